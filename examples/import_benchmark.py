@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Startup latency benchmark
+
+Times 'import rawsocket.iothread' and building a BpfProgramFilter in fresh
+interpreters, with a cold and a warm BPF cache, and exits non-zero if the
+median warm start exceeds the given limit.
+
+    python examples/import_benchmark.py --runs 20 --max-ms 150
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+_CHILD = '''
+import sys, time, json
+start = time.perf_counter()
+from rawsocket.iothread import BpfProgramFilter
+imported = time.perf_counter()
+BpfProgramFilter(sys.argv[1])
+built = time.perf_counter()
+json.dump({'import': imported - start, 'filter': built - imported,
+           'pcapy': 'pcapy' in sys.modules, 'numpy': 'numpy' in sys.modules}, sys.stdout)
+'''
+
+
+def run_child(expression, env):
+    output = subprocess.check_output([sys.executable, '-c', _CHILD, expression], env=env)
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='rawsocket import time benchmark')
+    parser.add_argument('--runs', type=int, default=10, help='Interpreters to start per case')
+    parser.add_argument('--filter', default='vlan 1000 and ip src host 10.10.10.10',
+                        help='Filter expression to build')
+    parser.add_argument('--max-ms', type=float, default=None,
+                        help='Fail if the median warm start takes longer than this')
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, (root, env.get('PYTHONPATH'))))
+
+    with tempfile.TemporaryDirectory() as cache:
+        env['RAWSOCKET_BPF_CACHE'] = cache
+        run_child(args.filter, env)         # Populate the cache for the warm runs
+
+        results = {}
+        for case in ('cold', 'warm'):
+            runs = []
+            for _ in range(args.runs):
+                # A cold start gets an empty cache every time, a warm one reuses it
+                env['RAWSOCKET_BPF_CACHE'] = tempfile.mkdtemp(dir=cache) if case == 'cold' else cache
+                runs.append(run_child(args.filter, env))
+            results[case] = runs
+
+    for case, runs in results.items():
+        total = [1000.0 * (run['import'] + run['filter']) for run in runs]
+        print('{:5s} import {:7.2f} ms  filter {:7.2f} ms  total {:7.2f} ms (median of {})  '
+              'pcapy loaded: {}  numpy loaded: {}'.format(
+                  case,
+                  1000.0 * statistics.median(run['import'] for run in runs),
+                  1000.0 * statistics.median(run['filter'] for run in runs),
+                  statistics.median(total), len(runs),
+                  any(run['pcapy'] for run in runs), any(run['numpy'] for run in runs)))
+
+    warm = statistics.median(1000.0 * (run['import'] + run['filter']) for run in results['warm'])
+    if args.max_ms is not None and warm > args.max_ms:
+        print('FAIL: warm start {:.2f} ms exceeds {:.2f} ms'.format(warm, args.max_ms))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
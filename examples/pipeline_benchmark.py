@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Receive pipeline benchmark
+
+Sends frames on one port of each link and measures the rate at which the
+rx_callback of the other port sees them. The same code runs against
+simulated ports, which need no privileges, and real interfaces such as
+a veth pair:
+
+    python examples/pipeline_benchmark.py --backend sim --links sim0:sim1 --count 200000
+    sudo python examples/pipeline_benchmark.py --backend packet --links vt0:vt1
+"""
+import sys
+import time
+import argparse
+import threading
+
+from rawsocket.iothread import IOThread
+from rawsocket.ioport import IOPort
+from rawsocket.recorder import FlightRecorder
+
+FRAME = b'\xff' * 6 + b'\x02\x00\x00\x00\x00\x01' + b'\x88\xb5' + b'\x00' * 50
+
+
+def main():
+    parser = argparse.ArgumentParser(description='rawsocket receive pipeline benchmark')
+    parser.add_argument('--backend', default=IOPort.BACKEND_SIM,
+                        choices=(IOPort.BACKEND_SIM, IOPort.BACKEND_PACKET, IOPort.BACKEND_XDP))
+    parser.add_argument('--engine', default=IOThread.ENGINE_SELECT,
+                        choices=(IOThread.ENGINE_SELECT, IOThread.ENGINE_URING))
+    parser.add_argument('--links', nargs='+', default=['sim0:sim1'],
+                        help='rx:tx interface pairs, frames are sent on tx and received on rx')
+    parser.add_argument('--count', type=int, default=100000, help='Frames to send per link')
+    parser.add_argument('--rate', type=float, default=None, help='Frames per second per link')
+    parser.add_argument('--loss', type=float, default=0.0, help='Simulated link loss probability')
+    parser.add_argument('--work-us', type=float, default=0.0,
+                        help='Busy time of the rx_callback per frame in microseconds')
+    parser.add_argument('--recorder', type=int, default=0,
+                        help='Frames kept by a flight recorder on every port, 0 for none')
+    args = parser.parse_args()
+
+    links = [link.split(':') for link in args.links]
+    if args.backend == IOPort.BACKEND_SIM:
+        from rawsocket.simnet import default_network
+        for rx, tx in links:
+            default_network.link(rx, tx, loss=args.loss)
+
+    work = args.work_us / 1e6
+    received = {rx: 0 for rx, _ in links}
+
+    def callback(rx):
+        def rx_callback(_frame):
+            received[rx] += 1
+            if work:
+                end = time.perf_counter() + work
+                while time.perf_counter() < end:
+                    pass
+        return rx_callback
+
+    def recorder():
+        return FlightRecorder(frames=args.recorder) if args.recorder else None
+
+    io_thread = IOThread(engine=args.engine)
+    for rx, tx in links:
+        io_thread.open(rx, callback(rx), backend=args.backend, recorder=recorder())
+        io_thread.open(tx, None, backend=args.backend, queue_size=2, recorder=recorder())
+
+    def sender(tx):
+        start = time.perf_counter()
+        for sent in range(1, args.count + 1):
+            io_thread.send(tx, FRAME)
+            if args.rate:
+                delay = start + sent / args.rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+    time.sleep(0.2)
+    start = time.perf_counter()
+    senders = [threading.Thread(target=sender, args=(tx,)) for _, tx in links]
+    for thread in senders:
+        thread.start()
+    for thread in senders:
+        thread.join()
+
+    # Wait until the receivers go quiet
+    total = -1
+    while total != sum(received.values()):
+        total = sum(received.values())
+        time.sleep(0.1)
+    elapsed = time.perf_counter() - start - 0.1
+
+    print('backend {}  engine {}  flight recorder {}'.format(
+        args.backend, io_thread.thread_statistics()['engine'], args.recorder or 'off'))
+    for rx, tx in links:
+        stats = io_thread.statistics(rx)
+        print('{:>8s} <- {:8s} received {:9d}/{:d}  {:10.0f} frames/s  kernel drops {}'.format(
+            rx, tx, received[rx], args.count, received[rx] / elapsed,
+            stats.get('rx_kernel_drops')))
+    print('total {:.0f} frames/s'.format(sum(received.values()) / elapsed))
+
+    io_thread.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Receive thread scaling benchmark
+
+Runs the same receive load with an IOThread of 1, 2 ... N receive threads
+and reports how the frame rate scales. The rx_callback does some busy work
+per frame, so with the GIL the rate stays flat while a free-threaded
+interpreter (python3.13t and later) should scale with the thread count.
+
+Simulated ports need no privileges, one link per receive thread:
+
+    python examples/scaling_benchmark.py --threads 4 --count 50000
+
+With --fanout the frames of one real interface are spread round robin over a
+PACKET_FANOUT group with a member per receive thread, the frames being sent on --tx:
+
+    sudo python examples/scaling_benchmark.py --threads 4 --fanout vt1 --tx vt0
+"""
+import sys
+import time
+import argparse
+import threading
+
+from rawsocket.iothread import IOThread
+from rawsocket.ioport import IOPort
+from rawsocket.util import FREE_THREADED, PACKET_FANOUT_LB
+
+FRAME = b'\xff' * 6 + b'\x02\x00\x00\x00\x00\x01' + b'\x88\xb5' + b'\x00' * 50
+
+
+def run(threads, args):
+    received = dict()       # receive thread ident -> frames, each written by one thread only
+    work = args.work_us / 1e6
+
+    def rx_callback(_frame):
+        ident = threading.get_ident()
+        received[ident] = received.get(ident, 0) + 1
+        if work:
+            end = time.perf_counter() + work
+            while time.perf_counter() < end:
+                pass
+
+    io_thread = IOThread(receive_threads=threads)
+
+    if args.fanout:
+        io_thread.open(args.fanout, rx_callback, fanout=threads, fanout_mode=PACKET_FANOUT_LB,
+                       rcvbuf=args.count * 2048)
+        io_thread.open(args.tx, None, group='tx', queue_size=2)
+        links = [(args.fanout, args.tx)]
+    else:
+        from rawsocket.simnet import SimNetwork
+        network = SimNetwork()
+        links = [('sim{}'.format(2 * i), 'sim{}'.format(2 * i + 1)) for i in range(threads)]
+        for rx, tx in links:
+            network.link(rx, tx)
+            io_thread.open(rx, rx_callback, backend=IOPort.BACKEND_SIM, network=network,
+                           sim_queue_size=args.count)       # Hold the whole run, no drops
+        for _, tx in links:
+            io_thread.open(tx, None, group='tx', backend=IOPort.BACKEND_SIM, network=network,
+                           queue_size=2)
+
+    count = args.count if args.fanout else args.count // threads
+
+    def sender(tx):
+        for _ in range(count):
+            io_thread.send(tx, FRAME)
+
+    time.sleep(0.2)
+    start = time.perf_counter()
+    senders = [threading.Thread(target=sender, args=(tx,)) for _, tx in links]
+    for thread in senders:
+        thread.start()
+    for thread in senders:
+        thread.join()
+
+    # Wait until the receivers go quiet
+    total = -1
+    while total != sum(received.values()):
+        total = sum(received.values())
+        time.sleep(0.1)
+    elapsed = time.perf_counter() - start - 0.1
+
+    io_thread.stop()
+    return total, elapsed, len(received)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='rawsocket receive thread scaling benchmark')
+    parser.add_argument('--threads', type=int, default=4, help='Maximum number of receive threads')
+    parser.add_argument('--count', type=int, default=50000, help='Frames to send per run')
+    parser.add_argument('--work-us', type=float, default=20.0,
+                        help='Busy time of the rx_callback per frame in microseconds')
+    parser.add_argument('--fanout', default=None,
+                        help='Receive on this interface with a PACKET_FANOUT group (root)')
+    parser.add_argument('--tx', default=None, help='Interface to send on with --fanout')
+    args = parser.parse_args()
+
+    if args.fanout and not args.tx:
+        parser.error('--fanout needs --tx')
+
+    gil = sys._is_gil_enabled() if hasattr(sys, '_is_gil_enabled') else True
+    print('python {}  GIL {}  free-threaded {}'.format(sys.version.split()[0],
+                                                        'enabled' if gil else 'disabled',
+                                                        FREE_THREADED))
+    baseline = None
+    for threads in range(1, args.threads + 1):
+        total, elapsed, active = run(threads, args)
+        rate = total / elapsed
+        baseline = baseline or rate
+        print('{:2d} receive threads ({} active)  received {:8d}  {:10.0f} frames/s  x{:.2f}'.format(
+            threads, active, total, rate, rate / baseline))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
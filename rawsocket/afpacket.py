@@ -18,15 +18,34 @@ When VLAN offload is enabled on the NIC Linux will not deliver the VLAN tag
 in the data returned by recv. Instead, it delivers the VLAN TCI in a control
 message. Python 2.x doesn't have built-in support for recvmsg, so we have to
 use ctypes to call it. The recv function exported by this module reconstructs
-the VLAN tag if it was offloaded.
+the VLAN tag if it was offloaded. PacketReceiver does the same with buffers
+allocated once per socket, and strips the virtio_net_hdr when PACKET_VNET_HDR
+is enabled. ErrorQueueReader reads transmit error reports, such as missed
+SO_TXTIME deadlines, from the socket error queue.
 """
 
+import os
+import errno
 import struct
+from time import perf_counter_ns
+from ctypes import *
+from .vnet import VirtioNetHdr, VNET_HDR_SIZE
 
 ETH_P_8021Q = 0x8100
 SOL_PACKET = 263
 PACKET_AUXDATA = 8
+PACKET_VNET_HDR = 15
+VLAN_TAG_SIZE = 4
 TP_STATUS_VLAN_VALID = 1 << 4
+PACKET_OUTGOING = 4
+MSG_DONTWAIT = 0x40
+MSG_ERRQUEUE = 0x2000
+PACKET_TX_TIMESTAMP = 16
+
+# From linux/errqueue.h
+SO_EE_ORIGIN_TXTIME = 6
+SO_EE_CODE_TXTIME_INVALID_PARAM = 1
+SO_EE_CODE_TXTIME_MISSED = 2
 
 
 class struct_iovec(Structure):
@@ -56,6 +75,30 @@ class struct_cmsghdr(Structure):
     ]
 
 
+class struct_sock_extended_err(Structure):
+    _fields_ = [
+        ("ee_errno", c_uint32),
+        ("ee_origin", c_uint8),
+        ("ee_type", c_uint8),
+        ("ee_code", c_uint8),
+        ("ee_pad", c_uint8),
+        ("ee_info", c_uint32),
+        ("ee_data", c_uint32),
+    ]
+
+
+class struct_sockaddr_ll(Structure):
+    _fields_ = [
+        ("sll_family", c_ushort),
+        ("sll_protocol", c_ushort),
+        ("sll_ifindex", c_int),
+        ("sll_hatype", c_ushort),
+        ("sll_pkttype", c_ubyte),
+        ("sll_halen", c_ubyte),
+        ("sll_addr", c_ubyte * 8),
+    ]
+
+
 class struct_tpacket_auxdata(Structure):
     _fields_ = [
         ("tp_status", c_uint),
@@ -68,11 +111,48 @@ class struct_tpacket_auxdata(Structure):
     ]
 
 
-libc = CDLL("libc.so.6")
+libc = CDLL("libc.so.6", use_errno=True)
 recvmsg = libc.recvmsg
 recvmsg.argtypes = [c_int, POINTER(struct_msghdr), c_int]
 recvmsg.retype = c_int
 
+sendto = libc.sendto
+sendto.argtypes = [c_int, c_char_p, c_size_t, c_int, c_void_p, c_uint32]
+sendto.restype = c_ssize_t
+
+bind = libc.bind
+bind.argtypes = [c_int, c_void_p, c_uint32]
+bind.restype = c_int
+
+AF_PACKET = 17
+ETH_P_ALL = 0x0003
+
+
+def sockaddr_ll(ifindex, protocol=ETH_P_ALL):
+    """
+    Build a struct sockaddr_ll
+
+    @ifindex Interface index, 0 for all interfaces
+    @protocol Ethernet protocol in host byte order
+    """
+    addr = struct_sockaddr_ll()
+    addr.sll_family = AF_PACKET
+    addr.sll_protocol = ((protocol & 0xff) << 8) | (protocol >> 8)      # htons
+    addr.sll_ifindex = ifindex
+    return addr
+
+
+def bind_all(sk, protocol=ETH_P_ALL):
+    """
+    Bind an AF_PACKET socket to receive from every interface
+
+    Python's bind() needs an interface name, this binds to ifindex 0.
+    """
+    addr = sockaddr_ll(0, protocol)
+    if bind(sk.fileno(), byref(addr), sizeof(addr)) < 0:
+        err = get_errno()
+        raise OSError(err, os.strerror(err))
+
 
 def enable_auxdata(sk):
     """
@@ -83,48 +163,230 @@ def enable_auxdata(sk):
     sk.setsockopt(SOL_PACKET, PACKET_AUXDATA, 1)
 
 
-def recv(sk, bufsize):
+def enable_vnet_hdr(sk):
+    """
+    Ask the kernel to prefix each frame with a struct virtio_net_hdr
+
+    Received frames may then be GRO coalesced super-frames and transmitted
+    frames must carry a header, which allows GSO. Must be called before bind.
+    """
+    sk.setsockopt(SOL_PACKET, PACKET_VNET_HDR, 1)
+
+
+class PacketReceiver(object):
+    """
+    Receive packets from an AF_PACKET socket with preallocated buffers
+
+    After each recv the virtio_net_hdr of the frame, if enabled, is available
+    as the vnet_hdr attribute.
+
+    With sockaddr enabled, the packet type (PACKET_HOST ... PACKET_OUTGOING)
+    and interface index of each frame are available as the pkttype and
+    ifindex attributes.
+
+    The original length of each frame, before any truncation by the receive
+    buffer or a BPF program, is available as the wire_len attribute.
+
+    If marks is set to a list, each recv appends ('recvmsg', ns) after the
+    system call and ('vlan', ns) once the frame is built, with ns from
+    time.perf_counter_ns(). See rawsocket.trace.
+    """
+    def __init__(self, sk, bufsize, vnet_hdr=False, sockaddr=False):
+        """
+        @sk Socket
+        @bufsize Maximum packet size, not including any virtio_net_hdr
+        @vnet_hdr True if PACKET_VNET_HDR is enabled on the socket
+        @sockaddr True to receive the sockaddr_ll of each frame
+        """
+        self._fileno = sk.fileno()
+        self._hdr_size = VNET_HDR_SIZE if vnet_hdr else 0
+        self.vnet_hdr = None
+        self.wire_len = None
+        self.marks = None
+
+        self._bufsize = bufsize + self._hdr_size
+        self._buf = create_string_buffer(self._bufsize)
+
+        self._ctrl_bufsize = sizeof(struct_cmsghdr) + sizeof(struct_tpacket_auxdata) + sizeof(c_size_t)
+        self._ctrl_buf = create_string_buffer(self._ctrl_bufsize)
+
+        self._iov = struct_iovec()
+        self._iov.iov_base = cast(self._buf, c_void_p)
+        self._iov.iov_len = self._bufsize
+
+        self.pkttype = None
+        self.ifindex = None
+        self._sockaddr = struct_sockaddr_ll() if sockaddr else None
+
+        self._msghdr = struct_msghdr()
+        self._msghdr.msg_name = cast(byref(self._sockaddr), c_void_p) if sockaddr else None
+        self._msghdr.msg_namelen = 0
+        self._msghdr.msg_iov = pointer(self._iov)
+        self._msghdr.msg_iovlen = 1
+        self._msghdr.msg_control = cast(self._ctrl_buf, c_void_p)
+        self._msghdr_ref = byref(self._msghdr)
+
+        self._cmsghdr = struct_cmsghdr.from_buffer(self._ctrl_buf) # pylint: disable=E1101
+        self._auxdata = struct_tpacket_auxdata.from_buffer(self._ctrl_buf, sizeof(struct_cmsghdr)) # pylint: disable=E1101
+
+    def recv(self, flags=0):
+        """
+        Receive a packet
+        @flags recvmsg flags, MSG_DONTWAIT for a non-blocking receive
+
+        Raises BlockingIOError if the receive would block
+        """
+        msghdr = self._msghdr
+        msghdr.msg_controllen = self._ctrl_bufsize
+        msghdr.msg_flags = 0
+        sockaddr = self._sockaddr
+        if sockaddr is not None:
+            msghdr.msg_namelen = sizeof(struct_sockaddr_ll)
+
+        rv = recvmsg(self._fileno, self._msghdr_ref, flags)
+        marks = self.marks
+        if marks is not None:
+            marks.append(('recvmsg', perf_counter_ns()))
+
+        if rv < 0:
+            err = get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise BlockingIOError(err, os.strerror(err))
+            raise RuntimeError("recvmsg failed: rv=%d", rv)
+
+        # The kernel only delivers control messages we ask for. We
+        # only enabled PACKET_AUXDATA, so we can assume it's the
+        # only control message.
+        assert msghdr.msg_controllen >= sizeof(struct_cmsghdr)
+
+        cmsghdr = self._cmsghdr
+        assert cmsghdr.cmsg_level == SOL_PACKET
+        assert cmsghdr.cmsg_type == PACKET_AUXDATA
+
+        if sockaddr is not None:
+            self.pkttype = sockaddr.sll_pkttype
+            self.ifindex = sockaddr.sll_ifindex
+
+        auxdata = self._auxdata
+        buf = self._buf
+        hdr = self._hdr_size
+        vlan_valid = auxdata.tp_vlan_tci != 0 or auxdata.tp_status & TP_STATUS_VLAN_VALID
+
+        if hdr:
+            self.vnet_hdr = VirtioNetHdr.unpack(buf[:hdr])
+            if vlan_valid:
+                self.vnet_hdr = self.vnet_hdr.shifted(VLAN_TAG_SIZE)
+
+        if vlan_valid:
+            # Insert VLAN tag
+            tag = struct.pack("!HH", ETH_P_8021Q, auxdata.tp_vlan_tci)
+            frame = buf[hdr:hdr + 12] + tag + buf[hdr + 12:rv]
+            self.wire_len = auxdata.tp_len + VLAN_TAG_SIZE
+        else:
+            frame = buf[hdr:rv]
+            self.wire_len = auxdata.tp_len
+
+        if marks is not None:
+            marks.append(('vlan', perf_counter_ns()))
+        return frame
+
+
+class ErrorQueueReader(object):
+    """
+    Read sock_extended_err reports from the error queue of an AF_PACKET socket
+
+    Python's recvmsg waits for the socket to become readable first if it has
+    a timeout, which an error queue read must not do.
+    """
+    def __init__(self, sk):
+        """
+        @sk Socket
+        """
+        self._fileno = sk.fileno()
+        self._buf = create_string_buffer(1)      # The frame itself is not needed
+
+        self._ctrl_bufsize = 256
+        self._ctrl_buf = create_string_buffer(self._ctrl_bufsize)
+
+        self._iov = struct_iovec()
+        self._iov.iov_base = cast(self._buf, c_void_p)
+        self._iov.iov_len = 1
+
+        self._msghdr = struct_msghdr()
+        self._msghdr.msg_iov = pointer(self._iov)
+        self._msghdr.msg_iovlen = 1
+        self._msghdr.msg_control = cast(self._ctrl_buf, c_void_p)
+        self._msghdr_ref = byref(self._msghdr)
+
+        self._cmsghdr = struct_cmsghdr.from_buffer(self._ctrl_buf) # pylint: disable=E1101
+        self._ee = struct_sock_extended_err.from_buffer(self._ctrl_buf, sizeof(struct_cmsghdr)) # pylint: disable=E1101
+
+    def read(self):
+        """
+        Take the oldest report from the error queue
+
+        Returns (ee_errno, ee_origin, ee_code, ee_info, ee_data), or None if the
+        queue is empty
+        """
+        msghdr = self._msghdr
+        msghdr.msg_controllen = self._ctrl_bufsize
+        msghdr.msg_flags = 0
+
+        rv = recvmsg(self._fileno, self._msghdr_ref, MSG_ERRQUEUE | MSG_DONTWAIT)
+        if rv < 0:
+            err = get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return None
+            raise OSError(err, os.strerror(err))
+
+        cmsghdr = self._cmsghdr
+        if msghdr.msg_controllen < sizeof(struct_cmsghdr) + sizeof(struct_sock_extended_err) or \
+                cmsghdr.cmsg_level != SOL_PACKET or cmsghdr.cmsg_type != PACKET_TX_TIMESTAMP:
+            return 0, 0, 0, 0, 0        # Not an extended error report
+
+        ee = self._ee
+        return ee.ee_errno, ee.ee_origin, ee.ee_code, ee.ee_info, ee.ee_data
+
+
+class PacketSender(object):
+    """
+    Send frames on one interface from an unbound AF_PACKET socket
+
+    The destination sockaddr_ll is built once, where socket.sendto would look
+    up the interface index by name on every call.
+    """
+    def __init__(self, sk, ifindex):
+        """
+        @sk Socket
+        @ifindex Index of the interface to send on
+        """
+        self._fileno = sk.fileno()
+        self._addr = sockaddr_ll(ifindex)
+        self._addr_ref = byref(self._addr)
+        self._addrlen = sizeof(self._addr)
+
+    def send(self, frame, flags=0):
+        """
+        Send a frame
+        @frame Frame (bytes)
+        @flags sendto flags
+
+        Returns the number of bytes sent, raises OSError on failure
+        """
+        rv = sendto(self._fileno, frame, len(frame), flags, self._addr_ref, self._addrlen)
+        if rv < 0:
+            err = get_errno()
+            raise OSError(err, os.strerror(err))
+        return rv
+
+
+def recv(sk, bufsize, flags=0):
     """
     Receive a packet from an AF_PACKET socket
     @sk Socket
     @bufsize Maximum packet size
+    @flags recvmsg flags, MSG_DONTWAIT for a non-blocking receive
+
+    Raises BlockingIOError if the receive would block
     """
-    buf = create_string_buffer(bufsize)
-
-    ctrl_bufsize = sizeof(struct_cmsghdr) + sizeof(struct_tpacket_auxdata) + sizeof(c_size_t)
-    ctrl_buf = create_string_buffer(ctrl_bufsize)
-
-    iov = struct_iovec()
-    iov.iov_base = cast(buf, c_void_p)
-    iov.iov_len = bufsize
-
-    msghdr = struct_msghdr()
-    msghdr.msg_name = None
-    msghdr.msg_namelen = 0
-    msghdr.msg_iov = pointer(iov)
-    msghdr.msg_iovlen = 1
-    msghdr.msg_control = cast(ctrl_buf, c_void_p)
-    msghdr.msg_controllen = ctrl_bufsize
-    msghdr.msg_flags = 0
-
-    rv = recvmsg(sk.fileno(), byref(msghdr), 0)
-    if rv < 0:
-        raise RuntimeError("recvmsg failed: rv=%d", rv)
-
-    # The kernel only delivers control messages we ask for. We
-    # only enabled PACKET_AUXDATA, so we can assume it's the
-    # only control message.
-    assert msghdr.msg_controllen >= sizeof(struct_cmsghdr)
-
-    cmsghdr = struct_cmsghdr.from_buffer(ctrl_buf) # pylint: disable=E1101
-    assert cmsghdr.cmsg_level == SOL_PACKET
-    assert cmsghdr.cmsg_type == PACKET_AUXDATA
-
-    auxdata = struct_tpacket_auxdata.from_buffer(ctrl_buf, sizeof(struct_cmsghdr)) # pylint: disable=E1101
-
-    if auxdata.tp_vlan_tci != 0 or auxdata.tp_status & TP_STATUS_VLAN_VALID:
-        # Insert VLAN tag
-        tag = struct.pack("!HH", ETH_P_8021Q, auxdata.tp_vlan_tci)
-        return buf.raw[:12] + tag + buf.raw[12:rv]
-    else:
-        return buf.raw[:rv]
+    return PacketReceiver(sk, bufsize).recv(flags)
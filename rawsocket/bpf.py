@@ -0,0 +1,670 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Classic BPF program support
+
+Programs are lists of (code, jt, jf, k) tuples as returned by
+BpfProgramFilter.get_bpf(). Jumps are relative and only go forward, so
+instructions can be prefixed to an existing program without relocating it.
+
+BpfProgram evaluates a program in user space, for example to validate a
+filter against captured traffic before it is deployed.
+"""
+import struct
+
+np = None               # NumPy, imported on first use by _numpy()
+_numpy_checked = False
+
+# Instruction classes, sizes and modes from linux/bpf_common.h
+BPF_LD = 0x00
+BPF_LDX = 0x01
+BPF_ST = 0x02
+BPF_STX = 0x03
+BPF_ALU = 0x04
+BPF_JMP = 0x05
+BPF_RET = 0x06
+BPF_MISC = 0x07
+
+BPF_W = 0x00
+BPF_H = 0x08
+BPF_B = 0x10
+
+BPF_IMM = 0x00
+BPF_ABS = 0x20
+BPF_IND = 0x40
+BPF_MEM = 0x60
+BPF_LEN = 0x80
+BPF_MSH = 0xa0
+
+BPF_ADD = 0x00
+BPF_SUB = 0x10
+BPF_MUL = 0x20
+BPF_DIV = 0x30
+BPF_OR = 0x40
+BPF_AND = 0x50
+BPF_LSH = 0x60
+BPF_RSH = 0x70
+BPF_NEG = 0x80
+BPF_MOD = 0x90
+BPF_XOR = 0xa0
+
+BPF_JA = 0x00
+BPF_JEQ = 0x10
+BPF_JGT = 0x20
+BPF_JGE = 0x30
+BPF_JSET = 0x40
+
+BPF_K = 0x00
+BPF_X = 0x08
+BPF_A = 0x10
+
+BPF_TAX = 0x00
+BPF_TXA = 0x80
+
+BPF_MEMWORDS = 16
+BPF_MAXINSNS = 4096
+
+# Ancillary data loads from linux/filter.h
+SKF_AD_OFF = -0x1000
+SKF_AD_PROTOCOL = 0
+SKF_AD_PKTTYPE = 4
+SKF_AD_IFINDEX = 8
+SKF_AD_RANDOM = 56
+
+# sll_pkttype values from linux/if_packet.h
+PACKET_HOST = 0
+PACKET_BROADCAST = 1
+PACKET_MULTICAST = 2
+PACKET_OTHERHOST = 3
+PACKET_OUTGOING = 4
+
+ACCEPT = 0x40000        # Return value accepting the whole frame
+
+ACCEPT_ALL = [(BPF_RET | BPF_K, 0, 0, ACCEPT)]
+
+
+def ancillary(offset):
+    """
+    Get the 'k' of an absolute load of kernel ancillary data
+
+    :param offset: (int) SKF_AD_* offset
+
+    :return: (int) unsigned 32-bit k value
+    """
+    return (SKF_AD_OFF + offset) & 0xffffffff
+
+
+def by_direction(program, outgoing):
+    """
+    Prefix a program so the kernel only passes frames in one direction to it
+
+    :param program:  (list) Program to filter for, None to accept all
+    :param outgoing: (bool) True to pass only frames transmitted on the interface,
+                            False to pass only received frames
+
+    :return: (list) new program
+    """
+    return [
+        (BPF_LD | BPF_W | BPF_ABS, 0, 0, ancillary(SKF_AD_PKTTYPE)),
+        (BPF_JMP | BPF_JEQ | BPF_K, 1, 0, PACKET_OUTGOING) if outgoing else
+        (BPF_JMP | BPF_JEQ | BPF_K, 0, 1, PACKET_OUTGOING),
+        (BPF_RET | BPF_K, 0, 0, 0),
+    ] + list(program or ACCEPT_ALL)
+
+
+def by_ifindex(program, ifindexes, leaf_size=16):
+    """
+    Prefix a program so the kernel only passes frames from a set of interfaces to it
+
+    The interface indexes are searched as a binary tree of comparisons with
+    small linear leaves, so a frame is checked in O(log n) instructions.
+    Conditional jumps are limited to 255 instructions, so longer jumps go
+    through BPF_JA.
+
+    :param program:   (list) Program to filter for, None to accept all
+    :param ifindexes: (iterable) Interface indexes to pass
+    :param leaf_size: (int) Indexes compared linearly at each leaf of the tree
+
+    :return: (list) new program, None if it would exceed BPF_MAXINSNS
+    """
+    values = sorted(set(ifindexes))
+    program = list(program or ACCEPT_ALL)
+    if not values:
+        return [(BPF_RET | BPF_K, 0, 0, 0)]
+
+    code = [[BPF_LD | BPF_W | BPF_ABS, 0, 0, ancillary(SKF_AD_IFINDEX)]]
+    labels = dict()
+
+    def build(chunk):
+        if len(chunk) <= leaf_size:
+            for position, value in enumerate(chunk):
+                code.append([BPF_JMP | BPF_JEQ | BPF_K, len(chunk) - position, 0, value])
+            code.append([BPF_JMP | BPF_JA, 0, 0, 'reject'])
+            code.append([BPF_JMP | BPF_JA, 0, 0, 'accept'])
+            return
+
+        middle = len(chunk) // 2
+        right = len(labels)
+        labels[right] = None
+        code.append([BPF_JMP | BPF_JGT | BPF_K, 0, 1, chunk[middle - 1]])
+        code.append([BPF_JMP | BPF_JA, 0, 0, right])
+        build(chunk[:middle])
+        labels[right] = len(code)
+        build(chunk[middle:])
+
+    build(values)
+    labels['reject'] = len(code)
+    code.append([BPF_RET | BPF_K, 0, 0, 0])
+    labels['accept'] = len(code)
+
+    if len(code) + len(program) > BPF_MAXINSNS:
+        return None
+
+    for pc, insn in enumerate(code):
+        if insn[0] == BPF_JMP | BPF_JA:
+            insn[3] = labels[insn[3]] - pc - 1
+
+    return [tuple(insn) for insn in code] + program
+
+
+def sampled(program, rate):
+    """
+    Prefix a program so the kernel only passes a random 1 in 'rate' frames to it
+
+    :param program: (list) Program to sample for, None to accept all
+    :param rate:    (int) Sampling rate, 1 passes every frame
+
+    :return: (list) new program
+    """
+    return [
+        (BPF_LD | BPF_W | BPF_ABS, 0, 0, ancillary(SKF_AD_RANDOM)),
+        (BPF_ALU | BPF_MOD | BPF_K, 0, 0, rate),
+        (BPF_JMP | BPF_JEQ | BPF_K, 1, 0, 0),
+        (BPF_RET | BPF_K, 0, 0, 0),
+    ] + list(program or ACCEPT_ALL)
+
+
+def snapped(program, snaplen):
+    """
+    Limit the length a program accepts, the kernel then truncates frames to
+    snaplen before queueing them
+
+    :param program: (list) Program to limit, None to accept all
+    :param snaplen: (int) Maximum octets of a frame to pass
+
+    :return: (list) new program
+    """
+    return [(code, jt, jf, min(k, snaplen)) if code == BPF_RET | BPF_K else (code, jt, jf, k)
+            for code, jt, jf, k in (program or ACCEPT_ALL)]
+
+
+class BpfProgram(object):
+    """
+    User space classic BPF evaluation
+
+    Runs a program the same way the kernel or libpcap would, either one frame
+    at a time through a program compiled into Python functions, or over a batch
+    of frames at once with NumPy when it is installed. Loads of kernel
+    ancillary data (SKF_AD_*) have no meaning outside the kernel and are
+    rejected.
+    """
+    NUMPY_MIN_BATCH = 1024      # Smaller batches are faster with the compiled program
+    NUMPY_CHUNK = 65536         # Frames evaluated per NumPy pass, bounds memory use
+
+    def __init__(self, program):
+        """
+        Class initializer
+
+        :param program: (list) BPF instructions as (code, jt, jf, k) tuples
+        """
+        self._program = [tuple(insn) for insn in program]
+        _validate(self._program)
+        self._run = _compile(self._program)
+
+    @property
+    def program(self):
+        return self._program
+
+    def __call__(self, frame, wire_len=None):
+        """
+        Run the program over one frame
+
+        :param frame:    (bytes) Frame, any buffer protocol object
+        :param wire_len: (int) Original length if frame was truncated on capture
+
+        :return: (int) program return value, 0 if the frame is rejected
+        """
+        return self._run(frame, len(frame) if wire_len is None else wire_len)
+
+    def filter_many(self, frames, wire_lens=None, use_numpy=None):
+        """
+        Run the program over a batch of frames
+
+        :param frames:    (list) Frames, any buffer protocol objects
+        :param wire_lens: (list) Original lengths of truncated frames, None if not truncated
+        :param use_numpy: (bool) Force (True) or prevent (False) NumPy evaluation, None to
+                                 use NumPy when available and the batch is large enough
+
+        :return: (list or numpy.ndarray) boolean mask, True where the frame passes
+        """
+        numpy = _numpy() if use_numpy is not False else None
+        if use_numpy is None:
+            use_numpy = numpy is not None and len(frames) >= self.NUMPY_MIN_BATCH
+
+        if use_numpy:
+            if numpy is None:
+                raise ImportError('NumPy is not installed')
+
+            chunk = self.NUMPY_CHUNK
+            masks = [_evaluate_numpy(self._program, frames[start:start + chunk],
+                                     None if wire_lens is None else wire_lens[start:start + chunk])
+                     for start in range(0, len(frames), chunk)]
+            return np.concatenate(masks) if masks else np.zeros(0, dtype=bool)
+
+        run = self._run
+        if wire_lens is None:
+            return [run(frame, len(frame)) != 0 for frame in frames]
+        return [run(frame, wire_len) != 0 for frame, wire_len in zip(frames, wire_lens)]
+
+    def filter_pcap(self, path, use_numpy=None):
+        """
+        Run the program over every frame of a capture file
+
+        :param path:      (str) pcap or pcapng file name
+        :param use_numpy: (bool) See filter_many
+
+        :return: (list or numpy.ndarray) boolean mask, one entry per captured frame
+        """
+        from rawsocket.pcapfile import open_capture
+
+        masks = []
+        chunk = self.NUMPY_CHUNK
+        with open_capture(path) as reader:
+            frames, wire_lens = [], []
+            for _timestamp, wire_len, frame in reader:
+                frames.append(frame)
+                wire_lens.append(wire_len)
+                if len(frames) == chunk:
+                    masks.append(self.filter_many(frames, wire_lens, use_numpy=use_numpy))
+                    frames, wire_lens = [], []
+
+            if frames:
+                masks.append(self.filter_many(frames, wire_lens, use_numpy=use_numpy))
+
+        if any(np is not None and isinstance(mask, np.ndarray) for mask in masks):
+            return np.concatenate([np.asarray(mask, dtype=bool) for mask in masks])
+        return [passed for mask in masks for passed in mask]
+
+
+def _numpy():
+    """Import NumPy when batch evaluation first needs it, it is slow to import"""
+    global np, _numpy_checked
+    if not _numpy_checked:
+        _numpy_checked = True
+        try:
+            import numpy as np
+
+        except ImportError:
+            pass        # Batch evaluation falls back to the compiled program
+    return np
+
+
+def _is_jump(code):
+    return code & 0x07 == BPF_JMP
+
+
+def _validate(program):
+    """Check a program the way the kernel's sk_chk_filter would, so evaluation cannot run away"""
+    count = len(program)
+    if not 0 < count <= BPF_MAXINSNS:
+        raise ValueError('Program must have 1 to {} instructions'.format(BPF_MAXINSNS))
+
+    for pc, (code, jt, jf, k) in enumerate(program):
+        cls = code & 0x07
+
+        if cls in (BPF_LD, BPF_LDX) and code & 0xe0 == BPF_ABS and k >= ancillary(0):
+            raise ValueError('Instruction {}: ancillary loads are only valid in the kernel'.format(pc))
+
+        if cls in (BPF_ST, BPF_STX) or (cls in (BPF_LD, BPF_LDX) and code & 0xe0 == BPF_MEM):
+            if k >= BPF_MEMWORDS:
+                raise ValueError('Instruction {}: invalid scratch memory slot {}'.format(pc, k))
+
+        if cls == BPF_ALU and code & 0xf0 in (BPF_DIV, BPF_MOD) and code & 0x08 == BPF_K and k == 0:
+            raise ValueError('Instruction {}: division by zero'.format(pc))
+
+        if cls == BPF_JMP:
+            targets = (k,) if code & 0xf0 == BPF_JA else (jt, jf)
+            if any(pc + 1 + offset >= count for offset in targets):
+                raise ValueError('Instruction {}: jump out of range'.format(pc))
+
+    if program[-1][0] & 0x07 != BPF_RET:
+        raise ValueError('Program must end with a return')
+
+
+_MASK = 0xffffffff
+
+_ALU_OPS = {
+    BPF_ADD: '({a} + {v}) & 0xffffffff',
+    BPF_SUB: '({a} - {v}) & 0xffffffff',
+    BPF_MUL: '({a} * {v}) & 0xffffffff',
+    BPF_DIV: '{a} // {v}',
+    BPF_MOD: '{a} % {v}',
+    BPF_OR: '{a} | {v}',
+    BPF_AND: '{a} & {v}',
+    BPF_LSH: '({a} << {v}) & 0xffffffff if {v} < 32 else 0',
+    BPF_RSH: '{a} >> {v}',
+    BPF_XOR: '{a} ^ {v}',
+}
+
+_JMP_OPS = {
+    BPF_JEQ: 'A == {v}',
+    BPF_JGT: 'A > {v}',
+    BPF_JGE: 'A >= {v}',
+    BPF_JSET: 'A & {v}',
+}
+
+_SIZES = {BPF_W: (4, '_W'), BPF_H: (2, '_H'), BPF_B: (1, None)}
+
+
+_MAX_NESTING = 32           # Conditional blocks inlined into one function, Python allows 100
+
+
+def _compile(program):
+    """
+    Compile a program into Python functions
+
+    Each basic block is compiled to straight Python. A block with a single
+    predecessor is inlined into it, as the body of an if statement for a
+    conditional jump, and any other block becomes a function of its own. A
+    function returns the program counter of the next block, or the complement
+    (~value) of the program's return value, and run() dispatches them through a
+    table indexed by program counter, so the call depth stays constant however
+    long the program is. A and X are passed between functions in a two element
+    list.
+
+    :return: (func) run(frame, wire_len) -> return value
+    """
+    count = len(program)
+    leaders = {0}
+    for pc, (code, jt, jf, k) in enumerate(program):
+        if _is_jump(code):
+            leaders.update((pc + 1 + k,) if code & 0xf0 == BPF_JA else (pc + 1 + jt, pc + 1 + jf))
+            leaders.add(pc + 1)
+        elif code & 0x07 == BPF_RET:
+            leaders.add(pc + 1)
+    leaders = sorted(leader for leader in leaders if leader < count)
+
+    blocks = {}                 # start -> (body lines, exit)
+    predecessors = dict.fromkeys(leaders, 0)
+    predecessors[0] = 1         # Entered from run()
+
+    for index, start in enumerate(leaders):
+        end = leaders[index + 1] if index + 1 < len(leaders) else count
+        body = []
+        exit = ('goto', end)
+
+        for pc in range(start, end):
+            code, jt, jf, k = program[pc]
+            cls = code & 0x07
+            mode = code & 0xe0
+            src = 'X' if code & 0x08 == BPF_X else str(k)
+
+            if cls in (BPF_LD, BPF_LDX):
+                reg = 'A' if cls == BPF_LD else 'X'
+                if mode == BPF_IMM:
+                    body.append('{} = {}'.format(reg, k))
+                elif mode == BPF_LEN:
+                    body.append('{} = W'.format(reg))
+                elif mode == BPF_MEM:
+                    body.append('{} = M[{}]'.format(reg, k))
+                elif mode == BPF_MSH:
+                    body.append('if {} >= B: return -1'.format(k))
+                    body.append('X = (P[{}] & 0xf) << 2'.format(k))
+                elif mode in (BPF_ABS, BPF_IND):
+                    size, unpack = _SIZES[code & 0x18]
+                    offset = str(k) if mode == BPF_ABS else '(X + {}) & 0xffffffff'.format(k)
+                    body.append('o = {}'.format(offset))
+                    body.append('if o + {} > B: return -1'.format(size))
+                    body.append('A = {}'.format('P[o]' if unpack is None else unpack + '(P, o)[0]'))
+                else:
+                    raise ValueError('Instruction {}: invalid load mode 0x{:02x}'.format(pc, code))
+
+            elif cls == BPF_ST:
+                body.append('M[{}] = A'.format(k))
+
+            elif cls == BPF_STX:
+                body.append('M[{}] = X'.format(k))
+
+            elif cls == BPF_ALU:
+                op = code & 0xf0
+                if op == BPF_NEG:
+                    body.append('A = -A & 0xffffffff')
+                elif op in _ALU_OPS:
+                    if src == 'X' and op in (BPF_DIV, BPF_MOD):
+                        body.append('if X == 0: return -1')
+                    body.append('A = ' + _ALU_OPS[op].format(a='A', v=src))
+                else:
+                    raise ValueError('Instruction {}: invalid ALU operation 0x{:02x}'.format(pc, code))
+
+            elif cls == BPF_JMP:
+                op = code & 0xf0
+                if op == BPF_JA:
+                    exit = ('goto', pc + 1 + k)
+                elif op in _JMP_OPS:
+                    exit = ('if', _JMP_OPS[op].format(v=src), pc + 1 + jt, pc + 1 + jf)
+                else:
+                    raise ValueError('Instruction {}: invalid jump 0x{:02x}'.format(pc, code))
+
+            elif cls == BPF_RET:
+                rval = code & 0x18
+                exit = ('return', 'A' if rval == BPF_A else 'X' if rval == BPF_X else str(k))
+
+            elif cls == BPF_MISC:
+                body.append('X = A' if code & 0xf8 == BPF_TAX else 'A = X')
+
+        blocks[start] = body, exit
+        for target in exit[2:] if exit[0] == 'if' else exit[1:] if exit[0] == 'goto' else ():
+            predecessors[target] += 1
+
+    functions = [0]
+    compiled = {0}
+
+    def branch(target, indent, nesting, out):
+        # Inline a block reached only from here, otherwise leave for its function
+        if predecessors[target] == 1 and nesting < _MAX_NESTING:
+            emit(target, indent, nesting, out)
+        else:
+            out.append((indent, None, target))
+            if target not in compiled:
+                compiled.add(target)
+                functions.append(target)
+
+    def emit(start, indent, nesting, out):
+        body, exit = blocks[start]
+        out.extend((indent, line, None) for line in body)
+        if exit[0] == 'return':
+            out.append((indent, 'return ~' + exit[1], None))
+        elif exit[0] == 'goto':
+            branch(exit[1], indent, nesting, out)
+        else:
+            out.append((indent, 'if {}:'.format(exit[1]), None))
+            branch(exit[2], indent + 1, nesting + 1, out)
+            branch(exit[3], indent, nesting + 1, out)
+
+    lines = []
+    for start in functions:             # Grows as blocks are left for functions of their own
+        out = []
+        emit(start, 1, 0, out)
+        text = ' '.join(line for _, line, _ in out if line is not None)
+        names = set(text.replace('(', ' ').replace(')', ' ').replace('[', ' ').split())
+        used = [reg for reg in ('A', 'X') if reg in names]
+        written = [reg for reg in used
+                   if any(line is not None and line.startswith(reg + ' =') for _, line, _ in out)]
+
+        # Registers are loaded only if used and stored only if changed when
+        # leaving for another function, a program return needs no store
+        store = '; '.join('R[{}] = {}'.format('AX'.index(reg), reg) for reg in written)
+        lines.append('def b{}(P, B, W, R, M):'.format(start))
+        if used:
+            lines.append('    {} = {}'.format(', '.join(used), 'R' if len(used) == 2
+                                              else 'R[{}]'.format('AX'.index(used[0]))))
+        for indent, line, target in out:
+            if line is None:
+                line = 'return {}'.format(target) if not store else \
+                    '{}; return {}'.format(store, target)
+            lines.append('    ' * indent + line)
+
+    lines.append('T = [None] * {}'.format(count))
+    lines.extend('T[{0}] = b{0}'.format(start) for start in functions)
+    lines.append('def run(P, W):')
+    lines.append('    B = len(P); R = [0, 0]; M = {}'.format(
+        '[0] * {}'.format(BPF_MEMWORDS) if any('M[' in line for line in lines) else 'None'))
+    lines.append('    pc = b0(P, B, W, R, M)')
+    lines.append('    while pc >= 0:')
+    lines.append('        pc = T[pc](P, B, W, R, M)')
+    lines.append('    return ~pc')
+
+    namespace = {'_W': struct.Struct('!I').unpack_from, '_H': struct.Struct('!H').unpack_from}
+    exec(compile('\n'.join(lines), '<bpf>', 'exec'), namespace)
+    return namespace['run']
+
+
+def _evaluate_numpy(program, frames, wire_lens=None):
+    """
+    Run a program over a batch of frames with NumPy
+
+    Every frame is at exactly one instruction at a time. Since jumps only go
+    forward, instructions are visited once in order and each one is applied to
+    the frames whose path reaches it, carrying a per-frame A, X and scratch
+    memory.
+
+    :return: (numpy.ndarray) boolean mask
+    """
+    count = len(frames)
+    lengths = np.fromiter(map(len, frames), dtype=np.int64, count=count)
+    wire = lengths if wire_lens is None else np.asarray(wire_lens, dtype=np.uint64)
+
+    # Frames are loaded from one packed buffer, padded so the loads of rejected
+    # frames can be computed without bounds checks and masked off afterwards
+    packed = np.frombuffer(b''.join(frames) + bytes(4), dtype=np.uint8)
+    starts = np.cumsum(lengths) - lengths
+
+    A = np.zeros(count, dtype=np.uint64)
+    X = np.zeros(count, dtype=np.uint64)
+    M = np.zeros((BPF_MEMWORDS, count), dtype=np.uint64)
+    result = np.zeros(count, dtype=np.uint64)
+    reach = [None] * len(program)
+    reach[0] = np.ones(count, dtype=bool)
+    mask = np.uint64(_MASK)
+
+    def arrive(target, where):
+        reach[target] = where if reach[target] is None else reach[target] | where
+
+    def load(offsets, size, active):
+        # Returns the loaded values and the frames that remain in bounds
+        offsets = offsets.astype(np.int64)
+        inside = active & (offsets >= 0) & (offsets + size <= lengths)
+        index = starts + np.where(inside, offsets, 0)
+        value = np.zeros(count, dtype=np.uint64)
+        for octet in range(size):
+            value = (value << np.uint64(8)) | packed[index + octet].astype(np.uint64)
+        return value, inside
+
+    for pc, (code, jt, jf, k) in enumerate(program):
+        active = reach[pc]
+        if active is None or not active.any():
+            continue
+
+        cls = code & 0x07
+        mode = code & 0xe0
+        kk = np.uint64(k)
+        src = X if code & 0x08 == BPF_X else kk
+
+        if cls in (BPF_LD, BPF_LDX):
+            if mode == BPF_IMM:
+                value = np.full(count, kk, dtype=np.uint64)
+            elif mode == BPF_LEN:
+                value = wire.astype(np.uint64)
+            elif mode == BPF_MEM:
+                value = M[k]
+            elif mode == BPF_MSH:
+                value, inside = load(np.full(count, k), 1, active)
+                value = (value & np.uint64(0xf)) << np.uint64(2)
+                active = inside
+            else:
+                size = _SIZES[code & 0x18][0]
+                offsets = np.full(count, k, dtype=np.uint64) if mode == BPF_ABS else (X + kk) & mask
+                value, inside = load(offsets, size, active)
+                active = inside             # Out of bounds frames are rejected with 0
+
+            if cls == BPF_LD and mode != BPF_MSH:
+                A = np.where(active, value, A)
+            else:
+                X = np.where(active, value, X)
+
+        elif cls in (BPF_ST, BPF_STX):
+            M[k] = np.where(active, A if cls == BPF_ST else X, M[k])
+
+        elif cls == BPF_ALU:
+            op = code & 0xf0
+            if op in (BPF_DIV, BPF_MOD):
+                divisor = np.broadcast_to(src, (count,))
+                active = active & (divisor != 0)        # Division by zero returns 0
+                divisor = np.where(divisor != 0, divisor, np.uint64(1))
+                value = A // divisor if op == BPF_DIV else A % divisor
+            elif op == BPF_NEG:
+                value = (np.uint64(0) - A) & mask
+            elif op == BPF_LSH:
+                shift = np.broadcast_to(src, (count,))
+                value = np.where(shift < 32, (A << np.minimum(shift, np.uint64(31))) & mask, 0)
+            elif op == BPF_RSH:
+                shift = np.broadcast_to(src, (count,))
+                value = np.where(shift < 32, A >> np.minimum(shift, np.uint64(31)), 0)
+            else:
+                value = {BPF_ADD: lambda: (A + src) & mask,
+                         BPF_SUB: lambda: (A - src) & mask,
+                         BPF_MUL: lambda: (A * src) & mask,
+                         BPF_OR: lambda: A | src,
+                         BPF_AND: lambda: A & src,
+                         BPF_XOR: lambda: A ^ src}[op]()
+            A = np.where(active, value.astype(np.uint64), A)
+
+        elif cls == BPF_JMP:
+            op = code & 0xf0
+            if op == BPF_JA:
+                arrive(pc + 1 + k, active)
+            else:
+                cond = {BPF_JEQ: lambda: A == src,
+                        BPF_JGT: lambda: A > src,
+                        BPF_JGE: lambda: A >= src,
+                        BPF_JSET: lambda: (A & src) != 0}[op]()
+                arrive(pc + 1 + jt, active & cond)
+                arrive(pc + 1 + jf, active & ~cond)
+            continue
+
+        elif cls == BPF_RET:
+            rval = code & 0x18
+            value = A if rval == BPF_A else X if rval == BPF_X else np.full(count, kk, dtype=np.uint64)
+            result = np.where(active, value, result)
+            continue
+
+        elif cls == BPF_MISC:
+            if code & 0xf8 == BPF_TAX:
+                X = np.where(active, A, X)
+            else:
+                A = np.where(active, X, A)
+
+        arrive(pc + 1, active)
+
+    return result != 0
@@ -0,0 +1,117 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+On-disk cache of compiled BPF programs
+
+Compiling a filter expression needs libpcap, which is slow to load. Compiled
+programs are stored by expression and link type so later processes can
+build the same filter without loading libpcap at all.
+
+The cache lives in $RAWSOCKET_BPF_CACHE, or $XDG_CACHE_HOME/rawsocket/bpf
+(~/.cache/rawsocket/bpf) when that is not set. Setting RAWSOCKET_BPF_CACHE
+to an empty string disables the cache.
+"""
+import os
+import zlib
+import struct
+
+_MAGIC = b'RSBPF\x01'
+_insn = struct.Struct('<HBBI')
+
+
+def cache_dir():
+    """
+    Get the cache directory
+
+    :return: (str) directory name, None if the cache is disabled
+    """
+    directory = os.environ.get('RAWSOCKET_BPF_CACHE')
+    if directory is not None:
+        return directory or None
+
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'rawsocket', 'bpf')
+
+
+def _path(directory, expression, linktype):
+    # The expression is stored in the entry too, so a CRC collision is only a cache miss
+    return os.path.join(directory, '{}-{:08x}'.format(linktype, zlib.crc32(expression.encode('utf-8'))))
+
+
+def load(expression, linktype):
+    """
+    Look up a compiled program
+
+    :param expression: (str) Filter expression
+    :param linktype:   (int) Link type the expression was compiled for
+
+    :return: (list) program as (code, jt, jf, k) tuples, None if not cached
+    """
+    directory = cache_dir()
+    if directory is None:
+        return None
+
+    try:
+        with open(_path(directory, expression, linktype), 'rb') as f:
+            data = f.read()
+
+    except OSError:
+        return None
+
+    # Layout is magic, expression length, expression, instructions
+    header = len(_MAGIC) + 4
+    if data[:len(_MAGIC)] != _MAGIC or len(data) < header:
+        return None
+
+    size = struct.unpack_from('<I', data, len(_MAGIC))[0]
+    if data[header:header + size] != expression.encode('utf-8'):
+        return None         # Hash collision or damaged entry
+
+    body = data[header + size:]
+    if not body or len(body) % _insn.size:
+        return None
+
+    return list(_insn.iter_unpack(body))
+
+
+def store(expression, linktype, program):
+    """
+    Save a compiled program, failures are ignored
+
+    :param expression: (str) Filter expression
+    :param linktype:   (int) Link type the expression was compiled for
+    :param program:    (list) program as (code, jt, jf, k) tuples
+    """
+    directory = cache_dir()
+    if directory is None:
+        return
+
+    encoded = expression.encode('utf-8')
+    data = _MAGIC + struct.pack('<I', len(encoded)) + encoded + \
+        b''.join(_insn.pack(*insn) for insn in program)
+
+    path = _path(directory, expression, linktype)
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)       # Atomic, so concurrent processes never read a partial entry
+
+    except OSError:
+        try:
+            os.unlink(tmp)
+
+        except OSError:
+            pass
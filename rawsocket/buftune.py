@@ -0,0 +1,133 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Adaptive socket receive buffer sizing
+
+A BufferTuner is given the kernel drop counter and receive queue occupancy of
+a port at regular intervals. It grows the receive buffer when the kernel
+drops frames and shrinks it again after a sustained period in which the
+queue stayed well below the buffer size.
+"""
+import time
+from collections import deque
+
+
+class BufferTuner(object):
+    """
+    Receive buffer auto-tuner for one port
+    """
+    def __init__(self, min_size=256 * 1024, max_size=64 * 1024 * 1024, interval=1.0,
+                 grow_factor=2, quiet_intervals=30, low_water=0.25, history=16):
+        """
+        Class initializer
+
+        :param min_size:        (int) Smallest receive buffer, in octets
+        :param max_size:        (int) Largest receive buffer, in octets
+        :param interval:        (float) Seconds between samples
+        :param grow_factor:     (int) Factor to grow or shrink the buffer by
+        :param quiet_intervals: (int) Consecutive intervals without drops and with the queue
+                                      below low_water of the buffer before shrinking
+        :param low_water:       (float) Fraction of the buffer the queue must stay below to shrink
+        :param history:         (int) Number of adjustments to remember
+        """
+        assert 0 < min_size <= max_size, 'Invalid buffer limits'
+        assert grow_factor > 1, 'grow_factor must be greater than one'
+
+        self._min_size = min_size
+        self._max_size = max_size
+        self._interval = interval
+        self._grow_factor = grow_factor
+        self._quiet_intervals = quiet_intervals
+        self._low_water = low_water
+
+        self._next_sample = 0.0
+        self._last_drops = None
+        self._quiet = 0
+        self._peak_queued = 0
+
+        self._grows = 0
+        self._shrinks = 0
+        self._adjustments = deque(maxlen=history)
+
+    @property
+    def min_size(self):
+        return self._min_size
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    def update(self, now, drops, queued, size):
+        """
+        Sample the port and decide whether the receive buffer should change
+
+        :param now:    (float) Current time.monotonic()
+        :param drops:  (int) Running total of frames dropped by the kernel
+        :param queued: (int) Octets currently queued on the socket, None if unknown
+        :param size:   (int) Current receive buffer size as requested (not doubled)
+
+        :return: (int) new buffer size to apply, or None to leave unchanged
+        """
+        if now < self._next_sample:
+            return None
+
+        self._next_sample = now + self._interval
+        last, self._last_drops = self._last_drops, drops
+        if last is None:
+            return None
+
+        if drops > last:
+            self._quiet = 0
+            self._peak_queued = 0
+            new_size = min(self._max_size, size * self._grow_factor)
+            return self._adjust(size, new_size, 'drops {}'.format(drops - last))
+
+        self._quiet += 1
+        self._peak_queued = max(self._peak_queued, queued or 0)
+
+        if self._quiet < self._quiet_intervals:
+            return None
+
+        # Kernel queue accounting includes skb overhead and counts against twice the
+        # requested size, so compare against the doubled value
+        peak, self._peak_queued, self._quiet = self._peak_queued, 0, 0
+        if peak < size * 2 * self._low_water:
+            new_size = max(self._min_size, size // self._grow_factor)
+            return self._adjust(size, new_size, 'peak queue {}'.format(peak))
+
+        return None
+
+    def _adjust(self, size, new_size, reason):
+        if new_size == size:
+            return None
+
+        if new_size > size:
+            self._grows += 1
+        else:
+            self._shrinks += 1
+
+        self._adjustments.append((time.time(), size, new_size, reason))
+        return new_size
+
+    def statistics(self):
+        """
+        Get tuner statistics
+
+        :return: (dict) statistics
+        """
+        return {
+            'rcvbuf_grows': self._grows,
+            'rcvbuf_shrinks': self._shrinks,
+            'rcvbuf_adjustments': list(self._adjustments),
+        }
@@ -0,0 +1,201 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Bounded traffic classification counters
+
+Counters are kept in Space-Saving tables (Metwally, Agrawal and El Abbadi,
+'Efficient Computation of Frequent and Top-k Elements in Data Streams'). Each
+table monitors at most 'capacity' keys. When a new key arrives at a full
+table it replaces the key with the lowest count and inherits that count,
+which is remembered as the new key's maximum over-estimation (error). Any key
+seen more than total/capacity times is guaranteed to be in the table.
+
+Counters are grouped into buckets by count so every update is O(1) no matter
+how many distinct keys are seen.
+"""
+
+_VLAN_TPIDS = (0x8100, 0x88a8)
+
+
+class SpaceSaving(object):
+    """
+    Fixed memory top-K frequency table
+    """
+    def __init__(self, capacity):
+        """
+        Class initializer
+
+        :param capacity: (int) Maximum number of keys monitored
+        """
+        assert capacity > 0, 'capacity must be positive'
+        self._capacity = capacity
+        self._entries = dict()      # key -> [count, error, octets]
+        self._buckets = dict()      # count -> dict of keys with that count (ordered set)
+        self._min = 0
+        self._evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def evictions(self):
+        return self._evictions
+
+    def update(self, key, octets=0):
+        """
+        Count one occurrence of a key
+
+        :param key:    (hashable) Key to count
+        :param octets: (int) Octets to add to the key's octet counter
+        """
+        entries = self._entries
+        buckets = self._buckets
+        entry = entries.get(key)
+
+        if entry is not None:
+            count = entry[0]
+            bucket = buckets[count]
+            del bucket[key]
+
+        elif len(entries) < self._capacity:
+            count = 0
+            entry = entries[key] = [0, 0, 0]
+
+        else:
+            # Replace a key with the minimum count
+            count = self._min
+            bucket = buckets[count]
+            victim = next(iter(bucket))
+            del bucket[victim]
+            del entries[victim]
+            self._evictions += 1
+            entry = entries[key] = [count, count, 0]
+
+        if count == 0:
+            self._min = 1
+
+        elif not bucket:
+            del buckets[count]
+            if count == self._min:
+                self._min = count + 1
+
+        count += 1
+        entry[0] = count
+        entry[2] += octets
+
+        bucket = buckets.get(count)
+        if bucket is None:
+            bucket = buckets[count] = dict()
+        bucket[key] = None
+
+    def top(self, n=10):
+        """
+        Get the most frequent keys
+
+        :param n: (int) Number of keys to return
+
+        :return: (list) of (key, count, octets, error) tuples, most frequent first
+        """
+        ordered = sorted(self._entries.items(), key=lambda item: item[1][0], reverse=True)
+        return [(key, count, octets, error) for key, (count, error, octets) in ordered[:n]]
+
+    def clear(self):
+        self._entries.clear()
+        self._buckets.clear()
+        self._min = 0
+
+
+class TrafficClassifier(object):
+    """
+    Per-port frame counters keyed by VLAN, ethertype and source MAC
+    """
+    def __init__(self, capacity=1024, vlan=True, ethertype=True, src_mac=True):
+        """
+        Class initializer
+
+        Memory use is bounded by the capacity of each enabled table regardless
+        of the number of distinct keys seen.
+
+        :param capacity:  (int) Maximum number of keys monitored per table
+        :param vlan:      (bool) Count by (outer VLAN, inner VLAN)
+        :param ethertype: (bool) Count by ethertype after any VLAN tags
+        :param src_mac:   (bool) Count by source MAC address
+        """
+        self._vlan = SpaceSaving(capacity) if vlan else None
+        self._ethertype = SpaceSaving(capacity) if ethertype else None
+        self._src_mac = SpaceSaving(capacity) if src_mac else None
+        self._frames = 0
+
+    def update(self, frame, wire_len=None):
+        """
+        Classify a received frame
+
+        :param frame:    (bytes) Ethernet frame
+        :param wire_len: (int) Original length if the frame was truncated, None if complete
+        """
+        length = len(frame)
+        if length < 14:
+            return
+
+        self._frames += 1
+        octets = length if wire_len is None else wire_len
+        etype = (frame[12] << 8) | frame[13]
+        outer = inner = None
+
+        if etype in _VLAN_TPIDS and length >= 18:
+            outer = ((frame[14] << 8) | frame[15]) & 0x0fff
+            etype = (frame[16] << 8) | frame[17]
+
+            if etype in _VLAN_TPIDS and length >= 22:
+                inner = ((frame[18] << 8) | frame[19]) & 0x0fff
+                etype = (frame[20] << 8) | frame[21]
+
+        if self._vlan is not None:
+            self._vlan.update((outer, inner), octets)
+
+        if self._ethertype is not None:
+            self._ethertype.update(etype, octets)
+
+        if self._src_mac is not None:
+            self._src_mac.update(bytes(frame[6:12]), octets)
+
+    def top(self, n=10):
+        """
+        Get the top-N lists of each table
+
+        :param n: (int) Number of entries per list
+
+        :return: (dict) table name -> list of dicts, most frequent first
+        """
+        tables = (('vlan', self._vlan, lambda key: key),
+                  ('ethertype', self._ethertype, lambda key: '0x{:04x}'.format(key)),
+                  ('src_mac', self._src_mac, lambda key: ':'.join('{:02x}'.format(b) for b in key)))
+
+        return {name: [{'key': fmt(key), 'frames': count, 'octets': octets, 'error': error}
+                       for key, count, octets, error in table.top(n)]
+                for name, table, fmt in tables if table is not None}
+
+    def statistics(self):
+        """
+        Get classifier statistics
+
+        :return: (dict) statistics
+        """
+        tables = (('vlan', self._vlan), ('ethertype', self._ethertype), ('src_mac', self._src_mac))
+        stats = {'classified_frames': self._frames}
+        for name, table in tables:
+            if table is not None:
+                stats['classifier_{}_keys'.format(name)] = len(table)
+                stats['classifier_{}_evictions'.format(name)] = table.evictions
+        return stats
@@ -14,24 +14,77 @@
 
 import os
 import sys
+import time
+import errno
 import socket
 from struct import pack
+from threading import Lock
 from binascii import hexlify
+from rawsocket.vnet import NO_VNET_HDR, VNET_HDR_SIZE, GSO_MAX_SIZE
+from rawsocket.txpool import TxSocketPool
+from rawsocket.util import FREE_THREADED
 
 _IOPort = None  # Set later based on O/S platform type
 
+ZERO_PAD = memoryview(bytes(64))    # Shared padding segment for short frames
+
+
+def frame_segments(frame):
+    """
+    Get the segments and length of a frame passed to IOPort.send
+
+    :param frame: (bytes) Frame as bytes, any buffer protocol object such as a bytearray,
+                          memoryview or NumPy array, or a tuple or list of them
+
+    :return: (tuple) sequence of segments and the frame length in octets
+    """
+    if isinstance(frame, bytes):
+        return (frame,), len(frame)
+
+    if not isinstance(frame, (tuple, list)):
+        frame = (frame,)
+    return frame, sum(len(seg) if isinstance(seg, bytes) else memoryview(seg).nbytes
+                      for seg in frame)
+
+
+def frame_bytes(frame):
+    """
+    Get a frame passed to IOPort.send as one bytes object, copying only if it is not one
+
+    :param frame: (bytes) Frame, buffer protocol object or sequence of them
+
+    :return: (bytes) frame
+    """
+    if isinstance(frame, bytes):
+        return frame
+    return b''.join(frame_segments(frame)[0])
+
 
 class IOPort(object):
     """
     Represents a network interface which we can send/receive raw Ethernet frames.
     """
     RCV_SIZE_DEFAULT = 4096
+    RCV_SIZE_VNET = GSO_MAX_SIZE + 64   # GRO super-frame plus L2 headers
     ETH_P_ALL = 0x03
     # RCV_TIMEOUT = 10
     RCV_TIMEOUT = 24 * 3600
     MIN_PKT_SIZE = 60
 
-    def __init__(self, iface_name, rx_callback, bpf_filter=None, verbose=False):
+    DIRECTION_INOUT = 'inout'       # Received frames and frames transmitted on the interface
+    DIRECTION_IN = 'in'             # Received frames only
+    DIRECTION_OUT = 'out'           # Frames transmitted on the interface only
+
+    BACKEND_PACKET = 'packet'       # AF_PACKET socket (pcap/scapy on Darwin)
+    BACKEND_XDP = 'xdp'             # AF_XDP socket, see rawsocket.xdp
+    BACKEND_SIM = 'sim'             # Virtual interface, see rawsocket.simnet
+    BACKEND_PCAP = 'pcap'           # Capture file replay, see rawsocket.pcapport
+
+    def __init__(self, iface_name, rx_callback, bpf_filter=None, verbose=False, busy_poll=0,
+                 vnet_hdr=False, rcvbuf=None, sndbuf=None, rcvbuf_tuner=None, classifier=None,
+                 overload=None, tracer=None, direction=DIRECTION_INOUT, qdisc_bypass=False,
+                 tx_pool=False, fanout_group=None, recorder=None, txtime=None,
+                 txtime_deadline=False, snaplen=None):
         """
         Class initializer
 
@@ -39,21 +92,98 @@ class IOPort(object):
         :param rx_callback: (func) Function to process received frames (bytes)
         :param bpf_filter:  (BpfProgramFilter) Berkley Packet Filter to filter Rx Frames
         :param verbose:     (bool) True if verbose, debug output, should be shown
+        :param busy_poll:   (int) Microseconds for the kernel to busy poll the device queue
+                                  on receive (SO_BUSY_POLL), zero to disable
+        :param vnet_hdr:    (bool) Enable PACKET_VNET_HDR. Received frames may then be GRO
+                                   super-frames and rx_callback is called as
+                                   rx_callback(frame, vnet_hdr). Transmitted frames may be
+                                   GSO super-frames of up to 64 KB, see rawsocket.vnet.
+        :param rcvbuf:      (int) Socket receive buffer size in octets, None for the system default
+        :param sndbuf:      (int) Socket send buffer size in octets, None for the system default
+        :param rcvbuf_tuner: (BufferTuner) Adjusts the receive buffer from observed kernel
+                                           drops and queue occupancy, None to disable
+        :param classifier:  (TrafficClassifier) Counts received frames by VLAN, ethertype
+                                                and source MAC, None to disable
+        :param overload:    (OverloadGuard) Rate cap, sampling and load shedding of frames
+                                            delivered to rx_callback, None to disable
+        :param tracer:      (Tracer) Profiling and tracing hooks, see set_tracer
+        :param direction:   (str) Frames to receive. DIRECTION_IN suppresses frames transmitted
+                                  on the interface by the host, such as by other ports, which
+                                  are otherwise looped back to the rx_callback
+        :param qdisc_bypass: (bool) Transmit directly to the device, bypassing the qdisc layer.
+                                    Frames are dropped when the device queue is full.
+        :param tx_pool:     (bool) Send on a send-only socket per sending thread with
+                                   per-thread counters, so concurrent senders do not contend.
+                                   AF_PACKET ports only, see rawsocket.txpool. As with any
+                                   other socket, frames sent on the pool are looped back to the
+                                   port's receive socket unless direction is DIRECTION_IN
+        :param fanout_group: (tuple) PACKET_FANOUT group ID and mode to join, see
+                                     IOThread.open(fanout=N). Linux only
+        :param recorder:    (FlightRecorder) Keeps the most recent frames received and sent
+                                             for dumping to pcap, None to disable. See
+                                             rawsocket.recorder
+        :param txtime:      (int) Enable send_at() with launch times on this clock, such as
+                                  time.CLOCK_TAI for the ETF qdisc or time.CLOCK_MONOTONIC
+                                  for fq. None to disable. AF_PACKET ports on Linux, other
+                                  backends raise ValueError
+        :param txtime_deadline: (bool) Let the ETF qdisc send frames early, their launch
+                                       time is then a deadline
+        :param snaplen:     (int) Receive only the first snaplen octets of each frame. The
+                                  kernel truncates frames through the BPF return value and
+                                  they are received into buffers of this size, while rx_octets
+                                  still counts their original length. A reconstructed VLAN
+                                  tag adds 4 octets. AF_PACKET ports on Linux, and simulated
+                                  and capture file ports. Shared socket and AF_XDP ports
+                                  raise ValueError
         """
+        assert direction in (self.DIRECTION_INOUT, self.DIRECTION_IN, self.DIRECTION_OUT), \
+            'Invalid direction {}'.format(direction)
+        assert txtime is None or not qdisc_bypass, 'txtime needs the qdisc, not qdisc_bypass'
+
         self._iface_name = iface_name
         self._mac_address = None
         self._filter = bpf_filter
         self._rx_callback = rx_callback
         self._verbose = verbose
+        self._busy_poll = busy_poll
+        self._vnet_hdr = vnet_hdr
+        self._rx_vnet_hdr = None
+        self._rcv_size = self.RCV_SIZE_VNET if vnet_hdr else self.RCV_SIZE_DEFAULT
+        self._snaplen = snaplen
+        self._rx_wire_len = None        # Original length of the received frame if truncated
+        if snaplen is not None:
+            assert snaplen > 0, 'snaplen must be positive'
+            self._rcv_size = snaplen
+        self._rcvbuf = rcvbuf
+        self._sndbuf = sndbuf
+        self._rcvbuf_tuner = rcvbuf_tuner
+        self._classifier = classifier
+        self._overload = overload
         self._must_pad = False
+        self._tracer = None
+        self._trace_marks = []
+        self._direction = direction
+        self._qdisc_bypass = qdisc_bypass
+        self._recorder = recorder
+        self._txtime = txtime
+        self._txtime_deadline = txtime_deadline
 
         # Statistics
         self._rx_frames = 0
         self._rx_octets = 0
         self._rx_discards = 0
+        self._rx_shed = 0
         self._tx_frames = 0
         self._tx_octets = 0
         self._tx_errors = 0
+        self._tx_txtime_missed = 0
+        self._tx_txtime_invalid = 0
+        self._fanout_group = fanout_group
+        if tx_pool:
+            self._tx_pool = TxSocketPool(self._open_tx_socket)
+        else:
+            # Without the GIL concurrent senders would lose counter updates
+            self._tx_pool = TxSocketPool(None) if FREE_THREADED else None
 
         # Open the raw socket
         try:
@@ -63,12 +193,57 @@ class IOPort(object):
             self._socket = None
             raise
 
+        if tracer is not None:
+            self.set_tracer(tracer)
+
     def __del__(self):
         self.close()
 
     @staticmethod
-    def create(iface_name, rx_callback, bpf_filter=None, verbose=False):
-        return _IOPort(iface_name, rx_callback, bpf_filter=bpf_filter, verbose=verbose)
+    def create(iface_name, rx_callback, bpf_filter=None, verbose=False, backend=None, **kwargs):
+        """
+        Create an IOPort for the current O/S platform
+
+        An AF_XDP port falls back to the platform port if the kernel, the interface
+        or the process privileges do not support it.
+
+        :param iface_name:  (str) Interface Name to open
+        :param rx_callback: (func) Function to process received frames (bytes)
+        :param bpf_filter:  (BpfProgramFilter) Berkley Packet Filter to filter Rx Frames
+        :param verbose:     (bool) True if verbose, debug output, should be shown
+        :param backend:     (str) BACKEND_XDP for AF_XDP, BACKEND_SIM for a simulated port,
+                                  BACKEND_PCAP to replay a capture file, None or
+                                  BACKEND_PACKET for the platform port
+        :param kwargs:      Additional port options passed to the IOPort initializer
+
+        :return: (IOPort) the opened port
+        """
+        if backend == IOPort.BACKEND_XDP:
+            xdp_options = {k: kwargs.pop(k) for k in ('queue_id', 'xdp_mode', 'num_frames')
+                           if k in kwargs}
+            try:
+                from rawsocket.xdp import XdpIOPort
+                return XdpIOPort(iface_name, rx_callback, bpf_filter=bpf_filter, verbose=verbose,
+                                 **dict(kwargs, **xdp_options))
+
+            except OSError as e:
+                if verbose:
+                    print('{}: AF_XDP not available ({}), using AF_PACKET'.format(iface_name, e))
+
+        elif backend == IOPort.BACKEND_SIM:
+            from rawsocket.simnet import SimIOPort
+            return SimIOPort(iface_name, rx_callback, bpf_filter=bpf_filter, verbose=verbose,
+                             **kwargs)
+
+        elif backend == IOPort.BACKEND_PCAP:
+            from rawsocket.pcapport import PcapIOPort
+            return PcapIOPort(iface_name, rx_callback, bpf_filter=bpf_filter, verbose=verbose,
+                              **kwargs)
+
+        elif backend not in (None, IOPort.BACKEND_PACKET):
+            raise ValueError('Unknown IOPort backend {}'.format(backend))
+
+        return _IOPort(iface_name, rx_callback, bpf_filter=bpf_filter, verbose=verbose, **kwargs)
 
     @property
     def name(self):
@@ -87,15 +262,53 @@ class IOPort(object):
         """
         return self._mac_address or self._get_mac_address()
 
+    @property
+    def tracer(self):
+        return self._tracer
+
+    @property
+    def recorder(self):
+        return self._recorder
+
+    def set_tracer(self, tracer):
+        """
+        Attach, replace or remove the port's tracer, safe while the port is running
+
+        :param tracer: (Tracer) Tracer for the rx and tx paths, None to disable tracing
+        """
+        if tracer is None:
+            self._tracer = None
+            self._enable_trace_marks(False)
+        else:
+            self._enable_trace_marks(True)
+            self._tracer = tracer
+
+    def _enable_trace_marks(self, enabled):
+        """
+        Start or stop the O/S specific receive path appending (stage, time.perf_counter_ns())
+        marks to self._trace_marks
+
+        :param enabled: (bool) True while a tracer is attached
+        """
+        pass
+
     def _open_socket(self):
         raise NotImplementedError('to be implemented by derived class')
 
-    def _rcv_frame(self):
+    def _rcv_frame(self, nonblocking=False):
         raise NotImplementedError('to be implemented by derived class')
 
     def _get_mac_address(self):
         raise NotImplementedError('to be implemented by derived class')
 
+    def _open_tx_socket(self):
+        """
+        Open a send-only socket for the transmit socket pool
+
+        :return: (socket) socket
+        """
+        raise NotImplementedError('tx_pool is not supported by {}'.format(type(self).__name__))
+
     def close(self):
         """
         Close the IO Port socket
@@ -103,6 +316,10 @@ class IOPort(object):
         self._rx_callback = None
         sock, self._socket = self._socket, None
 
+        pool = getattr(self, '_tx_pool', None)
+        if pool is not None:
+            pool.close()
+
         if sock is not None:
             try:
                 sock.close()
@@ -119,67 +336,334 @@ class IOPort(object):
         sock = self._socket
         return sock.fileno() if sock is not None else None
 
-    def recv(self):
-        """Called on the select thread when a packet arrives"""
+    def _multishot_socket(self):
+        """
+        Socket the io_uring engine of the IOThread may receive from with multishot
+        recvmsg, passing each frame to _deliver_received(). None if the port must
+        be serviced through recv().
+
+        :return: (socket) AF_PACKET socket or None
+        """
+        return None
+
+    def recv(self, nonblocking=False):
+        """
+        Called on the select thread when a packet arrives
+
+        :param nonblocking: (bool) If True, return immediately if no frame is waiting
+
+        :return: (bool) True if a frame was read from the port
+        """
+        tracer = self._tracer
+        if tracer is not None:
+            return self._recv_traced(tracer, nonblocking)
+
         try:
             # Get the frame from the O/S Specific Layer
-            frame = self._rcv_frame()
-            callback = self._rx_callback
+            self._process_frame(self._rcv_frame(nonblocking))
+            return True
 
-            if callback is None or frame is None:
-                self._rx_discards += 1
-
-            else:
-                self._rx_frames += 1
-                self._rx_octets += len(frame)
-                callback(frame)
+        except BlockingIOError:
+            return False
 
         except RuntimeError as _e:
             # we observed this happens sometimes right after the _socket was
             # attached to a newly created veth interface. So we log it, but
             # allow to continue.
+            return False
+
+    def _process_frame(self, frame):
+        """
+        Count, classify and deliver a received frame
+
+        :param frame: (bytes) Frame, None if the O/S layer discarded it
+        """
+        callback = self._rx_callback
+
+        if callback is None or frame is None:
+            self._rx_discards += 1
+
+        else:
+            wire_len = self._rx_wire_len
+            if self._classifier is not None:
+                self._classifier.update(frame, wire_len)
+
+            if self._recorder is not None:
+                self._recorder.rx(frame, wire_len)
+
+            if self._overload is not None:
+                self._deliver_guarded(callback, frame)
+                return
+
+            self._rx_frames += 1
+            self._rx_octets += wire_len if wire_len is not None else len(frame)
+            if self._vnet_hdr:
+                callback(frame, self._rx_vnet_hdr)
+            else:
+                callback(frame)
+
+    def _recv_traced(self, tracer, nonblocking):
+        """ recv() with stage timing, see rawsocket.trace """
+        clock = time.perf_counter_ns
+        marks = self._trace_marks
+        del marks[:]
+        start = clock()
+
+        try:
+            frame = self._rcv_frame(nonblocking)
+            if not marks:
+                marks.append(('recv', clock()))
+
+            self._process_traced(tracer, frame, start, marks)
+            return True
+
+        except BlockingIOError:
+            return False
+
+        except RuntimeError as _e:
+            return False
+
+    def _process_traced(self, tracer, frame, start, marks):
+        """ _process_frame() with the classify and callback stages marked """
+        clock = time.perf_counter_ns
+        callback = self._rx_callback
+        if callback is None or frame is None:
+            self._rx_discards += 1
+            tracer.record('rx', self._iface_name, start, marks)
             return
 
-    def send(self, frame):
+        wire_len = self._rx_wire_len
+        if self._classifier is not None:
+            self._classifier.update(frame, wire_len)
+        if self._recorder is not None:
+            self._recorder.rx(frame, wire_len)
+        marks.append(('classify', clock()))
+
+        if self._overload is not None:
+            self._deliver_guarded(callback, frame)
+
+        else:
+            self._rx_frames += 1
+            self._rx_octets += wire_len if wire_len is not None else len(frame)
+            if self._vnet_hdr:
+                callback(frame, self._rx_vnet_hdr)
+            else:
+                callback(frame)
+
+        marks.append(('callback', clock()))
+        tracer.record('rx', self._iface_name, start, marks, {'rawsocket.octets': len(frame)})
+
+    def _deliver_guarded(self, callback, frame):
+        guard = self._overload
+        if not guard.admit():
+            self._rx_shed += 1
+            return True
+
+        self._rx_frames += 1
+        wire_len = self._rx_wire_len
+        self._rx_octets += wire_len if wire_len is not None else len(frame)
+        start = time.perf_counter() if guard.timed else None
+        try:
+            if self._vnet_hdr:
+                callback(frame, self._rx_vnet_hdr)
+            else:
+                callback(frame)
+
+        finally:
+            if start is not None:
+                guard.record(time.perf_counter() - start)
+
+        return True
+
+    def send(self, frame, vnet_hdr=None):
         """
         Send a frame on the interface
 
-        :param frame: (bytes) Frame to send
+        The frame may be any buffer protocol object or a sequence of segments such
+        as (header, vlan_tag, payload), which are sent without joining them.
+
+        :param frame:    (bytes) Frame to send, buffer protocol object or sequence of them
+        :param vnet_hdr: (VirtioNetHdr) GSO/checksum offload metadata for the frame, only
+                                        valid if the port was opened with vnet_hdr. See
+                                        rawsocket.vnet.prepare_gso
 
         :return: (int) number of bytes sent, -1 on error
         """
-        sent_bytes = self._send_frame(frame)
+        if self._tx_pool is not None:
+            return self._send_pooled(frame, vnet_hdr)
+
+        length = len(frame) if isinstance(frame, bytes) else frame_segments(frame)[1]
+        tracer = self._tracer
+        if tracer is not None:
+            start = time.perf_counter_ns()
+            sent_bytes = self._send_frame(frame, vnet_hdr)
+            tracer.record('tx', self._iface_name, start, [('send', time.perf_counter_ns())],
+                          {'rawsocket.octets': length})
+        else:
+            sent_bytes = self._send_frame(frame, vnet_hdr)
 
-        if sent_bytes != len(frame):
+        if sent_bytes != length:
             self._tx_errors += 1
         else:
             self._tx_frames += 1
             self._tx_octets += sent_bytes
+            if self._recorder is not None:
+                self._recorder.tx(frame)
+
+        return sent_bytes
+
+    def _send_pooled(self, frame, vnet_hdr):
+        """ send() on the calling thread's socket of the transmit socket pool """
+        sender = self._tx_pool.sender()
+        length = len(frame) if isinstance(frame, bytes) else frame_segments(frame)[1]
+        tracer = self._tracer
+        if tracer is not None:
+            start = time.perf_counter_ns()
+
+        try:
+            if sender.socket is not None:
+                sent_bytes = self._send_frame(frame, vnet_hdr, sock=sender.socket)
+            else:
+                sent_bytes = self._send_frame(frame, vnet_hdr)
+
+        except Exception as _e:
+            sender.errors += 1
+            raise
+
+        if tracer is not None:
+            tracer.record('tx', self._iface_name, start, [('send', time.perf_counter_ns())],
+                          {'rawsocket.octets': length})
+
+        if sent_bytes != length:
+            sender.errors += 1
+        else:
+            sender.frames += 1
+            sender.octets += sent_bytes
+            if self._recorder is not None:
+                self._recorder.tx(frame)
+
+        return sent_bytes
+
+    def send_at(self, frame, launch_time):
+        """
+        Send a frame for the qdisc to transmit at a launch time
+
+        The port must be opened with txtime and the interface have an ETF or fq
+        qdisc, so frames are paced by the kernel rather than by sleeping before
+        send(). Frames that miss their launch time are dropped by the qdisc and
+        counted in the tx_txtime_missed statistic.
+
+        :param frame:       (bytes) Frame to send, buffer protocol object or sequence of them
+        :param launch_time: (int) Transmit time in nanoseconds on the txtime clock, see txtime_now
+
+        :return: (int) number of bytes queued, -1 on error
+        """
+        if self._txtime is None:
+            raise ValueError('Port {} not opened with txtime'.format(self._iface_name))
+
+        pool = self._tx_pool
+        sender = pool.sender() if pool is not None else None
+        length = len(frame) if isinstance(frame, bytes) else frame_segments(frame)[1]
+        sent_bytes = self._send_timed(frame, launch_time,
+                                      sock=sender.socket if sender is not None else None)
+
+        if sent_bytes != length:
+            if sender is not None:
+                sender.errors += 1
+            else:
+                self._tx_errors += 1
+
+        else:
+            if sender is not None:
+                sender.frames += 1
+                sender.octets += sent_bytes
+            else:
+                self._tx_frames += 1
+                self._tx_octets += sent_bytes
+            if self._recorder is not None:
+                self._recorder.tx(frame)
 
         return sent_bytes
 
+    def send_many_at(self, frames, launch_time, interval=0):
+        """
+        Send a batch of frames at a launch time, or spaced by an interval
+
+        :param frames:      (iterable) Frames, see send_at
+        :param launch_time: (int) Launch time of the first frame in nanoseconds
+        :param interval:    (int) Nanoseconds between the launch times of the frames
+
+        :return: (int) number of frames queued
+        """
+        queued = 0
+        for index, frame in enumerate(frames):
+            if self.send_at(frame, launch_time + index * interval) > 0:
+                queued += 1
+        return queued
+
+    def txtime_now(self):
+        """
+        Current time on the txtime clock of the port
+
+        :return: (int) nanoseconds
+        """
+        if self._txtime is None:
+            raise ValueError('Port {} not opened with txtime'.format(self._iface_name))
+        return time.clock_gettime_ns(self._txtime)
+
+    def _send_timed(self, frame, launch_time, sock=None):
+        raise NotImplementedError('txtime is not supported by {}'.format(type(self).__name__))
+
     def _pad_frame(self, frame):
-        padding = '\x00' * (self.MIN_PKT_SIZE - len(frame))
-        return frame + padding
+        frame = frame_bytes(frame)
+        return frame + ZERO_PAD[:self.MIN_PKT_SIZE - len(frame)]
 
-    def _send_frame(self, frame):
+    def _send_frame(self, frame, vnet_hdr=None, sock=None):
         if self._socket is None:
             return -1
 
-        if self._must_pad and len(frame) < self.MIN_PKT_SIZE:
-            frame = self._pad_frame(frame)
+        sock = sock or self._socket
+        segments, length = frame_segments(frame)
+
+        if self._vnet_hdr:
+            return self._send_segments(sock, segments, length, True,
+                                       vnet_hdr=vnet_hdr or NO_VNET_HDR)
+
+        elif vnet_hdr is not None:
+            raise ValueError('Port {} not opened with vnet_hdr'.format(self._iface_name))
 
         try:
-            return self._socket.send(frame)
+            return self._send_segments(sock, segments, length, self._must_pad)
 
         except socket.error as err:
-            import errno
-            if err.args[0] == errno.EINVAL:
-                if len(frame) < self.MIN_PKT_SIZE:
-                    self._must_pad = True
-                    return self._socket.send(self._pad_frame(frame))
-            else:
-                raise
+            if err.errno == errno.EINVAL and length < self.MIN_PKT_SIZE and not self._must_pad:
+                self._must_pad = True
+                return self._send_segments(sock, segments, length, True)
+            raise
+
+    def _send_segments(self, sock, segments, length, pad, vnet_hdr=None):
+        """
+        Send a frame as an iovec of its segments, a short frame is padded with a
+        shared zero segment rather than copied
+
+        :param sock:     (socket) Socket to send on
+        :param segments: (sequence) Buffer protocol objects making up the frame
+        :param length:   (int) Frame length
+        :param pad:      (bool) Pad the frame to MIN_PKT_SIZE
+        :param vnet_hdr: (VirtioNetHdr) Header to send ahead of the frame
+
+        :return: (int) octets of the frame sent, not counting a vnet_hdr or padding
+        """
+        if pad and length < self.MIN_PKT_SIZE:
+            segments = tuple(segments) + (ZERO_PAD[:self.MIN_PKT_SIZE - length],)
+
+        if vnet_hdr is not None:
+            sent_bytes = sock.sendmsg((vnet_hdr.pack(),) + tuple(segments)) - VNET_HDR_SIZE
+            return min(sent_bytes, length) if sent_bytes >= 0 else -1
+
+        if len(segments) == 1:
+            return sock.send(segments[0])
+        return min(sock.sendmsg(segments), length)
 
     def up(self):
         """
@@ -197,32 +681,90 @@ class IOPort(object):
         """
         raise NotImplementedError('to be implemented by derived class')
 
-    def statistics(self):
+    def tick(self, now):
+        """
+        Periodic housekeeping, called on the I/O thread about every IOThread.TICK_INTERVAL
+
+        :param now: (float) Current time.monotonic()
+        """
+        guard = self._overload
+        if guard is not None:
+            state = guard.evaluate(now)
+            if state is not None:
+                if self._verbose:
+                    print('{}: overload state {}'.format(self._iface_name, state))
+                self._overload_changed(state)
+
+        recorder = self._recorder
+        if recorder is not None:
+            path = recorder.tick(self._iface_name)
+            if path is not None and self._verbose:
+                print('{}: flight recorder dumped to {}'.format(self._iface_name, path))
+
+    def _overload_changed(self, state):
+        """
+        Called when the overload guard changes state
+
+        :param state: (str) new overload state
+        """
+        pass
+
+    def statistics(self, top_n=None):
         """
         Get rx/tx statistics for the port
 
+        :param top_n: (int) If the port has a classifier, include its top-N lists
+                            under 'top_talkers'
+
         :return: (dict) statistics
         """
-        return {
+        stats = {
             'rx_frames': self._rx_frames,
             'rx_octets': self._rx_octets,
             'rx_discards': self._rx_discards,
+            'rx_shed': self._rx_shed,
             'tx_frames': self._tx_frames,
             'tx_octets': self._tx_octets,
             'tx_errors': self._tx_errors,
         }
+        pool = self._tx_pool
+        if pool is not None:
+            frames, octets, errors, sockets = pool.statistics()
+            stats['tx_frames'] += frames
+            stats['tx_octets'] += octets
+            stats['tx_errors'] += errors
+            stats['tx_sockets'] = sockets
 
+        if self._overload is not None:
+            stats.update(self._overload.statistics())
+
+        if self._recorder is not None:
+            stats.update(self._recorder.statistics())
+
+        if self._txtime is not None:
+            stats['tx_txtime_missed'] = self._tx_txtime_missed
+            stats['tx_txtime_invalid'] = self._tx_txtime_invalid
+
+        classifier = self._classifier
+        if classifier is not None:
+            stats.update(classifier.statistics())
+            if top_n:
+                stats['top_talkers'] = classifier.top(top_n)
+        return stats
 
-if sys.platform == 'darwin':
-    # config is per https://scapy.readthedocs.io/en/latest/installation.html#mac-os-x
-    from scapy.config import conf
-    from scapy.arch import pcapdnet, BIOCIMMEDIATE
-    import pcapy
 
-    conf.use_pcap = True
+if sys.platform == 'darwin':
 
     class DarwinIOPort(IOPort):
         def _open_socket(self):
+            # scapy and pcapy are slow to import, so load them when the first port opens.
+            # config is per https://scapy.readthedocs.io/en/latest/installation.html#mac-os-x
+            from scapy.config import conf
+            from scapy.arch import pcapdnet, BIOCIMMEDIATE
+            import pcapy
+
+            conf.use_pcap = True
+
             # TODO: Allow parameters to be set by caller
             try:
                 # sin = pcapdnet.open_pcap(iface_name, 1600, 1, 100)
@@ -237,7 +779,7 @@ if sys.platform == 'darwin':
 
             return sin
 
-        def _rcv_frame(self):
+        def _rcv_frame(self, nonblocking=False):
             pkt = next(self._socket)
             if pkt is not None:
                 ts, pkt = pkt
@@ -259,45 +801,281 @@ if sys.platform == 'darwin':
 
 elif sys.platform.startswith('linux'):
 
-    from rawsocket.afpacket import enable_auxdata, recv
-    from rawsocket.util import set_promiscuous_mode
-    from ctypes import create_string_buffer, addressof
-
-    # As defined in asm/socket.h
-    SO_ATTACH_FILTER = 26
+    from rawsocket.afpacket import enable_auxdata, enable_vnet_hdr, PacketReceiver, MSG_DONTWAIT, \
+        ErrorQueueReader, SO_EE_ORIGIN_TXTIME, SO_EE_CODE_TXTIME_MISSED
+    from rawsocket.util import set_promiscuous_mode, set_busy_poll, set_socket_buffer, \
+        get_packet_statistics, get_socket_meminfo, attach_filter, detach_filter, \
+        set_ignore_outgoing, set_qdisc_bypass, set_fanout, set_txtime, SCM_TXTIME
+    from rawsocket.bpf import sampled, by_direction, snapped, PACKET_OUTGOING
+    from rawsocket.overload import STATE_SAMPLING
 
 
     class LinuxIOPort(IOPort):
         def _open_socket(self):
             try:
+                self._rx_kernel_packets = 0
+                self._rx_kernel_drops = 0
+                self._kernel_stats_lock = Lock()
+                self._rx_direction_suppressed = 0
+                self._errqueue = None
+
                 s = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
                 enable_auxdata(s)
 
-                if self._filter is not None:
-                    # Convert to byte code
-                    filters = b''
-                    tuple_list = self._filter.get_bpf()
-                    for (code, jt, jf, k) in tuple_list:
-                        data = pack('HBBI', code, jt, jf, k)
-                        filters += data
+                if self._rcvbuf_tuner is not None and self._rcvbuf is None:
+                    self._rcvbuf = self._rcvbuf_tuner.min_size
+
+                if self._rcvbuf is not None:
+                    set_socket_buffer(s, self._rcvbuf, receive=True)
 
-                    b = create_string_buffer(filters)
-                    mem_addr_of_filters = addressof(b)
-                    fprog = pack('HL', len(tuple_list), mem_addr_of_filters)
+                if self._sndbuf is not None:
+                    set_socket_buffer(s, self._sndbuf, receive=False)
 
-                    s.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+                if self._vnet_hdr:
+                    enable_vnet_hdr(s)
+
+                self._program = self._filter.get_bpf() if self._filter is not None else None
+                if self._snaplen is not None:
+                    self._program = snapped(self._program, self._snaplen)
+                self._direction_mode = self._apply_direction(s)
+                if self._program is not None and self._direction_mode != 'bpf':
+                    attach_filter(s, self._program)
+
+                if self._qdisc_bypass and not set_qdisc_bypass(s):
+                    self._qdisc_bypass = False
+                    if self._verbose:
+                        print('PACKET_QDISC_BYPASS not supported on {}'.format(self._iface_name))
+
+                if self._txtime is not None:
+                    set_txtime(s, self._txtime, self._txtime_deadline)
+                    self._errqueue = ErrorQueueReader(s)
 
                 s.bind((self._iface_name, self.ETH_P_ALL))
+                if self._fanout_group is not None:
+                    set_fanout(s, *self._fanout_group)
                 set_promiscuous_mode(s, self._iface_name, True)
                 s.settimeout(self.RCV_TIMEOUT)
 
+                if self._busy_poll and not set_busy_poll(s, self._busy_poll):
+                    if self._verbose:
+                        print('SO_BUSY_POLL not permitted on {}'.format(self._iface_name))
+
+                self._receiver = PacketReceiver(s, self._rcv_size, vnet_hdr=self._vnet_hdr,
+                                                sockaddr=self._direction_mode == 'user')
+                self._receiver.marks = self._trace_marks if self._tracer is not None else None
                 return s
 
             except Exception as _e:
                 raise       # here primarily for debugging / breakpoint purposes
 
-        def _rcv_frame(self):
-            return recv(self._socket, self.RCV_SIZE_DEFAULT)
+        def _apply_direction(self, s):
+            """
+            Set up direction control, preferring the kernel's PACKET_IGNORE_OUTGOING, then
+            a packet type check prefixed to the BPF program, then checking sll_pkttype
+            of each frame in user space
+
+            :return: (str) mode used, None if not filtering by direction
+            """
+            direction = self._direction
+            if direction == self.DIRECTION_INOUT:
+                return None
+
+            if direction == self.DIRECTION_IN and set_ignore_outgoing(s):
+                return 'ignore_outgoing'
+
+            program = by_direction(self._program, outgoing=direction == self.DIRECTION_OUT)
+            try:
+                attach_filter(s, program)
+                self._program = program
+                return 'bpf'
+
+            except OSError as _e:
+                return 'user'
+
+        def _rcv_frame(self, nonblocking=False):
+            receiver = self._receiver
+            flags = MSG_DONTWAIT if nonblocking else 0
+            try:
+                frame = receiver.recv(flags)
+
+            except BlockingIOError:
+                # A txtime error report makes the socket readable without a frame
+                if self._errqueue is not None:
+                    self._txtime_errors(self._errqueue)
+                raise
+
+            if self._direction_mode == 'user':
+                outgoing = self._direction == self.DIRECTION_OUT
+                while (receiver.pkttype == PACKET_OUTGOING) != outgoing:
+                    self._rx_direction_suppressed += 1
+                    # Raises BlockingIOError if only suppressed frames were waiting
+                    frame = receiver.recv(MSG_DONTWAIT)
+
+            self._rx_vnet_hdr = receiver.vnet_hdr
+            if self._snaplen is not None:
+                self._rx_wire_len = receiver.wire_len
+            return frame
+
+        def _open_tx_socket(self):
+            # Protocol 0 receives nothing, so the socket needs no filter or buffer
+            s = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+            try:
+                if self._vnet_hdr:
+                    enable_vnet_hdr(s)
+                if self._sndbuf is not None:
+                    set_socket_buffer(s, self._sndbuf, receive=False)
+                if self._qdisc_bypass:
+                    set_qdisc_bypass(s)
+                if self._txtime is not None:
+                    set_txtime(s, self._txtime, self._txtime_deadline)
+                s.bind((self._iface_name, 0))
+                return s
+
+            except Exception as _e:
+                s.close()
+                raise
+
+        def _multishot_socket(self):
+            # txtime error reports are read by recv()
+            return self._socket if not self._vnet_hdr and self._txtime is None else None
+
+        def _send_timed(self, frame, launch_time, sock=None):
+            sock = sock or self._socket
+            if sock is None:
+                return -1
+
+            segments, length = frame_segments(frame)
+            if length < self.MIN_PKT_SIZE and (self._must_pad or self._vnet_hdr):
+                segments = tuple(segments) + (ZERO_PAD[:self.MIN_PKT_SIZE - length],)
+
+            ancillary = [(socket.SOL_SOCKET, SCM_TXTIME, pack('Q', launch_time))]
+            if self._vnet_hdr:
+                sent_bytes = sock.sendmsg((NO_VNET_HDR.pack(),) + tuple(segments),
+                                          ancillary) - VNET_HDR_SIZE
+            else:
+                sent_bytes = sock.sendmsg(segments, ancillary)
+            return min(sent_bytes, length) if sent_bytes >= 0 else -1
+
+        def _txtime_errors(self, reader):
+            """ Count the missed and invalid launch times reported on a socket's error queue """
+            try:
+                report = reader.read()
+                while report is not None:
+                    _errno, origin, code, _info, _data = report
+                    if origin == SO_EE_ORIGIN_TXTIME:
+                        if code == SO_EE_CODE_TXTIME_MISSED:
+                            self._tx_txtime_missed += 1
+                        else:
+                            self._tx_txtime_invalid += 1
+                    report = reader.read()
+
+            except OSError as _e:
+                pass        # Socket closed
+
+        def _deliver_received(self, frame, pkttype, wire_len=None):
+            if self._direction_mode == 'user' and \
+                    (pkttype == PACKET_OUTGOING) != (self._direction == self.DIRECTION_OUT):
+                self._rx_direction_suppressed += 1
+                return
+
+            if self._snaplen is not None:
+                self._rx_wire_len = wire_len
+
+            tracer = self._tracer
+            if tracer is None:
+                self._process_frame(frame)
+            else:
+                # The kernel completed the recvmsg, the span starts at classification
+                marks = self._trace_marks
+                del marks[:]
+                self._process_traced(tracer, frame, time.perf_counter_ns(), marks)
+
+        def _enable_trace_marks(self, enabled):
+            receiver = getattr(self, '_receiver', None)
+            if receiver is not None:
+                receiver.marks = self._trace_marks if enabled else None
+
+        def _update_kernel_statistics(self):
+            """
+            Accumulate the kernel counters, which PACKET_STATISTICS resets on each
+            read. Called from user threads and the I/O thread alike
+
+            :return: (tuple) total packets and drops
+            """
+            with self._kernel_stats_lock:
+                sock = self._socket
+                if sock is not None:
+                    packets, drops = get_packet_statistics(sock)
+                    self._rx_kernel_packets += packets
+                    self._rx_kernel_drops += drops
+                return self._rx_kernel_packets, self._rx_kernel_drops
+
+        def _overload_changed(self, state):
+            guard = self._overload
+            sock = self._socket
+            if sock is None or not guard.kernel_sampling:
+                return
+
+            try:
+                if state == STATE_SAMPLING:
+                    attach_filter(sock, sampled(self._program, guard.sample_rate))
+                    guard.set_in_kernel(True)
+
+                elif guard.state != STATE_SAMPLING and self._program is not None:
+                    attach_filter(sock, self._program)
+                    guard.set_in_kernel(False)
+
+                else:
+                    detach_filter(sock)
+                    guard.set_in_kernel(False)
+
+            except OSError as _e:
+                guard.set_in_kernel(False)      # Sample in user space instead
+
+        def tick(self, now):
+            super(LinuxIOPort, self).tick(now)
+
+            if self._errqueue is not None:
+                self._txtime_errors(self._errqueue)
+                if self._tx_pool is not None:
+                    self._tx_pool.for_each_socket(
+                        lambda sock: self._txtime_errors(ErrorQueueReader(sock)))
+
+            tuner = self._rcvbuf_tuner
+            sock = self._socket
+            if tuner is None or sock is None:
+                return
+
+            _packets, drops = self._update_kernel_statistics()
+            meminfo = get_socket_meminfo(sock)
+            queued = meminfo[0] if meminfo is not None else None
+
+            size = tuner.update(now, drops, queued, self._rcvbuf)
+            if size is not None:
+                set_socket_buffer(sock, size, receive=True)
+                self._rcvbuf = size
+                if self._verbose:
+                    print('{}: receive buffer set to {}'.format(self._iface_name, size))
+
+        def statistics(self, top_n=None):
+            stats = super(LinuxIOPort, self).statistics(top_n=top_n)
+            sock = self._socket
+            if sock is not None:
+                stats['rcvbuf'] = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+                stats['sndbuf'] = sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+
+            stats['rx_kernel_packets'], stats['rx_kernel_drops'] = self._update_kernel_statistics()
+            stats['tx_qdisc_bypass'] = self._qdisc_bypass
+
+            if self._direction_mode is not None:
+                stats['rx_direction'] = self._direction
+                stats['rx_direction_mode'] = self._direction_mode
+                # Frames suppressed in the kernel are never seen, only user space suppression is counted
+                stats['rx_direction_suppressed'] = self._rx_direction_suppressed
+
+            if self._rcvbuf_tuner is not None:
+                stats.update(self._rcvbuf_tuner.statistics())
+            return stats
 
         def up(self):
             os.system('ip link set {} up'.format(self._iface_name))
@@ -13,25 +13,121 @@
 # limitations under the License.
 
 import os
+import time
+import errno
+import functools
+import itertools
 import socket
-import pcapy
 import fcntl
 import select
-from threading import Thread, Condition
-from .ioport import IOPort
+from collections import deque
+from threading import Thread, RLock
+from .ioport import IOPort, frame_bytes, frame_segments
+from .util import set_cpu_affinity, set_realtime_priority, FREE_THREADED, PACKET_FANOUT_HASH
+from .rxworker import ReceiveWorker
+from .shmring import SharedFrameRing, BACKPRESSURE_DROP
+from .rxqueue import ReceiveQueue, OVERFLOW_DROP_NEWEST
+from .transaction import TransactionLayer
+from .bpf import BpfProgram
+from .pcapfile import LINKTYPE_ETHERNET, open_capture
+from . import bpfcache
+
+
+_fanout_ids = itertools.count(os.getpid() * 16)    # PACKET_FANOUT group IDs, low 16 bits used
+
+# Port options holding state that the receive threads of fanout members would race on
+_FANOUT_UNSHARED = ('classifier', 'overload', 'rcvbuf_tuner', 'recorder')
+
+# Fanout member statistics that are not summed, the largest value is reported
+_FANOUT_MAXIMUM = ('rx_queue_capacity', 'rx_queue_high_water')
+
+
+def _locked(method):
+    """ Run an IOThread method with the port registration lock held """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
 
 
 class IOThread(Thread):
-    def __init__(self, verbose=False):
-        super(IOThread, self).__init__(name='IOThread')
+    TICK_INTERVAL = 1.0         # Seconds between IOPort.tick housekeeping calls
+
+    ENGINE_SELECT = 'select'    # select() and a receive per ready port
+    ENGINE_URING = 'io_uring'   # io_uring multishot receive, see rawsocket.uring
+
+    URING_ENTRIES = 256         # Submission queue entries of the io_uring engine
+    URING_BUFFERS = 1024        # Receive buffers shared by all ports of the io_uring engine
+
+    def __init__(self, verbose=False, busy_poll=0, cpus=None, sched_policy=None,
+                 sched_priority=None, name='IOThread', engine=ENGINE_SELECT, receive_threads=0,
+                 receive_cpus=None):
+        """
+        Class initializer
+
+        :param verbose:        (bool) True if verbose, debug output, should be shown
+        :param busy_poll:      (int) Busy poll budget in microseconds, zero to disable. When enabled,
+                                     SO_BUSY_POLL is requested on each opened port and, after select
+                                     reports a frame, the thread spins on non-blocking receives until
+                                     no frame has arrived for this long before it blocks again.
+        :param cpus:           (iterable) CPUs to pin the I/O thread to, None to let the scheduler decide
+        :param sched_policy:   (int) Scheduling policy for the I/O thread such as os.SCHED_FIFO or
+                                     os.SCHED_RR, None to leave unchanged
+        :param sched_priority: (int) Static priority for sched_policy, None for the policy minimum
+        :param name:           (str) Thread name
+        :param engine:         (str) ENGINE_SELECT, or ENGINE_URING to receive with io_uring
+                                     multishot recvmsg into a shared pool of provided buffers.
+                                     The select engine is used if io_uring is not available.
+                                     Busy polling only applies to the select engine.
+        :param receive_threads: (int) Service ports opened without a group on this many receive
+                                      threads, each port on the least loaded one, and fanout
+                                      members on one each. On a free-threaded interpreter the
+                                      threads and their rx_callbacks run in parallel.
+        :param receive_cpus:   (list) CPU for each receive thread, None to let the scheduler decide
+        """
+        super(IOThread, self).__init__(name=name)
         self._interface = None
         self._stopped = True
         self._verbose = verbose
         self._ports = dict()
         self._ports_modified = False
-        self._cvar = Condition()
         self._waker = _SelectWakerDescriptor()
 
+        # Scheduling
+        self._cpus = cpus
+        self._sched_policy = sched_policy
+        self._sched_priority = sched_priority
+        self._groups = dict()           # group name -> IOThread
+        self._port_groups = dict()      # interface -> IOThread for ports serviced by a group
+        self._workers = dict()          # interface -> ReceiveWorker process
+        self._queues = dict()           # interface -> ReceiveQueue of a pull-mode port, kept closed
+                                        # after the port closes so receive() can drain it
+        self._fanouts = dict()          # interface -> group IOThreads of its fanout members
+        self._lock = RLock()            # Port registration, taken by open/close and the run loop
+        self._receive_threads = receive_threads
+        self._receive_cpus = receive_cpus
+        self._shared = dict()           # name -> SharedPacketSocket
+
+        # Busy polling
+        self._busy_poll = busy_poll
+        self._spin_seconds = 0.0
+        self._spin_polls = 0
+        self._busy_rx_seconds = 0.0
+        self._busy_rx_polls = 0
+
+        self._tracer = None
+        self._transactions = None
+
+        self._engine = engine
+        self._engine_active = None
+        self._uring = None
+        self._uring_tokens = dict()     # user_data -> (kind, object, context)
+        self._uring_next = 1
+        self._uring_sends = deque()     # (port, frames) batches of send_many for the I/O thread
+        self._uring_batches = 0
+        self._uring_completions = 0
+
     def __del__(self):
         self._rx_callback = None
         self.stop()
@@ -41,21 +137,182 @@ class IOThread(Thread):
 
     @property
     def interfaces(self):
-        return [key for key, _ in self._ports]
+        return list(self._ports.keys()) + list(self._port_groups.keys()) + list(self._workers.keys())
 
     def port(self, interface):
+        thread = self._port_groups.get(interface)
+        if thread is not None:
+            return thread.port(interface)
+
         return self._ports.get(interface)
 
+    def _queue(self, interface):
+        thread = self._port_groups.get(interface)
+        if thread is not None:
+            return thread._queue(interface)
+
+        queue = self._queues.get(interface)
+        if queue is None:
+            if interface in self._ports:
+                raise ValueError('Interface {} is not open in pull mode'.format(interface))
+            raise ValueError('Interface {} was not opened'.format(interface))
+        return queue
+
+    @property
+    def tracer(self):
+        return self._tracer
+
+    def set_tracer(self, tracer):
+        """
+        Attach, replace or remove the tracer of this thread, its group threads and
+        all their ports. Ports opened later get the same tracer. Safe while running.
+
+        Ports in receive worker processes are not traced.
+
+        :param tracer: (Tracer) Tracer, None to disable tracing
+        """
+        self._tracer = tracer
+        for thread in self._groups.values():
+            thread.set_tracer(tracer)
+
+        for port in list(self._ports.values()):
+            port.set_tracer(tracer)
+
+    @property
+    def transactions(self):
+        """
+        Request/response transaction layer shared by this thread and its group threads,
+        created on first use. See request() and the response_key argument of open().
+
+        :return: (TransactionLayer) transaction layer
+        """
+        if self._transactions is None:
+            self._set_transactions(TransactionLayer(self, wakeup=self._notify))
+        return self._transactions
+
+    def _set_transactions(self, transactions):
+        self._transactions = transactions
+        for thread in self._groups.values():
+            thread._set_transactions(transactions)
+
+    def _notify(self):
+        waker = self._waker
+        if waker is not None:
+            waker.notify()
+
+        for thread in list(self._groups.values()):
+            thread._notify()
+
     @property
     def is_running(self):
         return not self._stopped and self.is_alive()
 
-    def open(self, iface, rx_callback, bpf_filter=None, verbose=False, keep_closed=False):
-        assert iface not in self._ports, 'Interface already Opened'
+    @_locked
+    def open(self, iface, rx_callback, bpf_filter=None, verbose=False, keep_closed=False,
+             group=None, cpus=None, sched_policy=None, sched_priority=None,
+             queue_size=ReceiveQueue.DEFAULT_SIZE, queue_overflow=OVERFLOW_DROP_NEWEST,
+             response_key=None, shared=None, fanout=None, fanout_mode=PACKET_FANOUT_HASH,
+             **port_options):
+        """
+        Open an interface and service it on this thread or on a group I/O thread
+
+        Ports opened with a group are serviced by a separate I/O thread for that
+        group. The group thread is created by the first open naming the group and
+        the cpus/sched_policy/sched_priority arguments only apply at that time.
+
+        Ports opened without an rx_callback are in pull mode. Received frames are
+        held in a bounded queue and read with receive() or receive_many().
+
+        Ports opened with a response_key complete the transactions started with
+        request(). Received frames that complete a transaction are not passed to
+        the rx_callback or queued.
+
+        Ports opened with the same shared name receive through one AF_PACKET socket
+        bound to all interfaces, see rawsocket.sharedsocket. Their bpf_filter is
+        evaluated in user space and socket level options (rcvbuf, sndbuf) are taken
+        from the first port opened on the shared socket. Linux only.
+
+        Ports opened with fanout are opened as that many sockets in a PACKET_FANOUT
+        group, each serviced by its own group thread (a receive thread if the
+        IOThread has them), so the interface's frames are received in parallel.
+        The rx_callback is then called concurrently. send() uses the first member
+        and statistics() sums the rx/tx counters of the members. Per-port objects
+        (classifier, overload, rcvbuf_tuner, recorder) cannot be shared by the
+        members and are rejected. Linux only.
+
+        :param iface:          (str) Interface Name to open
+        :param rx_callback:    (func) Function to process received frames (bytes), None
+                                      for pull mode
+        :param bpf_filter:     (BpfProgramFilter) Berkley Packet Filter to filter Rx Frames
+        :param verbose:        (bool) True if verbose, debug output, should be shown
+        :param keep_closed:    (bool) True if the I/O thread should not be started
+        :param group:          (str) Name of the I/O thread group to service the port on, True for a
+                                     dedicated per-port thread, or None to use this thread
+        :param cpus:           (iterable) CPUs to pin a new group thread to
+        :param sched_policy:   (int) Scheduling policy for a new group thread
+        :param sched_priority: (int) Static priority for a new group thread
+        :param queue_size:     (int) Frames a pull mode port can hold before it drops
+        :param queue_overflow: (str) Pull mode policy when the queue is full, see rawsocket.rxqueue
+        :param response_key:   (func) Returns the transaction match key of a received frame,
+                                      or None if it is not a response
+        :param shared:         (str) Name of the shared socket to receive on, True for the
+                                     default shared socket, or None for a socket per port
+        :param fanout:         (int) Number of fanout member sockets, None for a single socket
+        :param fanout_mode:    (int) How frames are spread over the members, see
+                                     rawsocket.util.PACKET_FANOUT_HASH and the other modes
+        :param port_options:   Additional IOPort options such as vnet_hdr
+
+        :return: (bool) True if opened
+        """
+        assert iface not in self.interfaces, 'Interface already Opened'
+        self._queues.pop(iface, None)       # Of a closed pull mode port
+
+        if fanout:
+            return self._open_fanout(iface, rx_callback, fanout, fanout_mode, cpus, sched_policy,
+                                     sched_priority, bpf_filter=bpf_filter, verbose=verbose,
+                                     keep_closed=keep_closed, response_key=response_key,
+                                     **port_options)
+
+        if group is None and self._receive_threads:
+            group, cpus = self._receive_group()
+
+        if group is not None:
+            name = iface if group is True else group
+            thread = self._group_thread(name, cpus, sched_policy, sched_priority)
+
+            if response_key is not None:
+                _ = self.transactions       # Shared with the group thread
+
+            self._port_groups[iface] = thread
+            return thread.open(iface, rx_callback, bpf_filter=bpf_filter,
+                               verbose=verbose, keep_closed=keep_closed, queue_size=queue_size,
+                               queue_overflow=queue_overflow, response_key=response_key,
+                               shared=shared, **port_options)
+
+        queue = None
+        if rx_callback is None:
+            queue = ReceiveQueue(queue_size, overflow=queue_overflow)
+            rx_callback = queue.put
+
+        if response_key is not None:
+            rx_callback = self.transactions.wrap(iface, response_key, rx_callback)
+
+        if self._tracer is not None:
+            port_options.setdefault('tracer', self._tracer)
+
+        if shared is not None:
+            self._ports[iface] = self._open_shared('default' if shared is True else shared,
+                                                   iface, rx_callback, bpf_filter,
+                                                   self._verbose or verbose, port_options)
+        else:
+            self._ports[iface] = IOPort.create(iface, rx_callback,
+                                               bpf_filter=bpf_filter,
+                                               verbose=self._verbose or verbose,
+                                               busy_poll=self._busy_poll,
+                                               **port_options)
+        if queue is not None:
+            self._queues[iface] = queue
 
-        self._ports[iface] = IOPort.create(iface, rx_callback,
-                                           bpf_filter=bpf_filter,
-                                           verbose=self._verbose or verbose)
         # Make sure rx thread is running if not suppressed
         if not keep_closed:
             self.start()
@@ -64,25 +321,186 @@ class IOThread(Thread):
         self._waker.notify()
         return True
 
+    def _group_thread(self, name, cpus=None, sched_policy=None, sched_priority=None):
+        """ Get a group thread, creating it if needed """
+        thread = self._groups.get(name)
+
+        if thread is None:
+            thread = IOThread(verbose=self._verbose, busy_poll=self._busy_poll,
+                              cpus=cpus, sched_policy=sched_policy,
+                              sched_priority=sched_priority,
+                              name='{}-{}'.format(self.name, name), engine=self._engine)
+            thread.set_tracer(self._tracer)
+            thread._set_transactions(self._transactions)
+            self._groups[name] = thread
+        return thread
+
+    def _receive_group(self, index=None):
+        """
+        Pick a receive thread
+
+        :param index: (int) Receive thread number, None for the one with the fewest ports
+
+        :return: (tuple) group name and CPUs to pin a new thread to
+        """
+        if index is None:
+            index = min(range(self._receive_threads),
+                        key=lambda i: len(self._groups['rx{}'.format(i)]._ports)
+                        if 'rx{}'.format(i) in self._groups else 0)
+
+        index %= self._receive_threads
+        cpus = self._receive_cpus
+        return 'rx{}'.format(index), [cpus[index % len(cpus)]] if cpus else None
+
+    def _open_fanout(self, iface, rx_callback, members, mode, cpus, sched_policy, sched_priority,
+                     response_key=None, **options):
+        assert rx_callback is not None, 'Fanout ports need an rx_callback'
+        assert not self._receive_threads or members <= self._receive_threads, \
+            'More fanout members than receive threads'
+
+        for option in _FANOUT_UNSHARED:
+            if options.get(option) is not None:
+                raise ValueError('Fanout members cannot share a {}'.format(option))
+
+        if response_key is not None:
+            _ = self.transactions       # Shared with the group threads
+
+        group_id = next(_fanout_ids) & 0xffff
+        threads = []
+        try:
+            for index in range(members):
+                if self._receive_threads:
+                    name, thread_cpus = self._receive_group(index)
+                else:
+                    name, thread_cpus = '{}-fanout{}'.format(iface, index), cpus
+
+                thread = self._group_thread(name, thread_cpus, sched_policy, sched_priority)
+                thread.open(iface, rx_callback, response_key=response_key,
+                            fanout_group=(group_id, mode), **options)
+                threads.append(thread)
+
+        except Exception as _e:
+            for thread in threads:
+                thread.close(iface)
+            raise
+
+        self._port_groups[iface] = threads[0]
+        self._fanouts[iface] = threads
+        return True
+
+    def _open_shared(self, name, iface, rx_callback, bpf_filter, verbose, port_options):
+        from rawsocket.sharedsocket import SharedPacketSocket, SharedIOPort
+
+        rcvbuf = port_options.pop('rcvbuf', None)
+        sndbuf = port_options.pop('sndbuf', None)
+        port_options.pop('rcvbuf_tuner', None)
+
+        shared = self._shared.get(name)
+        if shared is None:
+            shared = SharedPacketSocket(name='{}-{}'.format(self.name, name), verbose=verbose,
+                                        busy_poll=self._busy_poll, rcvbuf=rcvbuf, sndbuf=sndbuf)
+            self._shared[name] = shared
+
+        try:
+            return SharedIOPort(iface, rx_callback, shared, bpf_filter=bpf_filter,
+                                verbose=verbose, **port_options)
+
+        except Exception as _e:
+            if not len(shared):
+                del self._shared[name]
+                shared.close()
+            raise
+
+    @_locked
+    def open_process(self, iface, bpf_filter=None, ring_size=SharedFrameRing.DEFAULT_SIZE,
+                     backpressure=BACKPRESSURE_DROP, mp_context=None, **port_options):
+        """
+        Open an interface in a receive worker process
+
+        The worker owns the port's socket and writes received frames into a
+        shared memory ring. Frames are read from the returned ring in batches
+        (SharedFrameRing.read_batch or consume) instead of through a callback.
+        The worker is stopped by close() or stop().
+
+        :param iface:        (str) Interface Name to open
+        :param bpf_filter:   (BpfProgramFilter) Berkley Packet Filter to filter Rx Frames
+        :param ring_size:    (int) Size of the shared memory ring data area in octets
+        :param backpressure: (str) 'drop' to count and drop frames when the ring is full,
+                                   'block' to stall the worker until the consumer catches up
+        :param mp_context:   (BaseContext) multiprocessing context, default is 'spawn'
+        :param port_options: Additional IOPort options for the worker's port
+
+        :return: (SharedFrameRing) consumer side of the worker's ring
+        """
+        assert iface not in self.interfaces, 'Interface already Opened'
+
+        worker = ReceiveWorker(iface, bpf_filter=bpf_filter, ring_size=ring_size,
+                               backpressure=backpressure, mp_context=mp_context,
+                               **port_options)
+        self._workers[iface] = worker.start()
+        return worker.ring
+
+    @_locked
     def close(self, interface=None):
+        if self._transactions is not None and interface is not None:
+            self._transactions.cancel_all(interface)
+
+        worker = self._workers.pop(interface, None)
+        if worker is not None:
+            worker.stop()
+            return True
+
+        threads = self._fanouts.pop(interface, None)
+        if threads is not None:
+            self._port_groups.pop(interface, None)
+            for thread in threads:
+                thread.close(interface)
+            return True
+
+        thread = self._port_groups.pop(interface, None)
+        if thread is not None:
+            queue = thread._queues.get(interface)
+            if queue is not None:
+                self._queues[interface] = queue
+            return thread.close(interface)
+
         port = self._ports.pop(interface, None)
         if port is None:
             return False
 
         port.close()
+        for name, shared in list(self._shared.items()):
+            if not len(shared):
+                del self._shared[name]
+                shared.close()
+
+        queue = self._queues.get(interface)
+        if queue is not None:
+            queue.close()
+
         self._ports_modified = True
         self._waker.notify()
         return True
 
+    @_locked
     def _close_all(self):
-        ports, self._ports = self._ports, None
+        ports, self._ports = self._ports, dict()
+
+        for queue in self._queues.values():
+            queue.close()
 
         if len(ports):
             for _, port in ports.items():
                 port.close()
 
+            shared, self._shared = self._shared, dict()
+            for sock in shared.values():
+                sock.close()
+
             self._ports_modified = True
-            self._waker.notify()
+            waker = self._waker
+            if waker is not None:
+                waker.notify()
         return True
 
     def start(self):
@@ -92,12 +510,20 @@ class IOThread(Thread):
         If the background I/O Thread is not running prior to an 'open' call setting the interface
         into promiscuous mode, it will be started automatically,
 
+        Group threads, such as those of ports opened with keep_closed, are started too.
+
         :return:
         """
         if self._stopped:
             self._stopped = False
             super(IOThread, self).start()
 
+        with self._lock:
+            groups = list(self._groups.values())
+
+        for thread in groups:
+            thread.start()
+
         return self
 
     def stop(self, timeout=None):
@@ -116,6 +542,25 @@ class IOThread(Thread):
 
         :return: (Thread) thread object
         """
+        with self._lock:
+            groups, self._groups = self._groups, dict()
+            workers, self._workers = self._workers, dict()
+            for interface, thread in self._port_groups.items():
+                queue = thread._queues.get(interface)
+                if queue is not None:
+                    self._queues[interface] = queue
+            self._port_groups = dict()
+            self._fanouts = dict()
+
+        if self._transactions is not None:
+            self._transactions.cancel_all()
+
+        for thread in groups.values():
+            thread.stop(0.0)
+
+        for worker in workers.values():
+            worker.stop(timeout)
+
         if not self._stopped:
             self._stopped = True
             waker, self._waker = self._waker, None
@@ -127,24 +572,167 @@ class IOThread(Thread):
             if timeout is None or timeout > 0.0:
                 self.join(timeout)
 
+        if timeout is None or timeout > 0.0:
+            for thread in groups.values():
+                thread.join(timeout)
+
         return self
 
-    def send(self, interface, frame):
-        port = self._ports.get(interface, None)
+    def receive(self, interface, timeout=None):
+        """
+        Read the next frame of a pull mode port
+
+        Frames of vnet_hdr ports are returned as (frame, vnet_hdr) tuples. Ports
+        opened with an rx_callback and interfaces never opened raise ValueError.
+        Frames still queued when the port closes can be read afterwards.
+
+        :param interface: (str) Interface name
+        :param timeout:   (float) Seconds to wait, None to wait forever, 0 to poll
+
+        :return: (bytes) frame, None on timeout or once the port is closed and its
+                         queue is empty
+        """
+        return self._queue(interface).get(timeout)
+
+    def receive_many(self, interface, max=256, timeout=None):
+        """
+        Read up to max queued frames of a pull mode port
+
+        Waits only until at least one frame is available.
+
+        :param interface: (str) Interface name
+        :param max:       (int) Maximum number of frames to return
+        :param timeout:   (float) Seconds to wait for the first frame, None to wait
+                                  forever, 0 to poll
+
+        :return: (list) frames, oldest first, empty on timeout or once the port is closed
+                        and its queue is empty
+        """
+        return self._queue(interface).get_many(max, timeout)
+
+    def request(self, interface, frame, key, timeout=1.0, kind='default', vnet_hdr=None):
+        """
+        Send a request frame and get a future for its response
+
+        The response is received on a port opened with a response_key, see
+        TransactionLayer.request.
+
+        :param interface: (str) Interface name
+        :param frame:     (bytes) Request frame
+        :param key:       (hashable or func) Match key of the response, or a function
+                                             returning it from the request frame
+        :param timeout:   (float) Seconds to wait for the response
+        :param kind:      (str) Transaction type for statistics
+
+        :return: (concurrent.futures.Future) completes with the response frame
+        """
+        return self.transactions.request(interface, frame, key, timeout=timeout, kind=kind,
+                                         vnet_hdr=vnet_hdr)
+
+    def send(self, interface, frame, vnet_hdr=None):
+        port = self.port(interface)
+        if port is not None:
+            return port.send(frame, vnet_hdr=vnet_hdr)
+        return -1
+
+    def send_at(self, interface, frame, launch_time):
+        """
+        Send a frame for the qdisc to transmit at a launch time, see IOPort.send_at
+
+        :param interface:   (str) Interface name, opened with txtime
+        :param frame:       (bytes) Frame to send
+        :param launch_time: (int) Transmit time in nanoseconds on the port's txtime clock
+
+        :return: (int) number of bytes queued, -1 on error
+        """
+        port = self.port(interface)
         if port is not None:
-            return port.send(frame)
+            return port.send_at(frame, launch_time)
         return -1
 
+    def send_many(self, interface, frames):
+        """
+        Send a batch of frames
+
+        With the io_uring engine running the frames are handed to the I/O
+        thread, which queues them as one batch of send submissions and a single
+        system call, and their results are counted in the port statistics as
+        they complete. Otherwise they are sent one by one.
+
+        :param interface: (str) Interface name
+        :param frames:    (iterable) Frames, each bytes, a buffer or a sequence of them
+                                     as accepted by IOPort.send
+
+        :return: (int) number of frames sent or queued
+        """
+        port = self.port(interface)
+        if port is None:
+            return 0
+
+        thread = self._port_groups.get(interface, self)
+        ring = thread._uring
+        if ring is not None and port._multishot_socket() is not None:
+            return thread._uring_queue(port, frames)
+
+        count = 0
+        for frame in frames:
+            length = len(frame) if isinstance(frame, bytes) else frame_segments(frame)[1]
+            if port.send(frame) == length:
+                count += 1
+        return count
+
+    def _apply_scheduling(self):
+        """Apply CPU affinity and scheduling policy to the running I/O thread"""
+        if self._cpus is not None and not set_cpu_affinity(self._cpus):
+            if self._verbose:
+                print('{}: unable to set CPU affinity to {}'.format(self.name, self._cpus))
+
+        if self._sched_policy is not None and \
+                not set_realtime_priority(self._sched_policy, self._sched_priority):
+            if self._verbose:
+                print('{}: unable to set scheduling policy {}'.format(self.name, self._sched_policy))
+
     def run(self):
+        self._apply_scheduling()
+
+        if self._engine == self.ENGINE_URING:
+            uring = self._open_uring()
+            if uring is not None:
+                self._engine_active = self.ENGINE_URING
+                try:
+                    completed = self._run_uring(*uring)
+
+                finally:
+                    self._close_uring(*uring)
+
+                if completed:
+                    if self._verbose:
+                        print(os.linesep + 'exiting background I/O thread', flush=True)
+                    return
+
+        self._engine_active = self.ENGINE_SELECT
+        self._run_select()
+
+    def _run_select(self):
+        next_tick = 0.0
+
         # Outer loop invoked on port change
         while not self._stopped:
-            fds = [self._waker] + [port for _, port in self._ports.items()]
-            self._ports_modified = False
+            # Ports of a shared socket are serviced through it
+            fds = [self._waker] + self._serviced()
             empty = []
 
             while not self._stopped:
+                tracer = self._tracer
+                if tracer is not None:
+                    start = time.perf_counter_ns()
+
+                transactions = self._transactions
+                timeout = self.TICK_INTERVAL if transactions is None or not len(transactions) \
+                    else transactions.resolution
+
                 try:
-                    _in, _out, _err = select.select(fds, empty, empty, 1)
+                    _in, _out, _err = select.select(fds, empty, empty, timeout)
 
                 except Exception as _e:
                     break
@@ -154,33 +742,463 @@ class IOThread(Thread):
                         print('Timeout')
                     break
 
-                with self._cvar:
-                    for fd in _in:
-                        try:
-                            if fd is self._waker:
-                                self._waker.wait()
-                                continue
+                if tracer is not None:
+                    marks = [('select', time.perf_counter_ns())]
+
+                for fd in _in:
+                    try:
+                        if fd is self._waker:
+                            self._waker.wait()
+
+                        else:
+                            fd.recv()
 
-                            elif isinstance(fd, IOPort):
-                                fd.recv()
+                    except Exception as _e:
+                        pass  # for debug purposes
 
-                            else:
-                                pass  # Stale port or waker, may be shutting down
+                if tracer is not None:
+                    marks.append(('dispatch', time.perf_counter_ns()))
 
-                            self._cvar.notify_all()
+                if self._busy_poll and len(_in) and not self._ports_modified:
+                    self._spin(fds[1:])
+                    if tracer is not None:
+                        marks.append(('spin', time.perf_counter_ns()))
+
+                if self._ports_modified:
+                    break
 
-                        except Exception as _e:
-                            pass  # for debug purposes
+                now = time.monotonic()
+                if transactions is not None:
+                    transactions.advance(now)
 
-                    if self._ports_modified:
-                        break
+                if now >= next_tick:
+                    next_tick = now + self.TICK_INTERVAL
+                    self._tick(fds[1:], now)
+                    if tracer is not None:
+                        marks.append(('tick', time.perf_counter_ns()))
+
+                if tracer is not None:
+                    tracer.record('loop', self.name, start, marks, {'rawsocket.ready': len(_in)})
 
         if self._verbose:
             print(os.linesep + 'exiting background I/O thread', flush=True)
 
-    def statistics(self, interface):
-        port = self._ports.get(interface)
-        return port.statistics() if port is not None else None
+    def _serviced(self):
+        """
+        Snapshot of the ports and shared sockets to receive on, taken by the run
+        loop whenever ports were opened or closed
+
+        :return: (list) ports and shared sockets
+        """
+        with self._lock:
+            self._ports_modified = False
+            # Ports of a shared socket are serviced through it
+            targets = [port for port in self._ports.values() if port.fileno() is not None]
+            shared = list(self._shared.values())
+
+        for sock in shared:
+            sock.sync()
+        return targets + shared
+
+    def _open_uring(self):
+        """
+        Create the io_uring and receive buffer pool of the io_uring engine
+
+        :return: (tuple) IoUring and BufferRing, None if io_uring is not available
+        """
+        try:
+            from rawsocket.uring import IoUring, BufferRing, PacketRecvMsg
+            ring = IoUring(self.URING_ENTRIES)
+
+        except OSError as e:
+            if self._verbose:
+                print('{}: io_uring not available ({}), using select'.format(self.name, e))
+            return None
+
+        try:
+            buffers = BufferRing(ring, 0, self.URING_BUFFERS,
+                                 PacketRecvMsg.HEADER_SIZE + IOPort.RCV_SIZE_DEFAULT)
+        except OSError as e:
+            ring.close()
+            if self._verbose:
+                print('{}: io_uring buffer rings not available ({}), using select'.format(self.name, e))
+            return None
+
+        self._uring = ring
+        return ring, buffers
+
+    def _close_uring(self, ring, buffers):
+        self._uring = None
+        self._uring_tokens = dict()
+        buffers.close()
+        ring.close()
+        self._uring_send_pending()
+
+    def _uring_token(self, kind, obj, context=None):
+        # Called on the I/O thread only
+        token = self._uring_next
+        self._uring_next += 1
+        self._uring_tokens[token] = (kind, obj, context)
+        return token
+
+    def _uring_arm(self, ring, buffers, obj, armed, poll=False):
+        """
+        Start receiving on a port, shared socket or the waker
+
+        AF_PACKET ports get a multishot recvmsg, anything else a one-shot poll
+        after which recv() is called.
+        """
+        from rawsocket.uring import PacketRecvMsg, IORING_OP_RECVMSG, IORING_OP_POLL_ADD, \
+            IOSQE_BUFFER_SELECT, IORING_RECV_MULTISHOT, POLLIN
+
+        sock = obj._multishot_socket() if isinstance(obj, IOPort) and not poll else None
+        if sock is not None:
+            msg = PacketRecvMsg()
+            token = self._uring_token('rx', obj, msg)
+            queued = ring.prep(IORING_OP_RECVMSG, sock.fileno(), addr=msg.address,
+                               user_data=token, flags=IOSQE_BUFFER_SELECT,
+                               ioprio=IORING_RECV_MULTISHOT, buf_group=buffers.bgid)
+        else:
+            fd = obj.fileno()
+            if fd is None:
+                return
+            token = self._uring_token('poll', obj)
+            queued = ring.prep(IORING_OP_POLL_ADD, fd, op_flags=POLLIN, user_data=token)
+
+        if queued:
+            armed[obj] = token
+        else:
+            del self._uring_tokens[token]       # Submission queue full, retried next loop
+
+    def _uring_queue(self, port, frames):
+        """
+        Hand a send_many batch to the I/O thread, the ring is only used by that thread
+
+        :return: (int) number of frames queued
+        """
+        batch = []
+        for frame in frames:
+            frame = frame_bytes(frame)
+            if port._must_pad and len(frame) < port.MIN_PKT_SIZE:
+                frame = port._pad_frame(frame)
+            batch.append(frame)
+
+        self._uring_sends.append((port, batch))
+        if self._uring is None:
+            self._uring_send_pending()          # Engine stopped meanwhile, nothing left to take it
+        else:
+            self._waker.notify()
+        return len(batch)
+
+    def _uring_send_pending(self):
+        """ Send the queued send_many batches one frame at a time """
+        sends = self._uring_sends
+        while sends:
+            try:
+                port, batch = sends.popleft()
+
+            except IndexError:
+                break           # Taken by another thread
+
+            for frame in batch:
+                port.send(frame)
+
+    def _uring_send(self, ring):
+        """ Queue the send submissions of the waiting send_many batches """
+        from rawsocket.uring import IORING_OP_SEND
+        from ctypes import c_char_p, cast, c_void_p
+
+        sends = self._uring_sends
+        while sends:
+            port, batch = sends.popleft()
+            sock = port._multishot_socket()
+            if sock is None:
+                continue        # Closed since it was queued
+
+            fd = sock.fileno()
+            for frame in batch:
+                token = self._uring_token('tx', port, frame)
+                address = cast(c_char_p(frame), c_void_p).value
+                if not ring.prep(IORING_OP_SEND, fd, addr=address, length=len(frame),
+                                 user_data=token):
+                    ring.submit()
+                    if not ring.prep(IORING_OP_SEND, fd, addr=address, length=len(frame),
+                                     user_data=token):
+                        del self._uring_tokens[token]
+                        port.send(frame)
+
+    def _run_uring(self, ring, buffers):
+        """
+        io_uring engine loop
+
+        :return: (bool) True when stopped, False if the ring failed and the
+                        select engine should take over
+        """
+        from rawsocket.uring import IORING_OP_ASYNC_CANCEL, IORING_CQE_F_BUFFER, \
+            IORING_CQE_F_MORE, IORING_CQE_BUFFER_SHIFT
+
+        next_tick = 0.0
+        armed = dict()          # port, shared socket or waker -> user_data
+        targets = []
+        tokens = self._uring_tokens
+        waker = self._waker
+        modified = True
+
+        while not self._stopped:
+            if modified or self._ports_modified:
+                modified = False
+                targets = self._serviced()
+
+                current = set(targets)
+                current.add(waker)
+                for obj, token in list(armed.items()):
+                    if obj not in current:
+                        del armed[obj]
+                        ring.prep(IORING_OP_ASYNC_CANCEL, -1, addr=token)
+
+            for obj in [waker] + targets:
+                if obj not in armed:
+                    self._uring_arm(ring, buffers, obj, armed)
+
+            if self._uring_sends:
+                self._uring_send(ring)
+
+            tracer = self._tracer
+            if tracer is not None:
+                start = time.perf_counter_ns()
+
+            transactions = self._transactions
+            timeout = self.TICK_INTERVAL if transactions is None or not len(transactions) \
+                else transactions.resolution
+
+            try:
+                ring.submit(wait=1, timeout=timeout)
+
+            except OSError as e:
+                if self._verbose:
+                    print('{}: io_uring submit failed ({}), using select'.format(self.name, e))
+                return False
+
+            if tracer is not None:
+                marks = [('wait', time.perf_counter_ns())]
+
+            completions = ring.completions()
+            self._uring_batches += 1
+            self._uring_completions += len(completions)
+
+            for token, res, flags in completions:
+                entry = tokens.get(token)
+                if entry is None:
+                    continue
+                kind, obj, context = entry
+                more = flags & IORING_CQE_F_MORE
+
+                try:
+                    if kind == 'rx':
+                        if flags & IORING_CQE_F_BUFFER:
+                            bid = flags >> IORING_CQE_BUFFER_SHIFT
+                            view = buffers.view(bid, 0, res)
+                            try:
+                                frame, pkttype, wire_len = context.parse(view)
+                                obj._deliver_received(frame, pkttype, wire_len)
+                            finally:
+                                view.release()
+                                buffers.recycle(bid)
+
+                    elif kind == 'poll':
+                        if obj is waker:
+                            waker.wait()
+                        elif res > 0:
+                            for _ in range(64):
+                                if not obj.recv(nonblocking=True):
+                                    break
+
+                    elif kind == 'tx':
+                        if res == len(context):
+                            obj._tx_frames += 1
+                            obj._tx_octets += res
+                            if obj._recorder is not None:
+                                obj._recorder.tx(context)
+                        else:
+                            obj._tx_errors += 1
+                            if res == -errno.EINVAL and len(context) < obj.MIN_PKT_SIZE:
+                                obj._must_pad = True
+
+                except Exception as _e:
+                    pass  # for debug purposes
+
+                if not more:
+                    del tokens[token]
+                    if armed.get(obj) == token:
+                        del armed[obj]
+                        # Receive errors other than running out of buffers fall back to recv()
+                        if kind == 'rx' and res < 0 and res not in (-errno.ENOBUFS, -errno.ECANCELED) \
+                                and obj in targets:
+                            self._uring_arm(ring, buffers, obj, armed, poll=True)
+
+            if tracer is not None:
+                marks.append(('dispatch', time.perf_counter_ns()))
+
+            if self._ports_modified:
+                continue
+
+            now = time.monotonic()
+            if transactions is not None:
+                transactions.advance(now)
+
+            if now >= next_tick:
+                next_tick = now + self.TICK_INTERVAL
+                self._tick(targets, now)
+                if tracer is not None:
+                    marks.append(('tick', time.perf_counter_ns()))
+
+            if tracer is not None:
+                tracer.record('loop', self.name, start, marks, {'rawsocket.ready': len(completions)})
+
+        return True
+
+    @staticmethod
+    def _tick(ports, now):
+        for port in ports:
+            try:
+                port.tick(now)
+
+            except Exception as _e:
+                pass  # for debug purposes
+
+    def _spin(self, ports):
+        """
+        Busy poll the ports with non-blocking receives until none of them has
+        had a frame for the busy poll budget
+
+        :param ports: (list) IOPorts to poll
+        """
+        clock = time.perf_counter
+        budget = self._busy_poll / 1000000.0
+        now = clock()
+        deadline = now + budget
+
+        while not self._stopped and not self._ports_modified:
+            received = False
+            for port in ports:
+                try:
+                    received = port.recv(nonblocking=True) or received
+
+                except Exception as _e:
+                    pass  # for debug purposes
+
+            last, now = now, clock()
+            if received:
+                self._busy_rx_seconds += now - last
+                self._busy_rx_polls += 1
+                deadline = now + budget
+            else:
+                self._spin_seconds += now - last
+                self._spin_polls += 1
+                if now >= deadline:
+                    break
+
+    def dump_recorder(self, interface, path=None, direction=None):
+        """
+        Dump the flight recorder of a port to a pcap file. Safe from any thread.
+
+        :param interface: (str) Interface name
+        :param path:      (str) File name, None to trigger a dump to the recorder's
+                                dump_dir on the next tick of the port
+        :param direction: (str) rawsocket.recorder.DIRECTION_RX or _TX, None for both
+
+        :return: (int) frames written, zero for a triggered dump
+        """
+        port = self.port(interface)
+        recorder = port.recorder if port is not None else None
+        if recorder is None:
+            raise ValueError('Interface {} has no flight recorder'.format(interface))
+
+        if path is None:
+            recorder.trigger()
+            return 0
+        return recorder.dump(path, direction)
+
+    def statistics(self, interface, top_n=None):
+        """
+        Get statistics for an interface
+
+        :param interface: (str) Interface name
+        :param top_n:     (int) If the port was opened with a classifier, include the
+                                N busiest VLANs, ethertypes and source MACs
+
+        :return: (dict) statistics, None if the interface is not open
+        """
+        worker = self._workers.get(interface)
+        if worker is not None:
+            return worker.statistics()
+
+        threads = self._fanouts.get(interface)
+        if threads is not None:
+            return self._fanout_statistics(interface, threads, top_n)
+
+        port = self.port(interface)
+        if port is None:
+            return None
+
+        stats = port.statistics(top_n=top_n)
+        thread = self._port_groups.get(interface, self)
+        queue = thread._queues.get(interface)
+        if queue is not None:
+            stats.update(queue.statistics())
+        return stats
+
+    @staticmethod
+    def _fanout_statistics(interface, threads, top_n):
+        """
+        Sum the per-socket rx/tx counters of the fanout members of an interface,
+        other statistics such as buffer sizes are those of the first member
+        """
+        merged = dict()
+        for thread in threads:
+            stats = thread.statistics(interface, top_n=top_n) or dict()
+            for key, value in stats.items():
+                if key not in merged:
+                    merged[key] = value
+
+                elif not key.startswith(('rx_', 'tx_')) or isinstance(value, bool) or \
+                        not isinstance(value, (int, float)):
+                    continue
+
+                elif key in _FANOUT_MAXIMUM:
+                    merged[key] = max(merged[key], value)
+
+                else:
+                    merged[key] += value
+
+        merged['fanout_members'] = len(threads)
+        return merged
+
+    def thread_statistics(self):
+        """
+        Get statistics for the I/O thread itself
+
+        Busy poll time is split between polls that returned at least one frame
+        ('busy_rx_seconds') and polls that found nothing ('spin_seconds').
+
+        :return: (dict) statistics
+        """
+        return {
+            'name': self.name,
+            'native_id': getattr(self, 'native_id', None),
+            'groups': {name: thread.thread_statistics() for name, thread in self._groups.items()},
+            'engine': self._engine_active,
+            'free_threaded': FREE_THREADED,
+            'receive_threads': self._receive_threads,
+            'uring_batches': self._uring_batches,
+            'uring_completions': self._uring_completions,
+            'busy_poll': self._busy_poll,
+            'spin_seconds': self._spin_seconds,
+            'spin_polls': self._spin_polls,
+            'busy_rx_seconds': self._busy_rx_seconds,
+            'busy_rx_polls': self._busy_rx_polls,
+            'transactions': self._transactions.statistics() if self._transactions is not None else None,
+        }
 
 
 class _SelectWakerDescriptor(object):
@@ -215,27 +1233,89 @@ class BpfProgramFilter(object):
     Convenience packet filter based on the well-tried Berkeley Packet Filter,
     used by many well known open source tools such as pcap and tcpdump.
     """
-    def __init__(self, program_string):
+    def __init__(self, program_string, linktype=LINKTYPE_ETHERNET):
         """
         Create a filter using the BPF command syntax. To learn more,
         consult 'man pcap-filter'.
+
+        Compiled programs are kept in an on-disk cache (see rawsocket.bpfcache)
+        so pcapy is only imported the first time an expression is seen.
         :param program_string: The textual definition of the filter. Examples:
         'vlan 1000'
         'vlan 1000 and ip src host 10.10.10.10'
+        :param linktype: Link type to compile the expression for
         """
         self._program_string = program_string
-        self._bpf = pcapy.BPFProgram(program_string)
+        self._linktype = linktype
+        self._bpf = None
+        self._program = None
+        self._instructions = bpfcache.load(program_string, linktype)
+
+        if self._instructions is None:
+            self._instructions = self._libpcap().get_bpf()
+            bpfcache.store(program_string, linktype, self._instructions)
 
     def __call__(self, frame):
         """
-        Return 1 if frame passes filter.
+        Return non-zero if frame passes filter.
         :param frame: Raw frame provided as Python string
-        :return: 1 if frame satisfies filter, 0 otherwise.
+        :return: Non-zero if frame satisfies filter, 0 otherwise.
         """
-        return self._bpf.filter(frame)
+        if self._bpf is not None:
+            return self._bpf.filter(frame)
+
+        try:
+            return self._user_program()(frame)      # Loaded from the cache, libpcap not needed
+
+        except (ValueError, RecursionError):
+            return self._libpcap().filter(frame)    # Not evaluable in user space, such as kernel ancillary loads
 
     def __str__(self):
         return self._program_string
 
     def get_bpf(self):
-        return self._bpf.get_bpf()
+        return self._instructions
+
+    def _libpcap(self):
+        if self._bpf is None:
+            import pcapy
+            self._bpf = pcapy.BPFProgram(self._program_string, self._linktype)
+        return self._bpf
+
+    def _user_program(self):
+        if self._program is None:
+            self._program = BpfProgram(self.get_bpf())
+        return self._program
+
+    def filter_many(self, frames, use_numpy=None):
+        """
+        Run the filter over a batch of frames in user space
+        :param frames: List of raw frames
+        :param use_numpy: Force (True) or prevent (False) NumPy evaluation, None to decide by batch size
+        :return: Boolean mask, True where the frame satisfies the filter
+        """
+        try:
+            program = self._user_program()
+
+        except ValueError:
+            bpf = self._libpcap()
+            return [bpf.filter(bytes(frame)) != 0 for frame in frames]
+
+        return program.filter_many(frames, use_numpy=use_numpy)
+
+    def filter_pcap(self, path, use_numpy=None):
+        """
+        Run the filter over every frame of a pcap or pcapng capture file
+        :param path: Capture file name
+        :param use_numpy: See filter_many
+        :return: Boolean mask, one entry per captured frame
+        """
+        try:
+            program = self._user_program()
+
+        except ValueError:
+            bpf = self._libpcap()
+            with open_capture(path) as reader:
+                return [bpf.filter(bytes(frame)) != 0 for _timestamp, _wire_len, frame in reader]
+
+        return program.filter_pcap(path, use_numpy=use_numpy)
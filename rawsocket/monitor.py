@@ -0,0 +1,201 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Live receive rate monitor
+
+Opens one or more interfaces on an IOThread and shows, for every interval,
+the receive rate, kernel and user space drops, top talkers and rx_callback
+latency percentiles of each, as a refreshing terminal view or as JSON lines:
+
+    sudo python -m rawsocket eth0 eth1 --filter 'vlan 100' --interval 2
+    sudo python -m rawsocket eth0 --json >> eth0.jsonl
+
+User space drops are frames discarded, shed by an overload guard or dropped
+by a full pull-mode queue. Latency is measured with a Tracer, which adds a
+little per-frame cost of its own, use --no-latency to leave it out.
+"""
+import sys
+import json
+import time
+import argparse
+
+from .iothread import IOThread, BpfProgramFilter
+from .ioport import IOPort
+from .classifier import TrafficClassifier
+from .trace import Tracer
+
+CLEAR_SCREEN = '\x1b[H\x1b[2J'
+USER_DROPS = ('rx_discards', 'rx_shed', 'rx_queue_drops')
+
+
+class Monitor(object):
+    """
+    Per-interval rates of the ports of an IOThread
+    """
+    def __init__(self, io_thread, interfaces, tracer=None, top_n=5):
+        """
+        Class initializer
+
+        :param io_thread:  (IOThread) Thread the interfaces are open on
+        :param interfaces: (list) Interface names
+        :param tracer:     (Tracer) Tracer attached to the thread for callback latency, or None
+        :param top_n:      (int) Top talkers to report per interface, 0 for none
+        """
+        self._io_thread = io_thread
+        self._interfaces = interfaces
+        self._tracer = tracer
+        self._top_n = top_n
+        self._last = {iface: self._counters(io_thread.statistics(iface) or dict())
+                      for iface in interfaces}
+        self._last_time = time.monotonic()
+
+    @staticmethod
+    def _counters(stats):
+        return (stats.get('rx_frames', 0), stats.get('rx_octets', 0),
+                stats.get('rx_kernel_drops', 0) or 0,
+                sum(stats.get(key, 0) or 0 for key in USER_DROPS))
+
+    def sample(self):
+        """
+        Get the rates since the previous sample
+
+        :return: (list) a dict per interface
+        """
+        now = time.monotonic()
+        elapsed = max(now - self._last_time, 1e-9)
+        self._last_time = now
+
+        latency = dict()
+        tracer = self._tracer
+        if tracer is not None:
+            histograms = tracer.histograms('rx')
+            tracer.clear()
+            for (_operation, name), stages in histograms.items():
+                histogram = stages.get('callback')
+                if histogram is not None and len(histogram):
+                    latency[name] = {key: histogram.percentile(percent) / 1000.0
+                                     for key, percent in (('p50', 50), ('p99', 99),
+                                                          ('p99.9', 99.9))}
+                    latency[name]['max'] = histogram.snapshot()['max'] / 1000.0
+
+        samples = []
+        for iface in self._interfaces:
+            stats = self._io_thread.statistics(iface, top_n=self._top_n) or dict()
+            counters = self._counters(stats)
+            frames, octets, kernel_drops, user_drops = \
+                (current - last for current, last in zip(counters, self._last[iface]))
+            self._last[iface] = counters
+
+            talkers = stats.get('top_talkers', dict()).get('src_mac', [])
+            samples.append({
+                'time': time.time(),
+                'interface': iface,
+                'pps': frames / elapsed,
+                'mbps': octets * 8 / elapsed / 1e6,
+                'kernel_drops': kernel_drops,
+                'user_drops': user_drops,
+                'rx_frames': counters[0],
+                'callback_latency_us': latency.get(iface),
+                'top_talkers': [(talker['key'], talker['frames']) for talker in talkers],
+            })
+        return samples
+
+
+def render(samples, interval):
+    """
+    Format samples as a terminal view
+
+    :param samples:  (list) Samples from Monitor.sample
+    :param interval: (float) Seconds per sample
+
+    :return: (str) text
+    """
+    lines = ['rawsocket monitor  {}  every {:g}s'.format(time.strftime('%H:%M:%S'), interval), '',
+             '{:<12s} {:>12s} {:>10s} {:>10s} {:>10s}   {:>9s} {:>9s} {:>9s}'.format(
+                 'interface', 'pps', 'Mbps', 'kdrops', 'udrops', 'cb p50us', 'p99us', 'p99.9us')]
+
+    for sample in samples:
+        latency = sample['callback_latency_us'] or dict()
+        lines.append('{:<12s} {:>12.0f} {:>10.2f} {:>10d} {:>10d}   {:>9s} {:>9s} {:>9s}'.format(
+            sample['interface'], sample['pps'], sample['mbps'], sample['kernel_drops'],
+            sample['user_drops'],
+            *('{:.1f}'.format(latency[key]) if key in latency else '-'
+              for key in ('p50', 'p99', 'p99.9'))))
+
+    for sample in samples:
+        if sample['top_talkers']:
+            lines.append('')
+            lines.append('{} top talkers (frames since start)'.format(sample['interface']))
+            for mac, frames in sample['top_talkers']:
+                lines.append('    {}  {:>12d}'.format(mac, frames))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m rawsocket',
+                                     description='Live receive rates of raw socket interfaces')
+    parser.add_argument('interfaces', nargs='+', help='Interfaces to monitor')
+    parser.add_argument('--filter', default=None, help='BPF filter expression, see pcap-filter(7)')
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds between updates')
+    parser.add_argument('--duration', type=float, default=None, help='Seconds to run, default forever')
+    parser.add_argument('--top', type=int, default=5, help='Top talkers per interface, 0 for none')
+    parser.add_argument('--json', action='store_true', help='Write JSON lines instead of a terminal view')
+    parser.add_argument('--no-latency', action='store_true', help='Do not trace rx_callback latency')
+    parser.add_argument('--backend', default=IOPort.BACKEND_PACKET,
+                        choices=(IOPort.BACKEND_PACKET, IOPort.BACKEND_XDP, IOPort.BACKEND_SIM))
+    parser.add_argument('--engine', default=IOThread.ENGINE_SELECT,
+                        choices=(IOThread.ENGINE_SELECT, IOThread.ENGINE_URING))
+    parser.add_argument('--snaplen', type=int, default=None,
+                        help='Receive only the first snaplen octets of each frame')
+    parser.add_argument('--direction', default=IOPort.DIRECTION_IN,
+                        choices=(IOPort.DIRECTION_IN, IOPort.DIRECTION_OUT, IOPort.DIRECTION_INOUT))
+    args = parser.parse_args(argv)
+    if args.snaplen is not None and args.backend == IOPort.BACKEND_XDP:
+        parser.error('--snaplen is not supported by the xdp backend')
+
+    bpf_filter = BpfProgramFilter(args.filter) if args.filter else None
+    tracer = None if args.no_latency else Tracer()
+    io_thread = IOThread(engine=args.engine)
+    if tracer is not None:
+        io_thread.set_tracer(tracer)
+
+    def rx_callback(_frame):
+        pass
+
+    try:
+        for iface in args.interfaces:
+            io_thread.open(iface, rx_callback, bpf_filter=bpf_filter, backend=args.backend,
+                           direction=args.direction, snaplen=args.snaplen,
+                           classifier=TrafficClassifier(vlan=False, ethertype=False)
+                           if args.top else None)
+
+        monitor = Monitor(io_thread, args.interfaces, tracer=tracer, top_n=args.top)
+        end = time.monotonic() + args.duration if args.duration is not None else None
+
+        while end is None or time.monotonic() < end:
+            time.sleep(args.interval if end is None else
+                       max(0.0, min(args.interval, end - time.monotonic())))
+            samples = monitor.sample()
+            if args.json:
+                for sample in samples:
+                    print(json.dumps(sample), flush=True)
+            else:
+                print(CLEAR_SCREEN + render(samples, args.interval), flush=True)
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        io_thread.stop()
+    return 0
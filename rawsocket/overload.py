@@ -0,0 +1,192 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Receive path overload protection
+
+An OverloadGuard decides, frame by frame, whether a received frame is
+delivered to the rx_callback or shed. It enforces an optional rate cap and
+runs a watchdog over the time the callback takes per frame. When that time
+exceeds the budget the port degrades from NORMAL to SAMPLING (1 in N frames)
+and then to DROPPING (no frames). It steps back up one level only after the
+callback time has stayed below a fraction of the budget for several
+consecutive intervals.
+"""
+import time
+
+STATE_NORMAL = 'normal'
+STATE_SAMPLING = 'sampling'
+STATE_DROPPING = 'dropping'
+
+_LEVELS = (STATE_NORMAL, STATE_SAMPLING, STATE_DROPPING)
+
+
+class OverloadGuard(object):
+    """
+    Rate cap, sampling and load shedding for one port
+    """
+    def __init__(self, rate_limit=None, burst=None, sample_rate=10, callback_budget=None,
+                 recover_ratio=0.5, recover_intervals=3, interval=1.0, kernel_sampling=True):
+        """
+        Class initializer
+
+        :param rate_limit:        (float) Maximum frames per second delivered to the callback,
+                                          None for no cap
+        :param burst:             (int) Token bucket depth for rate_limit, default one second
+        :param sample_rate:       (int) Deliver 1 in sample_rate frames while SAMPLING
+        :param callback_budget:   (float) Seconds of callback time allowed per frame before
+                                          the port degrades, None to disable the watchdog
+        :param recover_ratio:     (float) Fraction of callback_budget the callback time must
+                                          stay below to recover
+        :param recover_intervals: (int) Consecutive healthy intervals needed to recover one level
+        :param interval:          (float) Watchdog interval in seconds
+        :param kernel_sampling:   (bool) Allow the port to sample in its kernel BPF filter
+        """
+        assert sample_rate >= 1, 'sample_rate must be at least one'
+
+        self._rate_limit = rate_limit
+        self._burst = burst if burst is not None else (rate_limit or 0)
+        self._tokens = self._burst
+        self._last_refill = time.monotonic()
+
+        self._sample_rate = sample_rate
+        self._sample_count = 0
+        self._kernel_sampling = kernel_sampling
+        self._in_kernel = False
+
+        self._budget = callback_budget
+        self._recover_ratio = recover_ratio
+        self._recover_intervals = recover_intervals
+        self._interval = interval
+        self._next_check = 0.0
+        self._healthy = 0
+
+        self._level = 0
+        self._transitions = 0
+        self._cb_seconds = 0.0
+        self._cb_frames = 0
+        self._kernel_admitted = 0
+
+    @property
+    def state(self):
+        return _LEVELS[self._level]
+
+    @property
+    def sample_rate(self):
+        return self._sample_rate
+
+    @property
+    def kernel_sampling(self):
+        return self._kernel_sampling
+
+    @property
+    def timed(self):
+        """True if callback times should be passed to record()"""
+        return self._budget is not None
+
+    def set_in_kernel(self, in_kernel):
+        """
+        Tell the guard whether the port's kernel filter is currently sampling
+
+        :param in_kernel: (bool) True if the kernel passes only 1 in sample_rate frames
+        """
+        self._in_kernel = in_kernel
+
+    def admit(self):
+        """
+        Decide whether a received frame is delivered
+
+        :return: (bool) True to deliver, False to shed
+        """
+        level = self._level
+        if level:
+            if level == 2:
+                return False
+
+            if not self._in_kernel:
+                self._sample_count += 1
+                if self._sample_count < self._sample_rate:
+                    return False
+                self._sample_count = 0
+
+        if self._rate_limit is not None:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._last_refill) * self._rate_limit)
+            self._last_refill = now
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+
+        if self._in_kernel:
+            self._kernel_admitted += 1
+        return True
+
+    def record(self, seconds):
+        """
+        Record the time a callback took for one frame
+
+        :param seconds: (float) Callback duration
+        """
+        self._cb_seconds += seconds
+        self._cb_frames += 1
+
+    def evaluate(self, now):
+        """
+        Run the watchdog
+
+        :param now: (float) Current time.monotonic()
+
+        :return: (str) the new state if it changed, otherwise None
+        """
+        if self._budget is None or now < self._next_check:
+            return None
+
+        self._next_check = now + self._interval
+        frames, self._cb_frames = self._cb_frames, 0
+        seconds, self._cb_seconds = self._cb_seconds, 0.0
+        per_frame = seconds / frames if frames else 0.0
+
+        if per_frame > self._budget:
+            self._healthy = 0
+            if self._level < len(_LEVELS) - 1:
+                return self._set_level(self._level + 1)
+
+        elif per_frame <= self._budget * self._recover_ratio:
+            self._healthy += 1
+            if self._level and self._healthy >= self._recover_intervals:
+                self._healthy = 0
+                return self._set_level(self._level - 1)
+        else:
+            self._healthy = 0
+
+        return None
+
+    def _set_level(self, level):
+        self._level = level
+        self._transitions += 1
+        self._sample_count = 0
+        return _LEVELS[level]
+
+    def statistics(self):
+        """
+        Get guard statistics
+
+        :return: (dict) statistics
+        """
+        return {
+            'overload_state': self.state,
+            'overload_transitions': self._transitions,
+            'overload_kernel_sampling': self._in_kernel,
+            # Frames dropped by kernel sampling are never seen, estimate them
+            'rx_shed_kernel_estimate': self._kernel_admitted * (self._sample_rate - 1),
+        }
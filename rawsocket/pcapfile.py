@@ -0,0 +1,286 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Capture file reading and writing
+
+PcapReader memory maps a classic libpcap file and PcapngReader a pcapng
+file. Both return every captured frame as a memoryview into the mapping,
+so frames are never copied. open_capture picks the reader from the file
+and write_pcap writes a classic libpcap file.
+"""
+import mmap
+import struct
+
+PCAP_MAGIC = 0xa1b2c3d4
+PCAP_MAGIC_NSEC = 0xa1b23c4d
+PCAPNG_SHB = 0x0a0d0d0a
+PCAPNG_BYTE_ORDER_MAGIC = 0x1a2b3c4d
+
+# pcapng block types
+_PCAPNG_IDB = 1
+_PCAPNG_SPB = 3
+_PCAPNG_EPB = 6
+_PCAPNG_IF_TSRESOL = 9
+
+LINKTYPE_ETHERNET = 1
+
+_FILE_HEADER_SIZE = 24
+_RECORD_HEADER_SIZE = 16
+
+
+class PcapReader(object):
+    """
+    Zero-copy reader for libpcap capture files
+    """
+    def __init__(self, path):
+        """
+        Class initializer
+
+        :param path: (str) Capture file name
+        """
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._view = memoryview(self._map)
+        if len(self._view) < _FILE_HEADER_SIZE:
+            self.close()
+            raise ValueError('{}: truncated file header'.format(path))
+
+        for order in ('<', '>'):
+            magic = struct.unpack_from(order + 'I', self._view)[0]
+            if magic in (PCAP_MAGIC, PCAP_MAGIC_NSEC):
+                break
+        else:
+            self.close()
+            raise ValueError('{}: not a pcap file'.format(path))
+
+        _, major, minor, _, _, self._snaplen, self._linktype = \
+            struct.unpack_from(order + 'IHHiIII', self._view)
+        self._version = (major, minor)
+        self._scale = 1e-9 if magic == PCAP_MAGIC_NSEC else 1e-6
+        self._record = struct.Struct(order + 'IIII')
+
+    @property
+    def linktype(self):
+        return self._linktype
+
+    @property
+    def snaplen(self):
+        return self._snaplen
+
+    @property
+    def version(self):
+        return self._version
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        """
+        Iterate over the captured frames
+
+        Frames are only valid until the reader is closed.
+
+        :return: (generator) of (timestamp, wire length, frame memoryview) tuples
+        """
+        view = self._view
+        unpack = self._record.unpack_from
+        scale = self._scale
+        offset = _FILE_HEADER_SIZE
+        end = len(view)
+
+        while offset + _RECORD_HEADER_SIZE <= end:
+            seconds, fraction, caplen, wire_len = unpack(view, offset)
+            offset += _RECORD_HEADER_SIZE
+            if offset + caplen > end:
+                break                       # Truncated final record, as left by an interrupted capture
+
+            yield seconds + fraction * scale, wire_len, view[offset:offset + caplen]
+            offset += caplen
+
+    def close(self):
+        if self._map is not None:
+            try:
+                self._view.release()
+                self._map.close()
+
+            except BufferError:
+                pass        # Frames are still referenced, the mapping goes when they do
+
+            self._map = None
+
+
+class PcapngReader(object):
+    """
+    Zero-copy reader for pcapng capture files
+
+    Enhanced and simple packet blocks are returned, other blocks are skipped.
+    Timestamps honour the if_tsresol option of each interface. A file may hold
+    several sections, each with its own byte order and interfaces.
+    """
+    def __init__(self, path):
+        """
+        Class initializer
+
+        :param path: (str) Capture file name
+        """
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._view = memoryview(self._map)
+        if len(self._view) < 28 or struct.unpack_from('<I', self._view)[0] != PCAPNG_SHB:
+            self.close()
+            raise ValueError('{}: not a pcapng file'.format(path))
+
+        # Link type and snap length of the first interface
+        self._linktype = LINKTYPE_ETHERNET
+        self._snaplen = 0
+        for _ in self._blocks(interfaces_only=True):
+            pass
+
+    @property
+    def linktype(self):
+        return self._linktype
+
+    @property
+    def snaplen(self):
+        return self._snaplen
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        """
+        Iterate over the captured frames
+
+        Frames are only valid until the reader is closed.
+
+        :return: (generator) of (timestamp, wire length, frame memoryview) tuples
+        """
+        return self._blocks()
+
+    def _blocks(self, interfaces_only=False):
+        view = self._view
+        end = len(view)
+        offset = 0
+        order = '<'
+        interfaces = []             # (snaplen, timestamp scale) per interface of the section
+        first = True
+
+        while offset + 12 <= end:
+            block_type, block_len = struct.unpack_from(order + 'II', view, offset)
+            if block_type == PCAPNG_SHB:
+                order = '<' if struct.unpack_from('<I', view, offset + 8)[0] == \
+                    PCAPNG_BYTE_ORDER_MAGIC else '>'
+                block_len = struct.unpack_from(order + 'I', view, offset + 4)[0]
+                interfaces = []
+
+            if block_len < 12 or offset + block_len > end:
+                break                       # Truncated final block, as left by an interrupted capture
+
+            body = offset + 8
+            if block_type == _PCAPNG_IDB:
+                linktype, _, snaplen = struct.unpack_from(order + 'HHI', view, body)
+                interfaces.append((snaplen, self._tsresol(view, order, body + 8,
+                                                          offset + block_len - 4)))
+                if first:
+                    first = False
+                    self._linktype, self._snaplen = linktype, snaplen
+                    if interfaces_only:
+                        return
+
+            elif interfaces_only:
+                pass
+
+            elif block_type == _PCAPNG_EPB:
+                if_id, high, low, caplen, wire_len = struct.unpack_from(order + 'IIIII', view, body)
+                scale = interfaces[if_id][1] if if_id < len(interfaces) else 1e-6
+                data = body + 20
+                yield ((high << 32) | low) * scale, wire_len, view[data:data + caplen]
+
+            elif block_type == _PCAPNG_SPB:
+                wire_len = struct.unpack_from(order + 'I', view, body)[0]
+                caplen = min(wire_len, block_len - 16)
+                if interfaces and interfaces[0][0]:
+                    caplen = min(caplen, interfaces[0][0])
+                yield None, wire_len, view[body + 4:body + 4 + caplen]
+
+            offset += block_len
+
+    @staticmethod
+    def _tsresol(view, order, offset, end):
+        """ Timestamp scale from the if_tsresol option of an interface description block """
+        while offset + 4 <= end:
+            code, length = struct.unpack_from(order + 'HH', view, offset)
+            if code == 0:
+                break                       # opt_endofopt
+            if code == _PCAPNG_IF_TSRESOL and length >= 1:
+                resolution = view[offset + 4]
+                return 2.0 ** -(resolution & 0x7f) if resolution & 0x80 else 10.0 ** -resolution
+            offset += 4 + ((length + 3) & ~3)
+        return 1e-6
+
+    def close(self):
+        if self._map is not None:
+            try:
+                self._view.release()
+                self._map.close()
+
+            except BufferError:
+                pass        # Frames are still referenced, the mapping goes when they do
+
+            self._map = None
+
+
+def open_capture(path):
+    """
+    Open a pcap or pcapng capture file
+
+    :param path: (str) Capture file name
+
+    :return: (PcapReader or PcapngReader) reader
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+
+    if len(magic) == 4 and struct.unpack('<I', magic)[0] == PCAPNG_SHB:
+        return PcapngReader(path)
+    return PcapReader(path)
+
+
+def write_pcap(path, records, snaplen=65535, linktype=LINKTYPE_ETHERNET):
+    """
+    Write frames to a classic libpcap file with microsecond timestamps
+
+    :param path:     (str) Capture file name
+    :param records:  (iterable) (timestamp, wire length, frame) tuples as returned by the readers
+    :param snaplen:  (int) Snap length recorded in the file header
+    :param linktype: (int) Link type of the frames
+    """
+    record = struct.Struct('<IIII')
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<IHHiIII', PCAP_MAGIC, 2, 4, 0, 0, snaplen, linktype))
+        for timestamp, wire_len, frame in records:
+            seconds = int(timestamp or 0)
+            micros = int(round(((timestamp or 0) - seconds) * 1e6))
+            if micros >= 1000000:
+                seconds, micros = seconds + 1, micros - 1000000
+            f.write(record.pack(seconds, micros, len(frame), wire_len))
+            f.write(frame)
@@ -0,0 +1,291 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Offline IOPort that replays capture files
+
+A PcapIOPort memory maps a pcap or pcapng file and delivers its frames to the
+rx_callback like a live port, so callbacks can be regression tested and
+captures analysed with unchanged application code:
+
+    io_thread.open('eth0', rx_callback, backend=IOPort.BACKEND_PCAP,
+                   capture='eth0.pcapng', timing=True)
+
+or, as fast as the callback allows, on the calling thread:
+
+    port = IOPort.create('eth0', rx_callback, backend=IOPort.BACKEND_PCAP,
+                         capture='eth0.pcap')
+    port.replay()
+"""
+import os
+import time
+import errno
+import threading
+
+from .ioport import IOPort, frame_segments
+from .bpf import BpfProgram
+from .pcapfile import open_capture
+
+
+class _Readiness(object):
+    """
+    A file descriptor that select reports readable while frames are due
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ready = False
+        self._read_fd, self._write_fd = os.pipe()
+
+    def fileno(self):
+        return self._read_fd
+
+    def set(self, ready):
+        with self._lock:
+            if ready != self._ready and self._read_fd is not None:
+                self._ready = ready
+                if ready:
+                    os.write(self._write_fd, b'\x00')
+                else:
+                    os.read(self._read_fd, 1)
+
+    def close(self):
+        with self._lock:
+            fds, self._read_fd, self._write_fd = (self._read_fd, self._write_fd), None, None
+        for fd in fds:
+            if fd is not None:
+                os.close(fd)
+
+
+class PcapIOPort(IOPort):
+    """
+    IOPort that replays a pcap or pcapng capture file
+
+    Frames are memoryviews into the mapped file and reach the rx_callback
+    without being copied. A callback that keeps a frame after it returns must
+    copy it (bytes(frame)). The bpf_filter runs in user space with the original
+    wire length, and accepted frames are truncated to its return value and to
+    snaplen as the kernel would.
+
+    Under an IOThread the port is readable while frames are due. That is
+    immediately unless timing is set, when frames are paced by their capture
+    timestamps. replay() delivers frames in a tight loop on the calling thread
+    instead. Frames sent on the port are counted and discarded, and direction
+    and vnet_hdr are not supported.
+    """
+    def __init__(self, iface_name, rx_callback, bpf_filter=None, verbose=False, capture=None,
+                 timing=False, speed=1.0, **kwargs):
+        """
+        Class initializer
+
+        :param iface_name:  (str) Interface name the port is known by
+        :param rx_callback: (func) Function to process received frames (memoryview)
+        :param bpf_filter:  (BpfProgramFilter) Berkley Packet Filter to filter Rx Frames
+        :param verbose:     (bool) True if verbose, debug output, should be shown
+        :param capture:     (str) pcap or pcapng file name, None to use iface_name
+        :param timing:      (bool) Deliver frames at the pace they were captured
+        :param speed:       (float) Replay speed multiplier when timing is set
+        :param kwargs:      Additional IOPort options
+        """
+        assert not kwargs.get('vnet_hdr'), 'vnet_hdr is not supported on capture file ports'
+        assert speed > 0, 'Replay speed must be positive'
+        self._socket = None
+        self._capture = capture or iface_name
+        self._timing = timing
+        self._speed = speed
+        self._reader = None
+        self._frames = None
+        self._pending = None            # Next (timestamp, wire length, frame) record
+        self._origin = None             # (monotonic time, capture timestamp) of the first frame
+        self._timer = None
+        self._finished = threading.Event()
+        self._program = None
+        self._capture_frames = 0
+        self._rx_filtered = 0
+        if kwargs.get('txtime') is not None:
+            raise ValueError('txtime is not supported on capture file ports')
+        super(PcapIOPort, self).__init__(iface_name, rx_callback, bpf_filter=bpf_filter,
+                                         verbose=verbose, **kwargs)
+
+    def _open_socket(self):
+        self._reader = open_capture(self._capture)
+        self._program = BpfProgram(self._filter.get_bpf()) if self._filter is not None else None
+        self._frames = iter(self._reader)
+        self._pending = next(self._frames, None)
+
+        readiness = _Readiness()
+        readiness.set(True)
+        return readiness
+
+    @property
+    def capture(self):
+        return self._capture
+
+    @property
+    def linktype(self):
+        return self._reader.linktype if self._reader is not None else None
+
+    @property
+    def finished(self):
+        """ True once every frame of the capture has been delivered """
+        return self._finished.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Wait until every frame of the capture has been delivered
+
+        :param timeout: (float) Seconds to wait, None to wait forever
+
+        :return: (bool) True if the capture is finished
+        """
+        return self._finished.wait(timeout)
+
+    def close(self):
+        timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+
+        super(PcapIOPort, self).close()
+        self._frames, self._pending = None, None
+
+        reader, self._reader = self._reader, None
+        if reader is not None:
+            reader.close()          # Deferred while the rx_callback still holds frames
+
+    def _take(self):
+        """ Take the next record """
+        self._capture_frames += 1
+        self._pending = next(self._frames, None)
+
+    def _finish(self):
+        """ Mark the port finished once the last frame has been delivered """
+        if self._pending is None and self._frames is not None and not self._finished.is_set():
+            sock = self._socket
+            if sock is not None:
+                sock.set(False)
+            self._finished.set()
+
+    def recv(self, nonblocking=False):
+        received = super(PcapIOPort, self).recv(nonblocking)
+        if self._pending is None:
+            self._finish()
+        return received
+
+    def _rcv_frame(self, nonblocking=False):
+        # Never blocks, a frame that is not yet due re-arms the readiness
+        # descriptor so the IOThread can service other ports meanwhile
+        program = self._program
+
+        while True:
+            record = self._pending
+            if record is None:
+                raise BlockingIOError(errno.EAGAIN, 'End of capture')
+
+            timestamp, wire_len, frame = record
+            if self._timing and timestamp is not None:
+                delay = self._delay(timestamp)
+                if delay > 0:
+                    self._wait_for(delay)
+                    raise BlockingIOError(errno.EAGAIN, 'No frame due')
+
+            self._take()
+            frame = self._accept(program, frame, wire_len)
+            if frame is not None:
+                return frame
+
+    def _accept(self, program, frame, wire_len):
+        """ Filter and truncate a frame as the kernel would, None if filtered """
+        limit = self._snaplen
+        if program is not None:
+            accepted = program(frame, wire_len)
+            if not accepted:
+                self._rx_filtered += 1
+                return None
+
+            if limit is None or accepted < limit:
+                limit = accepted
+
+        if self._snaplen is not None:
+            self._rx_wire_len = wire_len
+        return frame[:limit] if limit is not None and limit < len(frame) else frame
+
+    def _delay(self, timestamp):
+        """ Seconds until a frame captured at timestamp is due """
+        now = time.monotonic()
+        if self._origin is None:
+            self._origin = now, timestamp
+        start, first = self._origin
+        return start + (timestamp - first) / self._speed - now
+
+    def _wait_for(self, delay):
+        sock = self._socket
+        if sock is None:
+            return
+
+        sock.set(False)
+        timer = self._timer
+        if timer is None or not timer.is_alive():
+            self._timer = timer = threading.Timer(delay, sock.set, (True,))
+            timer.daemon = True
+            timer.start()
+
+    def replay(self, count=None):
+        """
+        Deliver the remaining frames to the rx_callback on the calling thread
+        as fast as possible, ignoring timing. Do not mix with an IOThread
+        servicing the same port.
+
+        :param count: (int) Maximum frames to take from the capture, None for all
+
+        :return: (int) frames taken from the capture
+        """
+        program = self._program
+        process = self._process_frame
+        taken = 0
+
+        while self._pending is not None and (count is None or taken < count):
+            _timestamp, wire_len, frame = self._pending
+            self._take()
+            taken += 1
+
+            frame = self._accept(program, frame, wire_len)
+            if frame is not None:
+                process(frame)
+
+        self._finish()
+        return taken
+
+    def _send_frame(self, frame, vnet_hdr=None, sock=None):
+        if vnet_hdr is not None:
+            raise ValueError('Port {} not opened with vnet_hdr'.format(self._iface_name))
+
+        if self._socket is None:
+            return -1
+        return frame_segments(frame)[1]
+
+    def statistics(self, top_n=None):
+        stats = super(PcapIOPort, self).statistics(top_n=top_n)
+        stats['backend'] = 'pcap'
+        stats['capture'] = self._capture
+        stats['capture_frames'] = self._capture_frames
+        stats['rx_filtered'] = self._rx_filtered
+        stats['finished'] = self.finished
+        return stats
+
+    def up(self):
+        return self
+
+    def down(self):
+        return self
+
+    def _get_mac_address(self):
+        return None
@@ -0,0 +1,240 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Flight recorder of the most recent frames of a port
+
+A FlightRecorder keeps the last N frames received and the last N frames sent
+on a port, each truncated to a snaplen, in two rings of fixed size slots
+allocated once. Recording a frame copies at most snaplen octets into its slot
+and stores the wire length and timestamp in preallocated arrays, so an
+always-on recorder adds no allocation to the receive and send paths. Its
+cost per frame can be measured with examples/pipeline_benchmark.py --recorder.
+
+    recorder = FlightRecorder(frames=4096, snaplen=128, trigger=lambda frame: ...,
+                              dump_dir='/var/tmp')
+    io_thread.open('eth0', rx_callback, recorder=recorder)
+    ...
+    io_thread.dump_recorder('eth0', 'eth0-failure.pcap')
+
+A trigger that matches a received frame, or a call to trigger(), dumps the
+rings to a pcap file in dump_dir on the next port tick, about a second later,
+so the file also holds the traffic that followed.
+"""
+import os
+import time
+from array import array
+from threading import Lock
+
+from .pcapfile import write_pcap, LINKTYPE_ETHERNET
+
+DIRECTION_RX = 'rx'
+DIRECTION_TX = 'tx'
+
+
+class _Ring(object):
+    """
+    Fixed memory ring of truncated frames for one direction
+    """
+    def __init__(self, slots, snaplen):
+        self.slots = slots
+        self.snaplen = snaplen
+        self.recorded = 0
+        self._next = 0
+        self._lock = Lock()             # Frames are sent from any thread
+        self._arena = bytearray(slots * snaplen)
+        self._view = memoryview(self._arena)
+        self._caplen = array('I', [0]) * slots
+        self._wire_len = array('I', [0]) * slots
+        self._time = array('d', [0.0]) * slots
+
+    def record(self, frame, now, wire_len=None):
+        """
+        Copy a frame into the oldest slot
+
+        :param frame:    (bytes) Frame, buffer protocol object or sequence of them
+        :param now:      (float) Timestamp
+        :param wire_len: (int) Original length if the frame was truncated, None if complete
+        """
+        snaplen = self.snaplen
+        view = self._view
+
+        # Segmented the way ioport.frame_segments does, any other buffer is copied as octets
+        if isinstance(frame, bytes):
+            segments = (frame,)
+        else:
+            segments = frame if isinstance(frame, (tuple, list)) else (frame,)
+            segments = [segment if isinstance(segment, bytes) else memoryview(segment).cast('B')
+                        for segment in segments]
+
+        with self._lock:
+            index = self._next
+            self._next = index + 1 if index + 1 < self.slots else 0
+            self.recorded += 1
+            offset = index * snaplen
+
+            length = caplen = 0
+            for segment in segments:
+                size = len(segment)
+                room = snaplen - caplen
+                if room > 0:
+                    part = size if size <= room else room
+                    view[offset + caplen:offset + caplen + part] = \
+                        segment if part == size else memoryview(segment)[:part]
+                    caplen += part
+                length += size
+
+            self._caplen[index] = caplen
+            self._wire_len[index] = length if wire_len is None else wire_len
+            self._time[index] = now
+
+    def snapshot(self):
+        """
+        Copy the recorded frames out of the ring
+
+        :return: (list) (timestamp, wire length, frame) tuples, oldest first
+        """
+        with self._lock:
+            count = min(self.recorded, self.slots)
+            first = self._next if self.recorded > self.slots else 0
+            snaplen = self.snaplen
+            records = []
+            for n in range(count):
+                index = (first + n) % self.slots
+                offset = index * snaplen
+                records.append((self._time[index], self._wire_len[index],
+                                bytes(self._view[offset:offset + self._caplen[index]])))
+        return records
+
+    def clear(self):
+        with self._lock:
+            self._next = 0
+            self.recorded = 0
+
+
+class FlightRecorder(object):
+    """
+    Fixed memory recorder of the most recent frames received and sent on a port
+
+    A recorder belongs to a single port.
+    """
+    def __init__(self, frames=1024, snaplen=128, octets=None, trigger=None, dump_dir=None,
+                 linktype=LINKTYPE_ETHERNET):
+        """
+        Class initializer
+
+        :param frames:   (int) Frames kept per direction
+        :param snaplen:  (int) Octets kept of each frame
+        :param octets:   (int) Arena size per direction, overrides frames if given
+        :param trigger:  (func) Called with each received frame, a true result dumps the
+                                recorder to dump_dir. A BpfProgramFilter may be used.
+        :param dump_dir: (str) Directory of triggered dumps, None for the current directory
+        :param linktype: (int) pcap link type of dumped files
+        """
+        assert snaplen > 0, 'snaplen must be positive'
+        if octets is not None:
+            frames = octets // snaplen
+        assert frames > 0, 'The recorder must hold at least one frame'
+
+        self._rx = _Ring(frames, snaplen)
+        self._tx = _Ring(frames, snaplen)
+        self._trigger = trigger
+        self._dump_dir = dump_dir or '.'
+        self._linktype = linktype
+        self._triggered = False
+        self._triggers = 0
+        self._dumps = 0
+        self.last_dump = None
+
+    @property
+    def snaplen(self):
+        return self._rx.snaplen
+
+    @property
+    def frames(self):
+        return self._rx.slots
+
+    def rx(self, frame, wire_len=None):
+        """ Record a received frame, wire_len is its original length if it was truncated """
+        self._rx.record(frame, time.time(), wire_len)
+        trigger = self._trigger
+        if trigger is not None and not self._triggered and trigger(frame):
+            self.trigger()
+
+    def tx(self, frame):
+        """ Record a sent frame """
+        self._tx.record(frame, time.time())
+
+    def trigger(self):
+        """ Dump the recorder to dump_dir on the next tick of its port """
+        self._triggered = True
+        self._triggers += 1
+
+    def records(self, direction=None):
+        """
+        Copy of the recorded frames
+
+        :param direction: (str) DIRECTION_RX or DIRECTION_TX, None for both
+
+        :return: (list) (timestamp, wire length, frame) tuples in time order
+        """
+        if direction == DIRECTION_RX:
+            return self._rx.snapshot()
+        if direction == DIRECTION_TX:
+            return self._tx.snapshot()
+        return sorted(self._rx.snapshot() + self._tx.snapshot(), key=lambda record: record[0])
+
+    def dump(self, path, direction=None):
+        """
+        Write the recorded frames to a pcap file
+
+        :param path:      (str) File name
+        :param direction: (str) DIRECTION_RX or DIRECTION_TX, None for both
+
+        :return: (int) frames written
+        """
+        records = self.records(direction)
+        write_pcap(path, records, snaplen=self.snaplen, linktype=self._linktype)
+        self._dumps += 1
+        self.last_dump = path
+        return len(records)
+
+    def tick(self, name):
+        """
+        Write a triggered dump, called on the I/O thread by the port
+
+        :param name: (str) Interface name, used in the file name
+
+        :return: (str) file written, None if not triggered
+        """
+        if not self._triggered:
+            return None
+
+        self._triggered = False
+        path = os.path.join(self._dump_dir, '{}-{}.pcap'.format(
+            name, time.strftime('%Y%m%d-%H%M%S')))
+        self.dump(path)
+        return path
+
+    def clear(self):
+        self._rx.clear()
+        self._tx.clear()
+
+    def statistics(self):
+        return {
+            'recorder_rx_frames': self._rx.recorded,
+            'recorder_tx_frames': self._tx.recorded,
+            'recorder_triggers': self._triggers,
+            'recorder_dumps': self._dumps,
+            'recorder_octets': 2 * self._rx.slots * self._rx.snaplen,
+        }
@@ -0,0 +1,190 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Bounded receive queue for pull-mode consumers
+
+A ReceiveQueue is a fixed array of slots used as a ring. The I/O thread
+stores frame references into the slots and consumers take them out with
+get() or get_many(). No per-frame queue nodes are allocated. A consumer is
+woken only when it is actually waiting, one consumer per arriving frame
+batch, rather than every waiter on every frame.
+"""
+from threading import Lock, Condition
+
+OVERFLOW_DROP_NEWEST = 'drop-newest'
+OVERFLOW_DROP_OLDEST = 'drop-oldest'
+
+
+class ReceiveQueue(object):
+    """
+    Bounded single-producer, multi-consumer frame ring
+    """
+    DEFAULT_SIZE = 4096
+
+    def __init__(self, size=DEFAULT_SIZE, overflow=OVERFLOW_DROP_NEWEST):
+        """
+        Class initializer
+
+        :param size:     (int) Number of frames the queue can hold, rounded up to a power of two
+        :param overflow: (str) OVERFLOW_DROP_NEWEST to drop arriving frames when full, or
+                               OVERFLOW_DROP_OLDEST to replace the oldest queued frame
+        """
+        assert size > 0, 'size must be positive'
+        assert overflow in (OVERFLOW_DROP_NEWEST, OVERFLOW_DROP_OLDEST), 'Invalid overflow policy'
+
+        size = 1 << (size - 1).bit_length()
+        self._slots = [None] * size
+        self._mask = size - 1
+        self._head = 0              # Next slot to read
+        self._tail = 0              # Next slot to write
+        self._drop_oldest = overflow == OVERFLOW_DROP_OLDEST
+        self._closed = False
+
+        self._lock = Lock()
+        self._not_empty = Condition(self._lock)
+        self._waiters = 0
+
+        self._enqueued = 0
+        self._drops = 0
+        self._high_water = 0
+
+    def __len__(self):
+        return self._tail - self._head
+
+    @property
+    def capacity(self):
+        return len(self._slots)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def put(self, frame, vnet_hdr=None):
+        """
+        Queue a received frame, usable directly as an rx_callback
+
+        :param frame:    (bytes) Received frame
+        :param vnet_hdr: (VirtioNetHdr) Header of a vnet_hdr port's frame, the frame is
+                                        then queued as a (frame, vnet_hdr) tuple
+
+        :return: (bool) True if queued, False if dropped
+        """
+        if vnet_hdr is not None:
+            frame = (frame, vnet_hdr)
+
+        with self._lock:
+            depth = self._tail - self._head
+            if depth > self._mask:
+                self._drops += 1
+                if not self._drop_oldest:
+                    return False
+
+                self._slots[self._head & self._mask] = None
+                self._head += 1
+                depth -= 1
+
+            self._slots[self._tail & self._mask] = frame
+            self._tail += 1
+            self._enqueued += 1
+            if depth >= self._high_water:
+                self._high_water = depth + 1
+
+            if self._waiters:
+                self._not_empty.notify()
+        return True
+
+    def _wait(self, timeout):
+        # Called with the lock held, returns True once a frame is queued
+        if self._tail != self._head:
+            return True
+
+        if self._closed or (timeout is not None and timeout <= 0):
+            return False
+
+        self._waiters += 1
+        try:
+            return self._not_empty.wait_for(lambda: self._tail != self._head or self._closed,
+                                            timeout) and self._tail != self._head
+        finally:
+            self._waiters -= 1
+
+    def get(self, timeout=None):
+        """
+        Take the oldest frame from the queue
+
+        :param timeout: (float) Seconds to wait for a frame, None to wait forever, 0 to poll
+
+        :return: (bytes) frame, None on timeout or if the queue was closed
+        """
+        with self._lock:
+            if not self._wait(timeout):
+                return None
+
+            index = self._head & self._mask
+            frame, self._slots[index] = self._slots[index], None
+            self._head += 1
+
+            if self._waiters and self._tail != self._head:
+                self._not_empty.notify()        # Pass the remaining frames on
+            return frame
+
+    def get_many(self, max_frames, timeout=None):
+        """
+        Take up to max_frames frames, waiting only until at least one is queued
+
+        :param max_frames: (int) Maximum number of frames to return
+        :param timeout:    (float) Seconds to wait for the first frame, None to wait
+                                   forever, 0 to poll
+
+        :return: (list) frames, oldest first, empty on timeout or if the queue was closed
+        """
+        with self._lock:
+            if not self._wait(timeout):
+                return []
+
+            head = self._head
+            count = min(max_frames, self._tail - head)
+            slots = self._slots
+            mask = self._mask
+            frames = [None] * count
+            for offset in range(count):
+                index = (head + offset) & mask
+                frames[offset], slots[index] = slots[index], None
+
+            self._head = head + count
+            if self._waiters and self._tail != self._head:
+                self._not_empty.notify()
+            return frames
+
+    def close(self):
+        """
+        Wake all waiting consumers, frames still queued can be read afterwards
+        """
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+
+    def statistics(self):
+        """
+        Get queue statistics
+
+        :return: (dict) statistics
+        """
+        return {
+            'rx_queue_depth': len(self),
+            'rx_queue_capacity': self.capacity,
+            'rx_queue_enqueued': self._enqueued,
+            'rx_queue_drops': self._drops,
+            'rx_queue_high_water': self._high_water,
+        }
@@ -0,0 +1,189 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Process based receive engine
+
+A ReceiveWorker runs an IOThread in a child process that owns the raw socket
+for an interface. Received frames are written into a SharedFrameRing, so the
+parent reads them in batches straight out of shared memory, without pickling
+and without competing with the receive path for the GIL.
+"""
+import os
+import struct
+
+from .shmring import SharedFrameRing, BACKPRESSURE_DROP
+
+_VLAN_TPIDS = (0x8100, 0x88a8)
+
+
+class _BpfInstructions(object):
+    """ Compiled BPF instructions, usable anywhere a BpfProgramFilter is """
+    def __init__(self, instructions):
+        self._instructions = instructions
+
+    def get_bpf(self):
+        return self._instructions
+
+
+def _worker_main(iface, instructions, ring_name, wakeup_fd, stop_event, backpressure, port_options):
+    # Imported here so the parent does not need the child's dependencies loaded
+    from .iothread import IOThread
+
+    os.set_blocking(wakeup_fd, False)
+    ring = SharedFrameRing.attach(ring_name, wakeup_fd=wakeup_fd, backpressure=backpressure)
+    write = ring.write
+    unpack_tag = struct.Struct('!HH').unpack_from
+
+    snapped = port_options.get('snaplen') is not None
+
+    def rx_callback(frame, *_vnet_hdr):
+        # Frames too short for a tag are written untagged, a vnet_hdr is not kept
+        tpid, tci = unpack_tag(frame, 12) if len(frame) >= 16 else (0, 0)
+        write(frame, vlan=tci if tpid in _VLAN_TPIDS else None,
+              wire_len=io_thread.port(iface)._rx_wire_len if snapped else None)
+
+    bpf_filter = _BpfInstructions(instructions) if instructions is not None else None
+    io_thread = IOThread()
+
+    try:
+        io_thread.open(iface, rx_callback, bpf_filter=bpf_filter, **port_options)
+        stop_event.wait()
+
+    finally:
+        io_thread.stop(1.0)
+        ring.close()
+
+
+class ReceiveWorker(object):
+    """
+    Receive frames for an interface in a worker process
+    """
+    def __init__(self, iface, bpf_filter=None, ring_size=SharedFrameRing.DEFAULT_SIZE,
+                 backpressure=BACKPRESSURE_DROP, mp_context=None, **port_options):
+        """
+        Class initializer
+
+        :param iface:        (str) Interface Name to open in the worker
+        :param bpf_filter:   (BpfProgramFilter) Berkley Packet Filter to filter Rx Frames. Only
+                                                its compiled instructions are sent to the worker
+        :param ring_size:    (int) Size of the shared memory ring data area in octets
+        :param backpressure: (str) 'drop' to count and drop frames when the ring is full,
+                                   'block' to stall the worker until the consumer catches up
+        :param mp_context:   (BaseContext) multiprocessing context, default is 'spawn'
+        :param port_options: Additional IOPort options for the worker's port
+        """
+        if mp_context is None:
+            import multiprocessing      # Slow to import, load only when a worker is started
+            mp_context = multiprocessing.get_context('spawn')
+
+        ctx = mp_context
+        self._iface = iface
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self._ring = SharedFrameRing.create(ring_size, wakeup_fd=self._wakeup_r)
+        self._stop_event = ctx.Event()
+
+        instructions = bpf_filter.get_bpf() if bpf_filter is not None else None
+
+        self._process = ctx.Process(target=_worker_main,
+                                    name='rawsocket-rx-{}'.format(iface),
+                                    args=(iface, instructions, self._ring.name,
+                                          _FdArg(self._wakeup_w), self._stop_event,
+                                          backpressure, port_options),
+                                    daemon=True)
+
+    def __del__(self):
+        self.stop(0.0)
+
+    @property
+    def name(self):
+        return self._iface
+
+    @property
+    def ring(self):
+        """Consumer side of the worker's frame ring"""
+        return self._ring
+
+    @property
+    def is_running(self):
+        return self._process is not None and self._process.is_alive()
+
+    def start(self):
+        """
+        Start the worker process
+
+        :return: (ReceiveWorker) self reference
+        """
+        self._process.start()
+        os.close(self._wakeup_w)
+        self._wakeup_w = None
+        return self
+
+    def stop(self, timeout=None):
+        """
+        Stop the worker process and release the ring. Reading the ring afterwards
+        returns no frames
+
+        :param timeout: (float) Seconds to wait for the worker to exit before it is
+                                terminated, None to wait indefinitely
+
+        :return: (ReceiveWorker) self reference
+        """
+        process, self._process = self._process, None
+        if process is None:
+            return self
+
+        self._stop_event.set()
+        if process.pid is not None:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join(1.0)
+
+        ring, self._ring = self._ring, None
+        if ring is not None:
+            ring.close()
+
+        for fd in (self._wakeup_r, self._wakeup_w):
+            if fd is not None:
+                os.close(fd)
+        self._wakeup_r = self._wakeup_w = None
+        return self
+
+    def statistics(self):
+        """
+        Get worker and ring statistics
+
+        :return: (dict) statistics
+        """
+        ring = self._ring
+        stats = ring.statistics() if ring is not None else dict()
+        stats['worker_running'] = self.is_running
+        return stats
+
+
+class _FdArg(int):
+    """
+    A file descriptor argument for the worker process
+
+    The 'spawn' start method only passes descriptors it knows about, so the
+    descriptor is duplicated into the child through multiprocessing's
+    reduction support.
+    """
+    def __reduce__(self):
+        from multiprocessing import reduction
+        return _rebuild_fd, (reduction.DupFd(int(self)),)
+
+
+def _rebuild_fd(dup_fd):
+    return dup_fd.detach()
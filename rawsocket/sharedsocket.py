@@ -0,0 +1,343 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+One AF_PACKET socket serving many interfaces
+
+A SharedPacketSocket is bound to all interfaces and hands each received
+frame to the SharedIOPort of the interface it arrived on, looked up by
+sll_ifindex in a dict. Its kernel filter passes only frames of member
+interfaces (see bpf.by_ifindex), so the kernel runs each frame past one
+socket and one filter however many interfaces are open. Member BPF filters
+are evaluated in user space.
+
+Linux only.
+"""
+import os
+import errno
+import socket
+from threading import Lock
+
+from .ioport import IOPort, frame_bytes
+from .afpacket import enable_auxdata, bind_all, PacketReceiver, PacketSender, MSG_DONTWAIT
+from .util import get_if_index, set_promiscuous_mode, set_busy_poll, set_socket_buffer, \
+    get_packet_statistics, attach_filter, detach_filter
+from .bpf import BpfProgram, by_ifindex, PACKET_OUTGOING
+
+
+class SharedPacketSocket(object):
+    """
+    Unbound AF_PACKET socket dispatching frames by interface index
+    """
+    def __init__(self, name='shared', verbose=False, busy_poll=0, rcvbuf=None, sndbuf=None,
+                 rcv_size=IOPort.RCV_SIZE_DEFAULT):
+        """
+        Class initializer
+
+        :param name:      (str) Name for statistics and debug output
+        :param verbose:   (bool) True if verbose, debug output, should be shown
+        :param busy_poll: (int) Microseconds for SO_BUSY_POLL, zero to disable
+        :param rcvbuf:    (int) Socket receive buffer size, shared by all members
+        :param sndbuf:    (int) Socket send buffer size, shared by all members
+        :param rcv_size:  (int) Largest frame received
+        """
+        self._name = name
+        self._verbose = verbose
+        self._members = dict()          # ifindex -> SharedIOPort
+        self._filter_dirty = False
+        self._prefilter = False
+
+        self._rx_unknown = 0
+        self._rx_kernel_packets = 0
+        self._rx_kernel_drops = 0
+        self._kernel_stats_lock = Lock()
+        self._filter_updates = 0
+
+        s = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+        try:
+            enable_auxdata(s)
+            if rcvbuf is not None:
+                set_socket_buffer(s, rcvbuf, receive=True)
+            if sndbuf is not None:
+                set_socket_buffer(s, sndbuf, receive=False)
+
+            # Pass nothing until interfaces join, then bind to all interfaces
+            attach_filter(s, by_ifindex(None, ()))
+            bind_all(s)
+
+            if busy_poll and not set_busy_poll(s, busy_poll):
+                if verbose:
+                    print('SO_BUSY_POLL not permitted on {}'.format(name))
+
+        except Exception as _e:
+            s.close()
+            raise
+
+        self._socket = s
+        self._receiver = PacketReceiver(s, rcv_size, sockaddr=True)
+
+    def __len__(self):
+        return len(self._members)
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def socket(self):
+        return self._socket
+
+    def fileno(self):
+        sock = self._socket
+        return sock.fileno() if sock is not None else None
+
+    def add(self, port):
+        """
+        Add a member interface, frames are passed to it after the next sync()
+
+        :param port: (SharedIOPort) Port of the interface
+
+        :return: (int) interface index
+        """
+        ifindex = get_if_index(port.name, self._socket)
+        assert ifindex not in self._members, 'Interface already a member'
+
+        set_promiscuous_mode(self._socket, port.name, True)
+        self._members[ifindex] = port
+        self._filter_dirty = True
+        return ifindex
+
+    def remove(self, port):
+        """
+        Remove a member interface
+
+        :param port: (SharedIOPort) Port of the interface
+        """
+        for ifindex, member in list(self._members.items()):
+            if member is port:
+                del self._members[ifindex]
+                self._filter_dirty = True
+                try:
+                    set_promiscuous_mode(self._socket, port.name, False)
+
+                except OSError as _e:
+                    pass        # Interface may already be gone
+
+    def sync(self):
+        """
+        Update the kernel filter after members were added or removed. Called by the
+        I/O thread so a burst of opens causes a single update.
+        """
+        sock = self._socket
+        if not self._filter_dirty or sock is None:
+            return
+
+        self._filter_dirty = False
+        program = by_ifindex(None, self._members.keys())
+        if program is not None:
+            attach_filter(sock, program)
+            self._prefilter = True
+        else:
+            detach_filter(sock)         # Too many members, dispatch drops the rest
+            self._prefilter = False
+        self._filter_updates += 1
+
+    def recv(self, nonblocking=False):
+        """
+        Receive one frame and pass it to its interface's port
+
+        :param nonblocking: (bool) If True, return immediately if no frame is waiting
+
+        :return: (bool) True if a frame was read from the socket
+        """
+        if self._filter_dirty:
+            self.sync()
+
+        receiver = self._receiver
+        try:
+            frame = receiver.recv(MSG_DONTWAIT if nonblocking else 0)
+
+        except BlockingIOError:
+            return False
+
+        except RuntimeError as _e:
+            return False
+
+        port = self._members.get(receiver.ifindex)
+        if port is None:
+            self._rx_unknown += 1
+        else:
+            port._deliver(frame, receiver.pkttype)
+        return True
+
+    def tick(self, now):
+        """
+        Periodic housekeeping of the socket and its members
+
+        :param now: (float) Current time.monotonic()
+        """
+        self.sync()
+        for port in list(self._members.values()):
+            port.tick(now)
+
+    def close(self):
+        sock, self._socket = self._socket, None
+        self._members.clear()
+        if sock is not None:
+            sock.close()
+
+    def statistics(self):
+        """
+        Get statistics of the shared socket
+
+        :return: (dict) statistics
+        """
+        with self._kernel_stats_lock:          # PACKET_STATISTICS resets on each read
+            sock = self._socket
+            if sock is not None:
+                packets, drops = get_packet_statistics(sock)
+                self._rx_kernel_packets += packets
+                self._rx_kernel_drops += drops
+
+        return {
+            'shared_socket': self._name,
+            'shared_members': len(self._members),
+            'shared_prefilter': self._prefilter,
+            'shared_filter_updates': self._filter_updates,
+            'shared_rx_unknown': self._rx_unknown,
+            'shared_rx_kernel_packets': self._rx_kernel_packets,
+            'shared_rx_kernel_drops': self._rx_kernel_drops,
+        }
+
+
+class SharedIOPort(IOPort):
+    """
+    IOPort for one interface of a SharedPacketSocket
+
+    Socket level options (busy_poll, rcvbuf, sndbuf, rcvbuf_tuner) belong to
+    the shared socket. vnet_hdr, snaplen and tx_pool are not supported.
+    """
+    def __init__(self, iface_name, rx_callback, shared, bpf_filter=None, verbose=False, **kwargs):
+        """
+        Class initializer
+
+        :param iface_name:  (str) Interface Name to open
+        :param rx_callback: (func) Function to process received frames (bytes)
+        :param shared:      (SharedPacketSocket) Socket to join
+        :param bpf_filter:  (BpfProgramFilter) Filter evaluated in user space for this interface
+        :param verbose:     (bool) True if verbose, debug output, should be shown
+        :param kwargs:      Additional IOPort options
+        """
+        assert not kwargs.get('vnet_hdr'), 'vnet_hdr is not supported on a shared socket'
+        self._shared = shared
+        self._socket = None
+        self._ifindex = None
+        self._rx_filtered = 0
+        self._rx_direction_suppressed = 0
+        if kwargs.get('snaplen') is not None:
+            raise ValueError('snaplen is not supported on a shared socket')
+        if kwargs.get('tx_pool'):
+            raise ValueError('tx_pool is not supported on a shared socket')
+        if kwargs.get('txtime') is not None:
+            raise ValueError('txtime is not supported on a shared socket')
+        super(SharedIOPort, self).__init__(iface_name, rx_callback, bpf_filter=bpf_filter,
+                                           verbose=verbose, **kwargs)
+
+    def _open_socket(self):
+        self._user_filter = BpfProgram(self._filter.get_bpf()) if self._filter is not None else None
+        self._ifindex = self._shared.add(self)
+        self._sender = PacketSender(self._shared.socket, self._ifindex)
+        return self._shared
+
+    @property
+    def ifindex(self):
+        return self._ifindex
+
+    def fileno(self):
+        return None         # Received through the shared socket
+
+    def _deliver(self, frame, pkttype):
+        """ Called by the shared socket with a frame received on this interface """
+        direction = self._direction
+        if direction != self.DIRECTION_INOUT and \
+                (pkttype == PACKET_OUTGOING) != (direction == self.DIRECTION_OUT):
+            self._rx_direction_suppressed += 1
+            return
+
+        user_filter = self._user_filter
+        if user_filter is not None and not user_filter(frame):
+            self._rx_filtered += 1
+            return
+
+        self._process_frame(frame)
+
+    def _rcv_frame(self, nonblocking=False):
+        raise NotImplementedError('Frames are received through the shared socket')
+
+    def _send_frame(self, frame, vnet_hdr=None, sock=None):
+        if vnet_hdr is not None:
+            raise ValueError('Port {} not opened with vnet_hdr'.format(self._iface_name))
+
+        if self._socket is None:
+            return -1
+
+        # sendto() through the cached sockaddr_ll needs the frame in one buffer
+        frame = frame_bytes(frame)
+        length = len(frame)
+        if self._must_pad and length < self.MIN_PKT_SIZE:
+            return min(self._sender.send(self._pad_frame(frame)), length)
+
+        try:
+            return self._sender.send(frame)
+
+        except OSError as err:
+            if err.errno == errno.EINVAL and length < self.MIN_PKT_SIZE:
+                self._must_pad = True
+                return min(self._sender.send(self._pad_frame(frame)), length)
+            raise
+
+    def close(self):
+        self._rx_callback = None
+        shared, self._socket = self._socket, None
+        pool = getattr(self, '_tx_pool', None)
+        if pool is not None:
+            pool.close()
+        if shared is not None:
+            shared.remove(self)
+
+    def statistics(self, top_n=None):
+        stats = super(SharedIOPort, self).statistics(top_n=top_n)
+        stats['ifindex'] = self._ifindex
+        stats['rx_filtered'] = self._rx_filtered
+        if self._direction != self.DIRECTION_INOUT:
+            stats['rx_direction'] = self._direction
+            stats['rx_direction_mode'] = 'user'
+            stats['rx_direction_suppressed'] = self._rx_direction_suppressed
+        stats.update(self._shared.statistics())
+        return stats
+
+    def up(self):
+        os.system('ip link set {} up'.format(self._iface_name))
+        return self
+
+    def down(self):
+        os.system('ip link set {} down'.format(self._iface_name))
+        return self
+
+    def _get_mac_address(self):
+        try:
+            with open('/sys/class/net/{}/address'.format(self._iface_name)) as f:
+                return f.read().strip().replace(':', '').encode()
+
+        except OSError as _e:
+            return None
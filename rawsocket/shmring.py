@@ -0,0 +1,393 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Single producer / single consumer frame ring in shared memory
+
+The ring is a multiprocessing.shared_memory segment holding a small header
+followed by a data area of variable length frame records. The producer and
+consumer each own one free-running 64-bit position counter in the header, so
+neither side ever writes the other's position and no lock is needed.
+
+Each record is 8-octet aligned and starts with:
+
+    u32 record length (header + frame + alignment)
+    u32 captured length, or PAD_RECORD for filler up to the end of the data area
+    u32 wire length
+    u16 VLAN TCI
+    u16 flags (RECORD_VLAN_VALID)
+    u64 timestamp (nanoseconds since the epoch)
+
+Positions are published with plain stores and there is no fence between a
+side's store and its load of the other side's field. Even x86 (TSO) may
+reorder that store after the load, so the producer can miss ARMED while the
+consumer misses the new TAIL. wait() therefore never sleeps more than
+WAIT_POLL seconds at a time before re-checking TAIL, a missed wakeup costs at
+most that latency.
+"""
+import os
+import time
+import select
+import struct
+
+RING_MAGIC = 0x52534852         # 'RSHR'
+RING_VERSION = 1
+
+# Header layout. Producer and consumer fields are kept on separate cache lines
+_HDR_MAGIC = 0                  # u32 magic, u32 version, u64 data area size
+_HDR_HEAD = 64                  # u64 consumer position
+_HDR_CONSUMED = 72              # u64 frames consumed
+_HDR_ARMED = 80                 # u32 consumer waiting for a wakeup
+_HDR_TAIL = 128                 # u64 producer position
+_HDR_COUNTERS = 136             # u64 frames, octets, dropped frames, dropped octets
+_HDR_CLOSED = 168               # u32 producer has exited
+HEADER_SIZE = 256
+
+_magic = struct.Struct('=IIQ')
+_u64 = struct.Struct('=Q')
+_u32 = struct.Struct('=I')
+_counters = struct.Struct('=QQQQ')
+_record = struct.Struct('=IIIHHQ')
+
+RECORD_HEADER_SIZE = _record.size
+RECORD_VLAN_VALID = 1 << 0
+
+PAD_RECORD = 0xFFFFFFFF
+
+BACKPRESSURE_DROP = 'drop'
+BACKPRESSURE_BLOCK = 'block'
+
+WAIT_POLL = 0.01                # Longest sleep in wait() before re-checking TAIL
+
+
+def _align(length):
+    return (length + 7) & ~7
+
+
+class SharedFrameRing(object):
+    """
+    One side (producer or consumer) of a shared memory frame ring
+    """
+    DEFAULT_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, shm, producer, owner, wakeup_fd=None, backpressure=BACKPRESSURE_DROP):
+        """
+        Class initializer. Use SharedFrameRing.create or SharedFrameRing.attach
+
+        :param shm:          (SharedMemory) Shared memory segment
+        :param producer:     (bool) True if this is the producer side
+        :param owner:        (bool) True if this side unlinks the segment on close
+        :param wakeup_fd:    (int) Pipe descriptor used for wakeups, read end for
+                                   the consumer and write end for the producer
+        :param backpressure: (str) Producer policy when the ring is full, BACKPRESSURE_DROP
+                                   to count and drop the frame, BACKPRESSURE_BLOCK to wait
+        """
+        assert backpressure in (BACKPRESSURE_DROP, BACKPRESSURE_BLOCK), \
+            'Invalid backpressure policy: {}'.format(backpressure)
+
+        self._shm = shm
+        self._buf = shm.buf
+        self._producer = producer
+        self._owner = owner
+        self._wakeup_fd = wakeup_fd
+        self._backpressure = backpressure
+
+        magic, version, self._capacity = _magic.unpack_from(self._buf, _HDR_MAGIC)
+        if magic != RING_MAGIC or version != RING_VERSION:
+            raise ValueError('{} is not a frame ring'.format(shm.name))
+
+        # Each side caches its own position and the counters it owns
+        self._head = _u64.unpack_from(self._buf, _HDR_HEAD)[0]
+        self._tail = _u64.unpack_from(self._buf, _HDR_TAIL)[0]
+        self._frames, self._octets, self._dropped, self._dropped_octets = \
+            _counters.unpack_from(self._buf, _HDR_COUNTERS)
+        self._consumed = _u64.unpack_from(self._buf, _HDR_CONSUMED)[0]
+
+    @staticmethod
+    def create(size=DEFAULT_SIZE, wakeup_fd=None):
+        """
+        Create a new ring and return its consumer side
+
+        :param size:      (int) Size of the data area in octets
+        :param wakeup_fd: (int) Read end of the wakeup pipe
+
+        :return: (SharedFrameRing) consumer
+        """
+        from multiprocessing import shared_memory     # Slow to import, load only when used
+
+        size = _align(size)
+        shm = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + size)
+        shm.buf[:HEADER_SIZE] = bytes(HEADER_SIZE)
+        _magic.pack_into(shm.buf, _HDR_MAGIC, RING_MAGIC, RING_VERSION, size)
+
+        return SharedFrameRing(shm, False, True, wakeup_fd=wakeup_fd)
+
+    @staticmethod
+    def attach(name, wakeup_fd=None, backpressure=BACKPRESSURE_DROP):
+        """
+        Attach to an existing ring as its producer
+
+        :param name:         (str) Shared memory segment name
+        :param wakeup_fd:    (int) Write end of the wakeup pipe
+        :param backpressure: (str) Policy when the ring is full
+
+        :return: (SharedFrameRing) producer
+        """
+        from multiprocessing import shared_memory
+
+        shm = shared_memory.SharedMemory(name=name)
+        return SharedFrameRing(shm, True, False, wakeup_fd=wakeup_fd, backpressure=backpressure)
+
+    @property
+    def name(self):
+        """Shared memory segment name"""
+        return self._shm.name
+
+    @property
+    def capacity(self):
+        """Size of the data area in octets"""
+        return self._capacity
+
+    @property
+    def closed(self):
+        """True if the producer has closed its side of the ring, or this side is closed"""
+        buf = self._buf
+        return buf is None or _u32.unpack_from(buf, _HDR_CLOSED)[0] != 0
+
+    def __len__(self):
+        """Octets currently queued in the ring"""
+        buf = self._buf
+        if buf is None:
+            return 0
+        return _u64.unpack_from(buf, _HDR_TAIL)[0] - _u64.unpack_from(buf, _HDR_HEAD)[0]
+
+    def close(self):
+        """
+        Close this side of the ring. The producer marks the ring closed and wakes
+        the consumer, the consumer (owner) unlinks the shared memory.
+        """
+        shm, self._shm = self._shm, None
+        if shm is None:
+            return
+
+        if self._producer:
+            _u32.pack_into(self._buf, _HDR_CLOSED, 1)
+            self._wakeup()
+
+        self._buf = None
+        try:
+            shm.close()
+            if self._owner:
+                shm.unlink()
+
+        except Exception as _e:
+            pass
+
+    ######################################################################
+    # Producer
+
+    def write(self, frame, timestamp=None, vlan=None, wire_len=None):
+        """
+        Append a frame to the ring
+
+        :param frame:     (bytes) Frame data
+        :param timestamp: (int) Receive time in nanoseconds, None for now
+        :param vlan:      (int) VLAN TCI of the outer tag, None if untagged
+        :param wire_len:  (int) Original frame length if frame is truncated
+
+        :return: (bool) True if written, False if dropped
+        """
+        buf = self._buf
+        length = len(frame)
+        size = _align(RECORD_HEADER_SIZE + length)
+        capacity = self._capacity
+        tail = self._tail
+        offset = tail % capacity
+        contiguous = capacity - offset
+        needed = size if contiguous >= size else contiguous + size
+
+        while capacity - (tail - _u64.unpack_from(buf, _HDR_HEAD)[0]) < needed:
+            if self._backpressure == BACKPRESSURE_DROP or needed > capacity:
+                self._dropped += 1
+                self._dropped_octets += length
+                _counters.pack_into(buf, _HDR_COUNTERS, self._frames, self._octets,
+                                    self._dropped, self._dropped_octets)
+                return False
+
+            time.sleep(0.0001)
+
+        if contiguous < size:
+            # Not enough room before the end of the data area, fill it and wrap
+            _record.pack_into(buf, HEADER_SIZE + offset, contiguous, PAD_RECORD, 0, 0, 0, 0)
+            tail += contiguous
+            offset = 0
+
+        start = HEADER_SIZE + offset
+        _record.pack_into(buf, start, size, length,
+                          length if wire_len is None else wire_len,
+                          vlan or 0, 0 if vlan is None else RECORD_VLAN_VALID,
+                          time.time_ns() if timestamp is None else timestamp)
+        start += RECORD_HEADER_SIZE
+        buf[start:start + length] = frame
+
+        self._tail = tail = tail + size
+        self._frames += 1
+        self._octets += length
+        _counters.pack_into(buf, _HDR_COUNTERS, self._frames, self._octets,
+                            self._dropped, self._dropped_octets)
+        _u64.pack_into(buf, _HDR_TAIL, tail)
+
+        if _u32.unpack_from(buf, _HDR_ARMED)[0]:
+            _u32.pack_into(buf, _HDR_ARMED, 0)
+            self._wakeup()
+
+        return True
+
+    def _wakeup(self):
+        if self._wakeup_fd is not None:
+            try:
+                os.write(self._wakeup_fd, b'\x00')
+
+            except OSError as _e:
+                pass    # Pipe full, a wakeup is already pending
+
+    ######################################################################
+    # Consumer
+
+    def fileno(self):
+        """
+        Wakeup descriptor for use with select. It only becomes readable after
+        wait() has armed the wakeup, so prefer wait() or read_batch(timeout=...)
+        """
+        return self._wakeup_fd
+
+    def consume(self, callback, max_frames=256):
+        """
+        Pass queued frames to a callback without copying them out of shared memory
+
+        The memoryview passed to the callback is only valid during the call.
+
+        :param callback:   (func) Called as callback(frame, wire_len, vlan, timestamp),
+                                  vlan is None for untagged frames
+        :param max_frames: (int) Maximum number of frames to consume
+
+        :return: (int) number of frames consumed, 0 once this side is closed
+        """
+        buf = self._buf
+        if buf is None:
+            return 0
+
+        capacity = self._capacity
+        head = self._head
+        tail = _u64.unpack_from(buf, _HDR_TAIL)[0]
+        count = 0
+
+        while head < tail and count < max_frames:
+            start = HEADER_SIZE + head % capacity
+            size, length, wire_len, tci, flags, timestamp = _record.unpack_from(buf, start)
+            head += size
+
+            if length == PAD_RECORD:
+                continue
+
+            start += RECORD_HEADER_SIZE
+            callback(buf[start:start + length], wire_len,
+                     tci if flags & RECORD_VLAN_VALID else None, timestamp)
+            count += 1
+
+        if head != self._head:
+            self._head = head
+            self._consumed += count
+            _u64.pack_into(buf, _HDR_CONSUMED, self._consumed)
+            _u64.pack_into(buf, _HDR_HEAD, head)
+
+        return count
+
+    def read_batch(self, max_frames=256, timeout=0.0):
+        """
+        Read a batch of frames
+
+        :param max_frames: (int) Maximum number of frames to return
+        :param timeout:    (float) Seconds to wait if the ring is empty, None to wait forever
+
+        :return: (list) of (frame, wire_len, vlan, timestamp) tuples, frame is bytes
+        """
+        frames = []
+        append = frames.append
+
+        def copy(frame, wire_len, vlan, timestamp):
+            append((bytes(frame), wire_len, vlan, timestamp))
+
+        if not self.consume(copy, max_frames) and timeout != 0.0 and self.wait(timeout):
+            self.consume(copy, max_frames)
+
+        return frames
+
+    def wait(self, timeout=None):
+        """
+        Wait for the producer to add a frame or close the ring. The TAIL is
+        re-checked at least every WAIT_POLL seconds in case a wakeup was missed
+
+        :param timeout: (float) Seconds to wait, None to wait forever
+
+        :return: (bool) True if frames are available
+        """
+        buf = self._buf
+        if buf is None:
+            return False
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            _u32.pack_into(buf, _HDR_ARMED, 1)
+            if _u64.unpack_from(buf, _HDR_TAIL)[0] != self._head:
+                _u32.pack_into(buf, _HDR_ARMED, 0)
+                return True
+
+            if self.closed:
+                return False
+
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+
+            if self._wakeup_fd is None:
+                time.sleep(min(0.001, remaining or 0.001))
+                continue
+
+            poll = WAIT_POLL if remaining is None else min(WAIT_POLL, remaining)
+            ready, _, _ = select.select([self._wakeup_fd], [], [], poll)
+            if ready:
+                try:
+                    os.read(self._wakeup_fd, 4096)
+
+                except OSError as _e:
+                    pass
+
+    def statistics(self):
+        """
+        Get ring statistics
+
+        :return: (dict) statistics
+        """
+        buf = self._buf
+        frames, octets, dropped, dropped_octets = _counters.unpack_from(buf, _HDR_COUNTERS)
+        return {
+            'ring_frames': frames,
+            'ring_octets': octets,
+            'ring_dropped': dropped,
+            'ring_dropped_octets': dropped_octets,
+            'ring_consumed': _u64.unpack_from(buf, _HDR_CONSUMED)[0],
+            'ring_queued_octets': len(self),
+            'ring_capacity': self._capacity,
+        }
@@ -0,0 +1,444 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Simulated network for unprivileged testing
+
+A SimNetwork holds virtual interfaces. Each has a bounded in-process
+frame queue with a pipe that is readable while frames are waiting, so a
+SimIOPort is serviced by the IOThread select loop exactly like a socket.
+Virtual links connect interfaces, optionally with random loss, and
+TrafficGenerator threads inject frames at a configured rate.
+
+    network = simnet.default_network
+    network.link('sim0', 'sim1')
+    io_thread.open('sim0', rx_callback, backend='sim')
+    network.generate('sim0', frames, rate=100000, count=1000000)
+
+Frames that arrive while an interface's queue is full are counted as
+kernel drops, as a full socket buffer would be. No privileges or real
+interfaces are needed.
+"""
+import os
+import time
+import errno
+import random
+import select
+import threading
+from collections import deque
+from zlib import crc32
+
+from .ioport import IOPort, frame_bytes
+from .bpf import BpfProgram
+
+
+class SimInterface(object):
+    """
+    A virtual interface with the receive queue of the port opened on it
+    """
+    QUEUE_SIZE = 4096
+
+    def __init__(self, name, queue_size=QUEUE_SIZE):
+        """
+        Class initializer
+
+        :param name:       (str) Interface name
+        :param queue_size: (int) Frames held before further frames are dropped
+        """
+        self.name = name
+        self.up = True
+        self.filter = None          # BpfProgram of the open port
+        self.queue_size = queue_size
+
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._signalled = False
+        self._read_fd, self._write_fd = os.pipe()
+
+        self.rx_frames = 0
+        self.rx_drops = 0
+        self.rx_filtered = 0
+        self.rx_down = 0
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def mac_address(self):
+        """Locally administered MAC derived from the interface name"""
+        return b'02' + '{:010x}'.format(crc32(self.name.encode()) & 0xffffffffff).encode()
+
+    def fileno(self):
+        return self._read_fd
+
+    def put(self, frame):
+        """
+        Deliver a frame to the interface
+
+        :param frame: (bytes) Frame
+
+        :return: (bool) True if queued
+        """
+        if not self.up:
+            self.rx_down += 1
+            return False
+
+        program = self.filter
+        if program is not None and not program(frame):
+            self.rx_filtered += 1
+            return False
+
+        with self._lock:
+            queue = self._queue
+            if len(queue) >= self.queue_size:
+                self.rx_drops += 1
+                return False
+
+            queue.append(frame)
+            self.rx_frames += 1
+            if not self._signalled:
+                self._signalled = True
+                os.write(self._write_fd, b'\x00')
+        return True
+
+    def get(self, nonblocking=False, timeout=None):
+        """
+        Take the oldest frame
+
+        :param nonblocking: (bool) If True, raise BlockingIOError if no frame is waiting
+        :param timeout:     (float) Seconds to wait for a blocking get
+
+        :return: (bytes) frame
+        """
+        while True:
+            with self._lock:
+                queue = self._queue
+                if queue:
+                    frame = queue.popleft()
+                    if not queue:
+                        self._signalled = False
+                        os.read(self._read_fd, 1)
+                    return frame
+
+            if nonblocking:
+                raise BlockingIOError(errno.EAGAIN, 'No frame waiting')
+
+            if not select.select([self._read_fd], [], [], timeout)[0]:
+                raise BlockingIOError(errno.EAGAIN, 'No frame waiting')
+
+    def clear(self):
+        """ Discard queued frames and reset the counters """
+        with self._lock:
+            self._queue.clear()
+            self.rx_frames = self.rx_drops = self.rx_filtered = self.rx_down = 0
+            if self._signalled:
+                self._signalled = False
+                os.read(self._read_fd, 1)
+
+    def close(self):
+        fds, self._read_fd, self._write_fd = (self._read_fd, self._write_fd), None, None
+        for fd in fds:
+            if fd is not None:
+                os.close(fd)
+
+
+class SimNetwork(object):
+    """
+    Virtual interfaces and the links between them
+    """
+    def __init__(self):
+        self._interfaces = dict()       # name -> SimInterface
+        self._links = dict()            # name -> {peer name: loss probability}
+        self._lock = threading.Lock()
+        self._random = random.Random()
+
+    def interface(self, name, queue_size=SimInterface.QUEUE_SIZE):
+        """
+        Get a virtual interface, creating it if needed
+
+        :param name:       (str) Interface name
+        :param queue_size: (int) Receive queue size of a new interface
+
+        :return: (SimInterface) interface
+        """
+        with self._lock:
+            iface = self._interfaces.get(name)
+            if iface is None:
+                iface = SimInterface(name, queue_size)
+                self._interfaces[name] = iface
+                self._links.setdefault(name, dict())
+            return iface
+
+    def remove(self, name):
+        """
+        Remove a virtual interface and its links
+
+        :param name: (str) Interface name
+        """
+        with self._lock:
+            iface = self._interfaces.pop(name, None)
+            for peers in self._links.values():
+                peers.pop(name, None)
+            self._links.pop(name, None)
+
+        if iface is not None:
+            iface.close()
+
+    def link(self, a, b, loss=0.0, bidirectional=True):
+        """
+        Connect two interfaces, frames sent on one are received on the other
+
+        :param a:             (str) Interface name
+        :param b:             (str) Interface name
+        :param loss:          (float) Probability a frame is lost on the link
+        :param bidirectional: (bool) False to only carry frames from a to b
+        """
+        self.interface(a)
+        self.interface(b)
+        with self._lock:
+            self._links[a][b] = loss
+            if bidirectional:
+                self._links[b][a] = loss
+
+    def unlink(self, a, b):
+        with self._lock:
+            self._links.get(a, {}).pop(b, None)
+            self._links.get(b, {}).pop(a, None)
+
+    def transmit(self, name, frame):
+        """
+        Carry a frame sent on an interface to its link peers
+
+        :param name:  (str) Sending interface
+        :param frame: (bytes) Frame
+
+        :return: (int) number of peers the frame was queued on
+        """
+        delivered = 0
+        rand = self._random.random
+        for peer, loss in self._links.get(name, {}).items():
+            if loss and rand() < loss:
+                continue
+
+            iface = self._interfaces.get(peer)
+            if iface is not None and iface.put(frame):
+                delivered += 1
+        return delivered
+
+    def inject(self, name, frame):
+        """
+        Deliver a frame to an interface as if received from the wire
+
+        :return: (bool) True if queued
+        """
+        return self.interface(name).put(frame)
+
+    def generate(self, name, frames, rate=None, count=None, loss=0.0, start=True):
+        """
+        Inject a stream of frames into an interface
+
+        :param name:   (str) Interface name
+        :param frames: (bytes or list) Frame or frames to send, repeated in order
+        :param rate:   (float) Frames per second, None as fast as possible
+        :param count:  (int) Frames to send, None until stopped
+        :param loss:   (float) Probability a frame is lost before the interface
+        :param start:  (bool) Start the generator thread
+
+        :return: (TrafficGenerator) generator
+        """
+        generator = TrafficGenerator(self.interface(name), frames, rate=rate, count=count,
+                                     loss=loss)
+        return generator.start() if start else generator
+
+
+default_network = SimNetwork()
+
+
+class TrafficGenerator(threading.Thread):
+    """
+    Thread injecting frames into a virtual interface at a fixed rate
+    """
+    BURST = 64          # Frames injected between rate checks
+
+    def __init__(self, iface, frames, rate=None, count=None, loss=0.0):
+        """
+        Class initializer
+
+        :param iface:  (SimInterface) Interface to inject into
+        :param frames: (bytes or list) Frame or frames to send, repeated in order
+        :param rate:   (float) Frames per second, None as fast as possible
+        :param count:  (int) Frames to send, None until stopped
+        :param loss:   (float) Probability a frame is lost before the interface
+        """
+        super(TrafficGenerator, self).__init__(name='TrafficGenerator-{}'.format(iface.name),
+                                               daemon=True)
+        self._iface = iface
+        self._frames = [frames] if isinstance(frames, (bytes, bytearray)) else list(frames)
+        self._rate = rate
+        self._count = count
+        self._loss = loss
+        self._stopped = False
+
+        self.sent = 0
+        self.lost = 0
+        self.dropped = 0
+        self.elapsed = 0.0
+
+    def start(self):
+        super(TrafficGenerator, self).start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stopped = True
+        if self.is_alive():
+            self.join(timeout)
+        return self
+
+    def run(self):
+        put = self._iface.put
+        frames = self._frames
+        nframes = len(frames)
+        rate, count, loss = self._rate, self._count, self._loss
+        rand = random.Random().random
+        clock = time.perf_counter
+        start = clock()
+        index = 0
+
+        while not self._stopped and (count is None or self.sent < count):
+            burst = self.BURST if count is None else min(self.BURST, count - self.sent)
+            for _ in range(burst):
+                frame = frames[index]
+                index = index + 1 if index + 1 < nframes else 0
+                self.sent += 1
+                if loss and rand() < loss:
+                    self.lost += 1
+                elif not put(frame):
+                    self.dropped += 1
+
+            if rate:
+                delay = start + self.sent / rate - clock()
+                if delay > 0:
+                    time.sleep(delay)
+
+        self.elapsed = clock() - start
+
+    def statistics(self):
+        return {
+            'sent': self.sent,
+            'lost': self.lost,
+            'dropped': self.dropped,
+            'elapsed': self.elapsed,
+            'rate': self.sent / self.elapsed if self.elapsed else None,
+        }
+
+
+class SimIOPort(IOPort):
+    """
+    IOPort on a virtual interface of a SimNetwork
+
+    The bpf_filter is evaluated as frames arrive, before they are queued,
+    as the kernel would. A snaplen truncates frames as they are received.
+    vnet_hdr and tx_pool are not supported.
+    """
+    def __init__(self, iface_name, rx_callback, bpf_filter=None, verbose=False, network=None,
+                 sim_queue_size=None, **kwargs):
+        """
+        Class initializer
+
+        :param iface_name:  (str) Virtual interface name, created if needed
+        :param rx_callback: (func) Function to process received frames (bytes)
+        :param bpf_filter:  (BpfProgramFilter) Berkley Packet Filter to filter Rx Frames
+        :param verbose:     (bool) True if verbose, debug output, should be shown
+        :param network:     (SimNetwork) Network of the interface, None for default_network
+        :param sim_queue_size: (int) Receive queue size of the interface, None to keep its
+                                     size. Named apart from the queue_size of pull mode ports
+                                     in IOThread.open
+        :param kwargs:      Additional IOPort options
+        """
+        assert not kwargs.get('vnet_hdr'), 'vnet_hdr is not supported on simulated ports'
+        self._socket = None
+        if kwargs.get('tx_pool'):
+            raise ValueError('tx_pool is not supported on simulated ports')
+        if kwargs.get('txtime') is not None:
+            raise ValueError('txtime is not supported on simulated ports')
+        self._network = network if network is not None else default_network
+        self._queue_size = sim_queue_size
+        self._iface = None
+        super(SimIOPort, self).__init__(iface_name, rx_callback, bpf_filter=bpf_filter,
+                                        verbose=verbose, **kwargs)
+
+    def _open_socket(self):
+        iface = self._network.interface(self._iface_name)
+        if self._queue_size is not None:
+            iface.queue_size = self._queue_size
+        assert iface.filter is None, 'Interface already has an open port'
+        iface.filter = BpfProgram(self._filter.get_bpf()) if self._filter is not None else None
+        iface.clear()
+        self._iface = iface
+        return iface
+
+    @property
+    def network(self):
+        return self._network
+
+    def close(self):
+        self._rx_callback = None
+        iface, self._socket = self._socket, None
+        pool = getattr(self, '_tx_pool', None)
+        if pool is not None:
+            pool.close()
+        if iface is not None:
+            iface.filter = None
+
+    def _rcv_frame(self, nonblocking=False):
+        frame = self._iface.get(nonblocking, self.RCV_TIMEOUT)
+        snaplen = self._snaplen
+        if snaplen is not None:
+            self._rx_wire_len = len(frame)
+            if len(frame) > snaplen:
+                frame = frame[:snaplen]
+        return frame
+
+    def _send_frame(self, frame, vnet_hdr=None, sock=None):
+        if vnet_hdr is not None:
+            raise ValueError('Port {} not opened with vnet_hdr'.format(self._iface_name))
+
+        if self._socket is None:
+            return -1
+
+        if not self._iface.up:
+            raise OSError(errno.ENETDOWN, os.strerror(errno.ENETDOWN))
+
+        frame = frame_bytes(frame)      # Queued frames must not change after send returns
+        self._network.transmit(self._iface_name, frame)
+        return len(frame)
+
+    def statistics(self, top_n=None):
+        stats = super(SimIOPort, self).statistics(top_n=top_n)
+        iface = self._iface
+        stats['backend'] = 'sim'
+        stats['rx_kernel_packets'] = iface.rx_frames
+        stats['rx_kernel_drops'] = iface.rx_drops
+        stats['rx_filtered'] = iface.rx_filtered
+        return stats
+
+    def up(self):
+        self._iface.up = True
+        return self
+
+    def down(self):
+        self._iface.up = False
+        return self
+
+    def _get_mac_address(self):
+        return self._iface.mac_address
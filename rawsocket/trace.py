@@ -0,0 +1,328 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Profiling and tracing hooks for the rx/tx hot paths
+
+A Tracer is attached to ports and I/O threads with set_tracer() and can be
+attached, replaced or removed at any time. With no tracer attached the hot
+paths only test a None attribute.
+
+Each traced operation ('rx', 'tx' and 'loop' for an I/O thread iteration)
+reports its start time and a list of (stage, end time) marks. A Tracer keeps
+a Histogram of every stage per operation and port, and turns 1 in N
+operations into spans passed to an exporter. OpenTelemetryExporter forwards
+those spans to an OpenTelemetry tracer.
+
+Stages are, in order:
+    rx:   recvmsg, vlan (AF_PACKET syscall and VLAN tag reconstruction), or recv
+          on other platforms, then classify and callback. Frames received by the
+          io_uring engine's multishot recvmsg only have classify and callback
+    tx:   send
+    loop: select, dispatch, spin (busy polling) and tick
+"""
+import os
+import time
+from threading import Lock
+from collections import namedtuple
+
+Span = namedtuple('Span', 'name trace_id span_id parent_id start_ns end_ns attributes')
+Span.__doc__ = """
+A finished span, times are in nanoseconds since the epoch as OpenTelemetry uses
+"""
+
+
+class Histogram(object):
+    """
+    Fixed memory log-linear histogram of non-negative integers
+
+    Values are counted in buckets whose width is 1/SUB_BUCKETS of their
+    power of two, so percentiles are accurate to about 6%.
+    """
+    SUB_BITS = 4
+    SUB_BUCKETS = 1 << SUB_BITS
+    MAX_BITS = 48               # Larger values are counted in the last bucket
+
+    __slots__ = ('_counts', '_count', '_total', '_min', '_max')
+
+    def __init__(self):
+        self._counts = [0] * ((self.MAX_BITS - self.SUB_BITS + 1) * self.SUB_BUCKETS)
+        self._count = 0
+        self._total = 0
+        self._min = None
+        self._max = 0
+
+    def __len__(self):
+        return self._count
+
+    @classmethod
+    def _index(cls, value):
+        shift = value.bit_length() - cls.SUB_BITS - 1
+        if shift <= 0:
+            return value
+        return min(shift * cls.SUB_BUCKETS + (value >> shift),
+                   (cls.MAX_BITS - cls.SUB_BITS + 1) * cls.SUB_BUCKETS - 1)
+
+    @classmethod
+    def _upper(cls, index):
+        if index < 2 * cls.SUB_BUCKETS:
+            return index
+        shift = index // cls.SUB_BUCKETS - 1
+        return ((index - shift * cls.SUB_BUCKETS + 1) << shift) - 1
+
+    def record(self, value):
+        """
+        Count a value
+
+        :param value: (int) Value such as a duration in nanoseconds, negative values count as 0
+        """
+        value = int(value) if value > 0 else 0
+        self._counts[self._index(value)] += 1
+        self._count += 1
+        self._total += value
+        if self._min is None or value < self._min:
+            self._min = value
+        if value > self._max:
+            self._max = value
+
+    def merge(self, other):
+        """
+        Add the counts of another histogram
+
+        :param other: (Histogram) Histogram to add
+        """
+        counts = self._counts
+        for index, count in enumerate(other._counts):
+            if count:
+                counts[index] += count
+        self._count += other._count
+        self._total += other._total
+        if other._min is not None and (self._min is None or other._min < self._min):
+            self._min = other._min
+        self._max = max(self._max, other._max)
+
+    def percentile(self, percent):
+        """
+        Get the value below which a percentage of the values fall
+
+        :param percent: (float) Percentile, 0 to 100
+
+        :return: (int) upper bound of the percentile's bucket, None if empty
+        """
+        if not self._count:
+            return None
+
+        rank = max(1, int(round(self._count * percent / 100.0)))
+        last = len(self._counts) - 1
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank:
+                return self._max if index == last else min(self._upper(index), self._max)
+        return self._max
+
+    def clear(self):
+        self._counts = [0] * len(self._counts)
+        self._count = 0
+        self._total = 0
+        self._min = None
+        self._max = 0
+
+    def snapshot(self):
+        """
+        Get a summary of the histogram
+
+        :return: (dict) count, min, max, mean and the 50/90/99/99.9th percentiles
+        """
+        count = self._count
+        return {
+            'count': count,
+            'min': self._min,
+            'max': self._max if count else None,
+            'mean': self._total / count if count else None,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p99.9': self.percentile(99.9),
+        }
+
+
+class Tracer(object):
+    """
+    Per-stage timing histograms and sampled span export
+    """
+    def __init__(self, histograms=True, sample_rate=0, exporter=None):
+        """
+        Class initializer
+
+        :param histograms:  (bool) Keep a histogram of every stage
+        :param sample_rate: (int) Export spans for 1 in sample_rate operations, 0 to disable
+        :param exporter:    (func) Called as exporter(spans) with the list of Spans of one
+                                   sampled operation, root span first. Called on the I/O thread
+                                   so it should hand the spans off rather than block.
+        """
+        assert sample_rate >= 0, 'sample_rate must not be negative'
+        assert not sample_rate or exporter is not None, 'sampling requires an exporter'
+
+        self._histograms = histograms
+        self._sample_rate = sample_rate
+        self._exporter = exporter
+        self._stages = dict()           # (operation, name) -> {stage: Histogram}
+        self._operations = 0
+        self._countdown = sample_rate
+        self._sampled = 0
+        self._export_errors = 0
+        self._lock = Lock()             # record() runs on the I/O thread and sending threads
+
+        # perf_counter_ns is monotonic with an arbitrary origin, spans need epoch times
+        self._epoch_offset = time.time_ns() - time.perf_counter_ns()
+
+    @property
+    def sample_rate(self):
+        return self._sample_rate
+
+    def record(self, operation, name, start, marks, attributes=None):
+        """
+        Record one traced operation
+
+        :param operation:  (str) Operation such as 'rx', 'tx' or 'loop'
+        :param name:       (str) Port or thread name
+        :param start:      (int) time.perf_counter_ns() when the operation started
+        :param marks:      (list) of (stage, time.perf_counter_ns()) at the end of each stage
+        :param attributes: (dict) Extra span attributes, only used if sampled
+        """
+        export = False
+        with self._lock:
+            self._operations += 1
+
+            if self._histograms:
+                key = (operation, name)
+                stages = self._stages.get(key)
+                if stages is None:
+                    stages = self._stages[key] = dict()
+
+                last = start
+                for stage, end in marks:
+                    histogram = stages.get(stage)
+                    if histogram is None:
+                        histogram = stages[stage] = Histogram()
+                    histogram.record(end - last)
+                    last = end
+
+            if self._sample_rate:
+                self._countdown -= 1
+                if self._countdown <= 0:
+                    self._countdown = self._sample_rate
+                    self._sampled += 1
+                    export = True
+
+        if export:
+            self._export(operation, name, start, marks, attributes)
+
+    def _export(self, operation, name, start, marks, attributes):
+        offset = self._epoch_offset
+        trace_id = int.from_bytes(os.urandom(16), 'big')
+        root_id = int.from_bytes(os.urandom(8), 'big')
+        root_attributes = {'rawsocket.name': name}
+        if attributes:
+            root_attributes.update(attributes)
+
+        end = marks[-1][1] if marks else start
+        spans = [Span('rawsocket.' + operation, trace_id, root_id, None,
+                      start + offset, end + offset, root_attributes)]
+
+        last = start
+        for index, (stage, mark) in enumerate(marks):
+            spans.append(Span('rawsocket.{}.{}'.format(operation, stage), trace_id,
+                              root_id + index + 1 & 0xffffffffffffffff, root_id,
+                              last + offset, mark + offset, {}))
+            last = mark
+
+        try:
+            self._exporter(spans)
+
+        except Exception as _e:
+            with self._lock:
+                self._export_errors += 1
+
+    def histograms(self, operation=None, name=None):
+        """
+        Get the stage histograms
+
+        :param operation: (str) Only this operation, None for all
+        :param name:      (str) Only this port or thread, None for all
+
+        :return: (dict) (operation, name) -> {stage: Histogram}
+        """
+        with self._lock:
+            return {key: dict(stages) for key, stages in self._stages.items()
+                    if (operation is None or key[0] == operation) and
+                    (name is None or key[1] == name)}
+
+    def clear(self):
+        with self._lock:
+            self._stages.clear()
+            self._operations = 0
+            self._sampled = 0
+            self._export_errors = 0
+
+    def statistics(self):
+        """
+        Get tracer statistics
+
+        :return: (dict) statistics, with stage histogram summaries under
+                        'stages'[operation][name][stage]
+        """
+        stages = dict()
+        with self._lock:
+            for (operation, name), histograms in self._stages.items():
+                stages.setdefault(operation, dict())[name] = \
+                    {stage: histogram.snapshot() for stage, histogram in histograms.items()}
+
+        return {
+            'traced_operations': self._operations,
+            'sampled_operations': self._sampled,
+            'export_errors': self._export_errors,
+            'stages': stages,
+        }
+
+
+class OpenTelemetryExporter(object):
+    """
+    Span exporter that forwards sampled operations to OpenTelemetry
+
+    The opentelemetry-api package is only imported when an exporter is created.
+    """
+    def __init__(self, tracer=None):
+        """
+        Class initializer
+
+        :param tracer: (opentelemetry.trace.Tracer) Tracer to create spans with, None
+                                                    for the global tracer provider's
+        """
+        from opentelemetry import trace
+
+        self._trace = trace
+        self._tracer = tracer or trace.get_tracer('rawsocket')
+
+    def __call__(self, spans):
+        root, children = spans[0], spans[1:]
+        otel_root = self._tracer.start_span(root.name, start_time=root.start_ns,
+                                            attributes=root.attributes)
+        context = self._trace.set_span_in_context(otel_root)
+
+        for span in children:
+            self._tracer.start_span(span.name, context=context, start_time=span.start_ns,
+                                    attributes=span.attributes).end(end_time=span.end_ns)
+
+        otel_root.end(end_time=root.end_ns)
@@ -0,0 +1,374 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Request/response transactions over raw frames
+
+A TransactionLayer sends request frames and returns a future for each. The
+future completes with the first received frame whose response key matches
+the request's key, or fails with TimeoutError. Outstanding requests are held
+in a single dict indexed by (interface, key), so matching a response is
+O(1). Timeouts are kept in a hierarchical TimerWheel, so any number of
+outstanding requests costs no more than a few dict operations each, with no
+per-request timer objects.
+"""
+import time
+from threading import Lock
+
+from .trace import Histogram
+
+
+class _Timer(object):
+    __slots__ = ('tick', 'item', 'bucket')
+
+    def __init__(self, tick, item):
+        self.tick = tick
+        self.item = item
+        self.bucket = None
+
+
+class TimerWheel(object):
+    """
+    Hierarchical timing wheel (Varghese and Lauck)
+
+    Level 0 has one slot per tick. Each higher level has slots covering a
+    whole rotation of the level below and its timers cascade down as their
+    slot comes up, so scheduling and cancelling are O(1) and every timer is
+    moved at most once per level.
+    """
+    def __init__(self, resolution=0.01, slot_bits=8, levels=4, now=None):
+        """
+        Class initializer
+
+        :param resolution: (float) Seconds per tick, timers expire up to one tick late
+        :param slot_bits:  (int) log2 of the number of slots per level
+        :param levels:     (int) Number of levels. Timers further out than
+                                 resolution * 2 ** (slot_bits * levels) are re-cascaded
+        :param now:        (float) Start time, default time.monotonic()
+        """
+        self._resolution = resolution
+        self._bits = slot_bits
+        self._mask = (1 << slot_bits) - 1
+        self._levels = [[dict() for _ in range(1 << slot_bits)] for _ in range(levels)]
+        self._tick = int((time.monotonic() if now is None else now) / resolution)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def resolution(self):
+        return self._resolution
+
+    def schedule(self, deadline, item):
+        """
+        Add a timer
+
+        :param deadline: (float) time.monotonic() at which the timer expires
+        :param item:     Value returned by advance() when the timer expires
+
+        :return: (object) handle for cancel()
+        """
+        tick = -int(-deadline // self._resolution)          # Round up, never expire early
+        timer = _Timer(max(tick, self._tick + 1), item)
+        self._place(timer)
+        self._count += 1
+        return timer
+
+    def cancel(self, timer):
+        """
+        Remove a timer that has not expired
+
+        :param timer: (object) handle from schedule()
+
+        :return: (bool) True if the timer was pending
+        """
+        bucket, timer.bucket = timer.bucket, None
+        if bucket is None:
+            return False
+        del bucket[timer]
+        self._count -= 1
+        return True
+
+    def _place(self, timer):
+        tick, now, bits = timer.tick, self._tick, self._bits
+        top = len(self._levels) - 1
+        level = 0
+        while level < top and tick >> (bits * (level + 1)) != now >> (bits * (level + 1)):
+            level += 1
+
+        bucket = self._levels[level][(tick >> (bits * level)) & self._mask]
+        bucket[timer] = None
+        timer.bucket = bucket
+
+    def advance(self, now):
+        """
+        Expire every timer due by now
+
+        :param now: (float) Current time.monotonic()
+
+        :return: (list) items of the expired timers, in expiry order
+        """
+        target = int(now / self._resolution)
+        expired = []
+        if not self._count:
+            self._tick = max(self._tick, target)
+            return expired
+
+        bits, mask, levels = self._bits, self._mask, self._levels
+        while self._tick < target and self._count:
+            self._tick += 1
+            tick = self._tick
+
+            # Cascade higher levels first so their timers can fall through to level 0
+            for level in range(len(levels) - 1, 0, -1):
+                if tick & ((1 << (bits * level)) - 1) == 0:
+                    bucket = levels[level][(tick >> (bits * level)) & mask]
+                    if bucket:
+                        timers = list(bucket)
+                        bucket.clear()
+                        for timer in timers:
+                            self._place(timer)
+
+            bucket = levels[0][tick & mask]
+            if bucket:
+                for timer in bucket:
+                    timer.bucket = None
+                    expired.append(timer.item)
+                self._count -= len(bucket)
+                bucket.clear()
+
+        self._tick = max(self._tick, target)
+        return expired
+
+
+class _Transaction(object):
+    __slots__ = ('interface', 'key', 'kind', 'future', 'start', 'timer')
+
+    def __init__(self, interface, key, kind, future, start):
+        self.interface = interface
+        self.key = key
+        self.kind = kind
+        self.future = future
+        self.start = start
+        self.timer = None
+
+
+class _KindStatistics(object):
+    __slots__ = ('requests', 'responses', 'timeouts', 'errors', 'latency')
+
+    def __init__(self):
+        self.requests = 0
+        self.responses = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.latency = Histogram()          # nanoseconds
+
+
+class TransactionLayer(object):
+    """
+    Pending request table and timeout wheel for one IOThread
+    """
+    def __init__(self, io_thread, resolution=0.01, slot_bits=8, levels=4, wakeup=None):
+        """
+        Class initializer
+
+        :param io_thread:  (IOThread) Thread whose ports requests are sent on
+        :param resolution: (float) Timeout resolution in seconds
+        :param slot_bits:  (int) log2 of the timer wheel slots per level
+        :param levels:     (int) Timer wheel levels
+        :param wakeup:     (func) Called when the first transaction becomes pending, so the
+                                  I/O thread starts advancing the wheel at its resolution
+        """
+        self._io_thread = io_thread
+        self._wakeup = wakeup
+        self._lock = Lock()
+        self._pending = dict()              # (interface, key) -> _Transaction
+        self._wheel = TimerWheel(resolution, slot_bits, levels)
+        self._kinds = dict()                # kind -> _KindStatistics
+        self._unmatched = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    @property
+    def resolution(self):
+        return self._wheel.resolution
+
+    def _kind(self, kind):
+        stats = self._kinds.get(kind)
+        if stats is None:
+            stats = self._kinds[kind] = _KindStatistics()
+        return stats
+
+    def request(self, interface, frame, key, timeout=1.0, kind='default', vnet_hdr=None):
+        """
+        Send a request frame and wait for its response asynchronously
+
+        :param interface: (str) Interface to send on and receive the response from
+        :param frame:     (bytes) Request frame
+        :param key:       (hashable or func) Match key of the expected response, or a
+                                             function returning it from the request frame
+        :param timeout:   (float) Seconds to wait for the response
+        :param kind:      (str) Transaction type, latency and counters are kept per type
+        :param vnet_hdr:  (VirtioNetHdr) Passed to IOThread.send
+
+        :return: (concurrent.futures.Future) completes with the response frame, or fails
+                                             with TimeoutError, or OSError or the exception
+                                             raised if the request could not be sent
+        """
+        from concurrent.futures import Future     # Slow to import, load only when used
+
+        if callable(key):
+            key = key(frame)
+
+        future = Future()
+        index = (interface, key)
+
+        with self._lock:
+            if index in self._pending:
+                raise ValueError('Transaction {!r} already pending on {}'.format(key, interface))
+
+            stats = self._kind(kind)
+            stats.requests += 1
+            transaction = _Transaction(interface, key, kind, future, time.perf_counter_ns())
+            self._pending[index] = transaction
+            transaction.timer = self._wheel.schedule(time.monotonic() + timeout, transaction)
+            first = len(self._pending) == 1
+
+        if first and self._wakeup is not None:
+            self._wakeup()
+
+        # Sent after the transaction is pending so a fast response cannot be missed
+        try:
+            error = None
+            if self._io_thread.send(interface, frame, vnet_hdr=vnet_hdr) < 0:
+                error = OSError('Unable to send request on {}'.format(interface))
+
+        except Exception as e:
+            error = e
+
+        if error is not None:
+            with self._lock:
+                if self._pending.get(index) is transaction:
+                    del self._pending[index]
+                    self._wheel.cancel(transaction.timer)
+                    stats.errors += 1
+            if not future.done():
+                future.set_exception(error)
+
+        return future
+
+    def match(self, interface, key, frame):
+        """
+        Complete the transaction waiting for a response, called from the receive path
+
+        :param interface: (str) Interface the frame was received on
+        :param key:       (hashable) Match key extracted from the received frame
+        :param frame:     (bytes) Received frame
+
+        :return: (bool) True if the frame completed a transaction
+        """
+        with self._lock:
+            transaction = self._pending.pop((interface, key), None)
+            if transaction is None:
+                self._unmatched += 1
+                return False
+
+            self._wheel.cancel(transaction.timer)
+            stats = self._kind(transaction.kind)
+            stats.responses += 1
+            stats.latency.record(time.perf_counter_ns() - transaction.start)
+
+        if not transaction.future.done():
+            transaction.future.set_result(frame)
+        return True
+
+    def wrap(self, interface, response_key, rx_callback=None):
+        """
+        Build an rx_callback that completes transactions
+
+        :param interface:    (str) Interface the callback is for
+        :param response_key: (func) Returns the match key of a received frame, None if
+                                    the frame is not a response
+        :param rx_callback:  (func) Called with frames that do not complete a transaction
+
+        :return: (func) rx_callback for the port
+        """
+        match = self.match
+
+        def callback(frame, *args):
+            key = response_key(frame)
+            if key is not None and match(interface, key, frame):
+                return
+            if rx_callback is not None:
+                rx_callback(frame, *args)
+
+        return callback
+
+    def advance(self, now):
+        """
+        Fail the transactions whose timeout has passed, called from the I/O thread
+
+        :param now: (float) Current time.monotonic()
+        """
+        with self._lock:
+            expired = self._wheel.advance(now)
+            for transaction in expired:
+                del self._pending[(transaction.interface, transaction.key)]
+                self._kind(transaction.kind).timeouts += 1
+
+        if not expired:
+            return
+
+        from concurrent.futures import TimeoutError     # Already loaded by request()
+
+        for transaction in expired:
+            if not transaction.future.done():
+                transaction.future.set_exception(
+                    TimeoutError('No response to {!r} on {}'.format(transaction.key,
+                                                                   transaction.interface)))
+
+    def cancel_all(self, interface=None):
+        """
+        Cancel pending transactions, such as when a port closes
+
+        :param interface: (str) Only this interface's transactions, None for all
+        """
+        with self._lock:
+            cancelled = [transaction for index, transaction in self._pending.items()
+                         if interface is None or index[0] == interface]
+            for transaction in cancelled:
+                del self._pending[(transaction.interface, transaction.key)]
+                self._wheel.cancel(transaction.timer)
+
+        for transaction in cancelled:
+            transaction.future.cancel()
+
+    def statistics(self):
+        """
+        Get transaction statistics
+
+        :return: (dict) statistics, per transaction type under 'kinds'
+        """
+        with self._lock:
+            return {
+                'transactions_pending': len(self._pending),
+                'transactions_unmatched': self._unmatched,
+                'kinds': {kind: {'requests': stats.requests,
+                                 'responses': stats.responses,
+                                 'timeouts': stats.timeouts,
+                                 'errors': stats.errors,
+                                 'latency_ns': stats.latency.snapshot()}
+                          for kind, stats in self._kinds.items()},
+            }
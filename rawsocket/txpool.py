@@ -0,0 +1,138 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Per-thread transmit sockets
+
+A TxSocketPool gives each thread that sends on a port its own send-only
+socket and counters, so concurrent senders neither serialise on one socket
+nor lose counter updates. Sockets are created on a thread's first send and
+closed once the thread has exited; the counters of exited threads are kept.
+Without a socket factory the pool only keeps the per-thread counters, which
+ports use on free-threaded interpreters.
+"""
+import threading
+import weakref
+
+
+class TxSender(object):
+    """
+    Transmit socket and counters of one thread
+    """
+    __slots__ = ('socket', 'frames', 'octets', 'errors', '_thread')
+
+    def __init__(self, sock):
+        self.socket = sock
+        self.frames = 0
+        self.octets = 0
+        self.errors = 0
+        self._thread = weakref.ref(threading.current_thread())
+
+    @property
+    def alive(self):
+        thread = self._thread()
+        return thread is not None and thread.is_alive()
+
+
+class TxSocketPool(object):
+    """
+    Send-only sockets of a port, one per sending thread
+    """
+    def __init__(self, factory):
+        """
+        Class initializer
+
+        :param factory: (func) Returns a new send-only socket, None for counters only
+        """
+        self._factory = factory
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._senders = []
+        self._retired = [0, 0, 0]       # frames, octets and errors of exited threads
+        self._closed = False
+
+    def sender(self):
+        """
+        Get the calling thread's sender, creating its socket on first use
+
+        :return: (TxSender) sender
+        """
+        sender = getattr(self._local, 'sender', None)
+        if sender is None:
+            if self._closed:
+                raise OSError('Transmit socket pool is closed')
+
+            sender = TxSender(self._factory() if self._factory is not None else None)
+            self._local.sender = sender
+            with self._lock:
+                self._prune()
+                self._senders.append(sender)
+        return sender
+
+    def _prune(self):
+        """ Close the sockets of exited threads, called with the lock held """
+        retired = self._retired
+        live = []
+        for sender in self._senders:
+            if sender.alive:
+                live.append(sender)
+            else:
+                retired[0] += sender.frames
+                retired[1] += sender.octets
+                retired[2] += sender.errors
+                if sender.socket is not None:
+                    sender.socket.close()
+        self._senders = live
+
+    def for_each_socket(self, func):
+        """
+        Call func with each open socket, with the lock held so that no socket
+        is closed meanwhile
+
+        :param func: (func) Called as func(socket)
+        """
+        with self._lock:
+            for sender in self._senders:
+                if sender.socket is not None:
+                    func(sender.socket)
+
+    def statistics(self):
+        """
+        Get the counters of all threads
+
+        :return: (tuple) frames, octets, errors and number of open sockets
+        """
+        with self._lock:
+            self._prune()
+            frames, octets, errors = self._retired
+            for sender in self._senders:
+                frames += sender.frames
+                octets += sender.octets
+                errors += sender.errors
+            return frames, octets, errors, \
+                len(self._senders) if self._factory is not None else 0
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            for sender in self._senders:
+                self._retired[0] += sender.frames
+                self._retired[1] += sender.octets
+                self._retired[2] += sender.errors
+                try:
+                    if sender.socket is not None:
+                        sender.socket.close()
+
+                except Exception as _e:
+                    pass
+            self._senders = []
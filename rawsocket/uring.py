@@ -0,0 +1,361 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Minimal io_uring binding
+
+Just enough of io_uring, through the raw system calls, for the IOThread
+io_uring engine: submission and completion rings, provided buffer rings
+and the operations it uses (multishot recvmsg, multishot poll, send and
+cancel). Requires Linux 6.0 or later for multishot recvmsg.
+
+Ring indexes are read and written with plain loads and stores, which is
+sufficient on x86 (TSO); other architectures are untested.
+"""
+import os
+import mmap
+import errno
+import struct
+import threading
+from struct import pack, pack_into, unpack_from
+from ctypes import CDLL, c_long, c_uint, c_uint16, c_uint32, c_char, create_string_buffer, \
+    addressof, get_errno, sizeof
+
+from .afpacket import struct_msghdr, struct_sockaddr_ll, struct_cmsghdr, \
+    struct_tpacket_auxdata, SOL_PACKET, PACKET_AUXDATA, TP_STATUS_VLAN_VALID, ETH_P_8021Q, VLAN_TAG_SIZE
+
+# Same numbers on all architectures
+SYS_io_uring_setup = 425
+SYS_io_uring_enter = 426
+SYS_io_uring_register = 427
+
+# From linux/io_uring.h
+IORING_SETUP_CQSIZE = 1 << 3
+
+IORING_OFF_SQ_RING = 0
+IORING_OFF_CQ_RING = 0x8000000
+IORING_OFF_SQES = 0x10000000
+
+IORING_FEAT_EXT_ARG = 1 << 8
+
+IORING_ENTER_GETEVENTS = 1 << 0
+IORING_ENTER_EXT_ARG = 1 << 3
+
+IORING_REGISTER_PBUF_RING = 22
+IORING_UNREGISTER_PBUF_RING = 23
+
+IORING_OP_POLL_ADD = 6
+IORING_OP_RECVMSG = 10
+IORING_OP_ASYNC_CANCEL = 14
+IORING_OP_SEND = 26
+
+IOSQE_BUFFER_SELECT = 1 << 5
+IORING_RECV_MULTISHOT = 1 << 1
+IORING_POLL_ADD_MULTI = 1 << 0
+
+IORING_CQE_F_BUFFER = 1 << 0
+IORING_CQE_F_MORE = 1 << 1
+IORING_CQE_BUFFER_SHIFT = 16
+
+POLLIN = 0x0001
+MSG_TRUNC = 0x20
+
+SQE_SIZE = 64
+CQE_SIZE = 16
+RECVMSG_OUT_SIZE = 16       # struct io_uring_recvmsg_out
+
+libc = CDLL("libc.so.6", use_errno=True)
+_syscall = libc.syscall
+_syscall.restype = c_long
+
+
+def _check(rv):
+    if rv < 0:
+        err = get_errno()
+        raise OSError(err, os.strerror(err))
+    return rv
+
+
+class IoUring(object):
+    """
+    An io_uring instance
+
+    Submissions may be prepared from any thread. Completions must be reaped by
+    a single thread.
+    """
+    def __init__(self, entries=256, cq_entries=None):
+        """
+        Class initializer
+
+        :param entries:    (int) Submission queue entries
+        :param cq_entries: (int) Completion queue entries, default 4 * entries
+        """
+        params = create_string_buffer(120)
+        pack_into('<II', params, 0, entries, cq_entries or 4 * entries)
+        pack_into('<I', params, 8, IORING_SETUP_CQSIZE)
+        self._fd = _check(_syscall(c_long(SYS_io_uring_setup), c_uint(entries), params))
+
+        self._sq = self._cq = self._sqes = None
+        try:
+            sq_entries, cq_entries, _flags = unpack_from('<III', params, 0)
+            self._features = unpack_from('<I', params, 20)[0]
+            if not self._features & IORING_FEAT_EXT_ARG:
+                raise OSError(errno.ENOSYS, 'io_uring without IORING_FEAT_EXT_ARG')
+
+            sq_head, sq_tail, sq_mask, _, _, _, sq_array = unpack_from('<7I', params, 40)
+            cq_head, cq_tail, cq_mask, _, _, cqes = unpack_from('<6I', params, 80)
+
+            flags = mmap.MAP_SHARED | mmap.MAP_POPULATE
+            prot = mmap.PROT_READ | mmap.PROT_WRITE
+            self._sq = mmap.mmap(self._fd, sq_array + sq_entries * 4, flags, prot,
+                                 offset=IORING_OFF_SQ_RING)
+            self._cq = mmap.mmap(self._fd, cqes + cq_entries * CQE_SIZE, flags, prot,
+                                 offset=IORING_OFF_CQ_RING)
+            self._sqes = mmap.mmap(self._fd, sq_entries * SQE_SIZE, flags, prot,
+                                   offset=IORING_OFF_SQES)
+
+            self._sq_head = c_uint32.from_buffer(self._sq, sq_head)
+            self._sq_tail = c_uint32.from_buffer(self._sq, sq_tail)
+            self._sq_mask = unpack_from('<I', self._sq, sq_mask)[0]
+            self._sq_array = sq_array
+            self._sq_entries = sq_entries
+
+            self._cq_head = c_uint32.from_buffer(self._cq, cq_head)
+            self._cq_tail = c_uint32.from_buffer(self._cq, cq_tail)
+            self._cq_mask = unpack_from('<I', self._cq, cq_mask)[0]
+            self._cqes = cqes
+
+        except Exception as _e:
+            self.close()
+            raise
+
+        self._lock = threading.Lock()
+        self._tail = self._sq_tail.value
+        self._pending = 0
+
+        self._timespec = create_string_buffer(16)
+        self._arg = create_string_buffer(pack('<QIIQ', 0, 8, 0, addressof(self._timespec)), 24)
+
+    def fileno(self):
+        return self._fd
+
+    def prep(self, opcode, fd, addr=0, length=0, off=0, op_flags=0, user_data=0, flags=0,
+             ioprio=0, buf_group=0):
+        """
+        Queue a submission queue entry, submitted by the next submit()
+
+        :return: (bool) False if the submission queue is full
+        """
+        with self._lock:
+            tail = self._tail
+            if ((tail - self._sq_head.value) & 0xffffffff) >= self._sq_entries:
+                return False
+
+            index = tail & self._sq_mask
+            pack_into('<BBHiQQIIQHHi16x', self._sqes, index * SQE_SIZE, opcode, flags, ioprio, fd,
+                      off, addr, length, op_flags, user_data, buf_group, 0, 0)
+            pack_into('<I', self._sq, self._sq_array + index * 4, index)
+            self._tail = tail = (tail + 1) & 0xffffffff
+            self._sq_tail.value = tail
+            self._pending += 1
+            return True
+
+    def submit(self, wait=0, timeout=None):
+        """
+        Submit queued entries and optionally wait for completions
+
+        :param wait:    (int) Completions to wait for
+        :param timeout: (float) Seconds to wait, None to wait without a limit
+
+        :return: (int) number of entries submitted
+        """
+        with self._lock:
+            pending, self._pending = self._pending, 0
+
+        flags = IORING_ENTER_GETEVENTS if wait else 0
+        arg, argsz = None, 0
+        if wait and timeout is not None:
+            secs = int(timeout)
+            pack_into('<qq', self._timespec, 0, secs, int((timeout - secs) * 1e9))
+            flags |= IORING_ENTER_EXT_ARG
+            arg, argsz = self._arg, len(self._arg)
+
+        rv = _syscall(c_long(SYS_io_uring_enter), c_uint(self._fd), c_uint(pending),
+                      c_uint(wait), c_uint(flags), arg, c_long(argsz))
+        if rv < 0:
+            err = get_errno()
+            if err not in (errno.ETIME, errno.EINTR, errno.EAGAIN, errno.EBUSY):
+                raise OSError(err, os.strerror(err))
+            return 0
+        return rv
+
+    def completions(self):
+        """
+        Reap the completion queue
+
+        :return: (list) (user_data, res, flags) tuples
+        """
+        head = self._cq_head.value
+        tail = self._cq_tail.value
+        if head == tail:
+            return []
+
+        cq, cqes, mask = self._cq, self._cqes, self._cq_mask
+        result = []
+        while head != tail:
+            result.append(unpack_from('<QiI', cq, cqes + (head & mask) * CQE_SIZE))
+            head = (head + 1) & 0xffffffff
+
+        self._cq_head.value = head
+        return result
+
+    def register(self, opcode, arg, nr_args=1):
+        return _check(_syscall(c_long(SYS_io_uring_register), c_uint(self._fd), c_uint(opcode),
+                               arg, c_uint(nr_args)))
+
+    def close(self):
+        self._sq_head = self._sq_tail = self._cq_head = self._cq_tail = None
+        for name in ('_sqes', '_cq', '_sq'):
+            mm = getattr(self, name, None)
+            setattr(self, name, None)
+            if mm is not None:
+                mm.close()
+
+        fd, self._fd = self._fd, None
+        if fd is not None:
+            os.close(fd)
+
+
+class BufferRing(object):
+    """
+    Provided buffer ring, the kernel picks a buffer for each received frame
+    """
+    def __init__(self, ring, bgid, entries, size):
+        """
+        Class initializer
+
+        :param ring:    (IoUring) io_uring to register with
+        :param bgid:    (int) Buffer group ID
+        :param entries: (int) Number of buffers, a power of two
+        :param size:    (int) Buffer size
+        """
+        assert entries & (entries - 1) == 0, 'entries must be a power of two'
+
+        self._ring = ring
+        self._bgid = bgid
+        self._entries = entries
+        self._mask = entries - 1
+        self._size = size
+        self._tail_ref = None
+
+        self._descs = mmap.mmap(-1, entries * 16)
+        self._buffers = mmap.mmap(-1, entries * size)
+        self._base = addressof(c_char.from_buffer(self._buffers))
+        try:
+            ring.register(IORING_REGISTER_PBUF_RING,
+                          create_string_buffer(pack('<QIHH24x', addressof(c_char.from_buffer(self._descs)),
+                                                    entries, bgid, 0)))
+        except Exception as _e:
+            self._descs.close()
+            self._buffers.close()
+            raise
+
+        self._tail_ref = c_uint16.from_buffer(self._descs, 14)
+        self._tail = 0
+        for bid in range(entries):
+            self._add(bid)
+        self._tail_ref.value = self._tail
+
+    @property
+    def bgid(self):
+        return self._bgid
+
+    @property
+    def size(self):
+        return self._size
+
+    def _add(self, bid):
+        pack_into('<QIH', self._descs, (self._tail & self._mask) * 16,
+                  self._base + bid * self._size, self._size, bid)
+        self._tail = (self._tail + 1) & 0xffff
+
+    def view(self, bid, offset, length):
+        start = bid * self._size + offset
+        return memoryview(self._buffers)[start:start + length]
+
+    def recycle(self, bid):
+        """ Return a buffer to the kernel """
+        self._add(bid)
+        self._tail_ref.value = self._tail
+
+    def close(self):
+        self._tail_ref = None
+        try:
+            self._ring.register(IORING_UNREGISTER_PBUF_RING,
+                                create_string_buffer(pack('<QIHH24x', 0, 0, self._bgid, 0)))
+        except OSError as _e:
+            pass
+        for mm in (self._descs, self._buffers):
+            try:
+                mm.close()
+
+            except BufferError as _e:
+                pass        # Still referenced, released with the last reference
+
+
+class PacketRecvMsg(object):
+    """
+    msghdr of a multishot recvmsg on an AF_PACKET socket, and the parser of
+    the buffers it fills: struct io_uring_recvmsg_out, the sockaddr_ll, the
+    PACKET_AUXDATA control message and the frame.
+    """
+    NAME_SIZE = sizeof(struct_sockaddr_ll)
+    CONTROL_SIZE = sizeof(struct_cmsghdr) + sizeof(struct_tpacket_auxdata) + 4
+    HEADER_SIZE = RECVMSG_OUT_SIZE + NAME_SIZE + CONTROL_SIZE
+
+    def __init__(self):
+        self.msghdr = struct_msghdr()
+        self.msghdr.msg_namelen = self.NAME_SIZE
+        self.msghdr.msg_controllen = self.CONTROL_SIZE
+        self.msghdr.msg_iovlen = 0
+
+    @property
+    def address(self):
+        return addressof(self.msghdr)
+
+    def parse(self, buf):
+        """
+        Extract a frame from a filled buffer
+
+        :param buf: (memoryview) Buffer contents
+
+        :return: (tuple) frame (bytes), packet type and original length of the frame
+        """
+        _namelen, controllen, payloadlen, flags = unpack_from('<IIII', buf, 0)
+        pkttype = buf[RECVMSG_OUT_SIZE + 10]
+        start = self.HEADER_SIZE
+        end = min(start + payloadlen, len(buf))
+        frame = buf[start:end].tobytes()
+        wire_len = payloadlen       # Length before truncation to the buffer, with MSG_TRUNC
+
+        if controllen >= sizeof(struct_cmsghdr) + sizeof(struct_tpacket_auxdata):
+            control = RECVMSG_OUT_SIZE + self.NAME_SIZE
+            _len, level, cmsg_type, status, tp_len = unpack_from('<QiiII', buf, control)
+            if level == SOL_PACKET and cmsg_type == PACKET_AUXDATA:
+                wire_len = tp_len       # Length before truncation by a BPF program
+                tci = unpack_from('<H', buf, control + 16 + 16)[0]
+                if tci != 0 or status & TP_STATUS_VLAN_VALID:
+                    frame = frame[:12] + struct.pack('!HH', ETH_P_8021Q, tci) + frame[12:]
+                    wire_len += VLAN_TAG_SIZE
+
+        return frame, pkttype, wire_len
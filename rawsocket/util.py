@@ -17,8 +17,11 @@ Network utilities with some originally from the OpenFlow test framework
 
 oftest from: http://github.com/floodlight/oftest
 """
-from socket import socket
+import os
+import sys
+from socket import socket, SOL_SOCKET, SO_RCVBUF, SO_SNDBUF
 from fcntl import ioctl
+from ctypes import create_string_buffer, addressof
 from struct import pack, unpack
 
 # From bits/ioctls.h
@@ -32,6 +35,39 @@ PACKET_MR_PROMISC = 1
 # From bits/socket.h
 SOL_PACKET = 263
 
+# From linux/if_packet.h
+PACKET_STATISTICS = 6
+
+# From asm-generic/socket.h
+SO_ATTACH_FILTER = 26
+SO_DETACH_FILTER = 27
+SO_SNDBUFFORCE = 32
+SO_RCVBUFFORCE = 33
+SO_MEMINFO = 55
+SO_BUSY_POLL = 46
+SO_PREFER_BUSY_POLL = 69
+SO_BUSY_POLL_BUDGET = 70
+PACKET_QDISC_BYPASS = 20
+PACKET_IGNORE_OUTGOING = 23
+PACKET_FANOUT = 18
+SO_TXTIME = 61
+SCM_TXTIME = SO_TXTIME
+
+# SO_TXTIME flags
+SOF_TXTIME_DEADLINE_MODE = 1
+SOF_TXTIME_REPORT_ERRORS = 2
+
+# PACKET_FANOUT modes
+PACKET_FANOUT_HASH = 0
+PACKET_FANOUT_LB = 1
+PACKET_FANOUT_CPU = 2
+PACKET_FANOUT_ROLLOVER = 3
+PACKET_FANOUT_RND = 4
+PACKET_FANOUT_QM = 5
+
+# True on a free-threaded (no GIL) interpreter, CPython 3.13t and later
+FREE_THREADED = hasattr(sys, '_is_gil_enabled') and not sys._is_gil_enabled()
+
 
 def interface_ioctl(iface, ioctl_cmd, sock=None):
     """
@@ -97,3 +133,218 @@ def set_promiscuous_mode(sock, iface, enable=True):
     except Exception as _e:
         pass    # Primarily here for placement of a debug breakpoint
         raise
+
+
+def set_busy_poll(sock, usecs, prefer=True, budget=None):
+    """
+    Enable kernel busy polling of the device queue on a socket
+
+    Setting a busy poll value greater than the 'net.core.busy_read' sysctl requires
+    CAP_NET_ADMIN. SO_PREFER_BUSY_POLL and SO_BUSY_POLL_BUDGET are only available on
+    Linux 5.11 and later and are applied on a best effort basis.
+
+    :param sock:   (socket) socket handle to use
+    :param usecs:  (int) Microseconds to busy poll the device queue on a blocking receive
+    :param prefer: (bool) True to prefer busy polling over softirq processing
+    :param budget: (int) Maximum number of packets to process per busy poll, None for kernel default
+
+    :return: (bool) True if SO_BUSY_POLL was accepted
+    """
+    try:
+        sock.setsockopt(SOL_SOCKET, SO_BUSY_POLL, usecs)
+
+    except OSError as _e:
+        return False    # Typically insufficient privileges
+
+    for option, value in ((SO_PREFER_BUSY_POLL, 1 if prefer else None),
+                          (SO_BUSY_POLL_BUDGET, budget)):
+        if value is not None:
+            try:
+                sock.setsockopt(SOL_SOCKET, option, value)
+
+            except OSError as _e:
+                pass    # Older kernel
+
+    return True
+
+
+def set_ignore_outgoing(sock):
+    """
+    Stop the kernel looping frames transmitted on the interface back to a packet socket
+
+    PACKET_IGNORE_OUTGOING is available on Linux 4.20 and later.
+
+    :param sock: (socket) AF_PACKET socket
+
+    :return: (bool) True if supported
+    """
+    try:
+        sock.setsockopt(SOL_PACKET, PACKET_IGNORE_OUTGOING, 1)
+        return True
+
+    except OSError as _e:
+        return False    # Older kernel
+
+
+def set_qdisc_bypass(sock):
+    """
+    Send frames from a packet socket directly to the device, bypassing the qdisc layer
+
+    Frames are dropped rather than queued if the device transmit queue is full.
+
+    :param sock: (socket) AF_PACKET socket
+
+    :return: (bool) True if supported
+    """
+    try:
+        sock.setsockopt(SOL_PACKET, PACKET_QDISC_BYPASS, 1)
+        return True
+
+    except OSError as _e:
+        return False
+
+
+def set_fanout(sock, group_id, mode=PACKET_FANOUT_HASH):
+    """
+    Join a PACKET_FANOUT group, frames of the interface are then spread over
+    the sockets of the group. Must be called after bind.
+
+    :param sock:     (socket) Bound AF_PACKET socket
+    :param group_id: (int) 16-bit group ID, unique per interface
+    :param mode:     (int) PACKET_FANOUT_HASH, _LB, _CPU, _ROLLOVER, _RND or _QM
+    """
+    sock.setsockopt(SOL_PACKET, PACKET_FANOUT, (group_id & 0xffff) | (mode << 16))
+
+
+def set_txtime(sock, clockid, deadline_mode=False, report_errors=True):
+    """
+    Enable time-based transmit, frames sent with an SCM_TXTIME control message
+    are then released by the ETF or fq qdisc at their launch time
+
+    SO_TXTIME is available on Linux 4.19 and later. The ETF qdisc needs
+    CLOCK_TAI, fq needs CLOCK_MONOTONIC.
+
+    :param sock:          (socket) AF_PACKET socket
+    :param clockid:       (int) Clock of the launch times, such as time.CLOCK_TAI
+    :param deadline_mode: (bool) ETF sends frames as soon as possible, before their launch time
+    :param report_errors: (bool) Report frames that miss their launch time on the error queue
+    """
+    flags = (SOF_TXTIME_DEADLINE_MODE if deadline_mode else 0) | \
+        (SOF_TXTIME_REPORT_ERRORS if report_errors else 0)
+    sock.setsockopt(SOL_SOCKET, SO_TXTIME, pack("iI", clockid, flags))
+
+
+def set_cpu_affinity(cpus):
+    """
+    Pin the calling thread to a set of CPUs
+
+    :param cpus: (iterable) CPU numbers the thread may run on
+
+    :return: (bool) True if successful
+    """
+    try:
+        os.sched_setaffinity(0, set(cpus))
+        return True
+
+    except (OSError, AttributeError) as _e:
+        return False    # Invalid CPU set or unsupported platform
+
+
+def set_realtime_priority(policy, priority=None):
+    """
+    Set the scheduling policy and priority of the calling thread
+
+    Real-time policies require CAP_SYS_NICE or a suitable RLIMIT_RTPRIO.
+
+    :param policy:   (int) Scheduling policy such as os.SCHED_FIFO or os.SCHED_RR
+    :param priority: (int) Static priority, None for the lowest priority of the policy
+
+    :return: (bool) True if successful
+    """
+    try:
+        if priority is None:
+            priority = os.sched_get_priority_min(policy)
+
+        os.sched_setscheduler(0, policy, os.sched_param(priority))
+        return True
+
+    except (OSError, AttributeError) as _e:
+        return False    # Typically insufficient privileges or unsupported platform
+
+
+def set_socket_buffer(sock, size, receive=True):
+    """
+    Set the receive or send buffer size of a socket
+
+    SO_RCVBUFFORCE/SO_SNDBUFFORCE are tried first so that privileged (CAP_NET_ADMIN)
+    processes are not limited by the 'net.core.rmem_max' and 'net.core.wmem_max' sysctls.
+
+    :param sock:    (socket) socket handle to use
+    :param size:    (int) Buffer size in octets
+    :param receive: (bool) True for the receive buffer, False for the send buffer
+
+    :return: (int) buffer size reported by the kernel, which is twice the size it accepted
+    """
+    option, force = (SO_RCVBUF, SO_RCVBUFFORCE) if receive else (SO_SNDBUF, SO_SNDBUFFORCE)
+    try:
+        sock.setsockopt(SOL_SOCKET, force, size)
+
+    except OSError as _e:
+        sock.setsockopt(SOL_SOCKET, option, size)   # Unprivileged, capped by sysctl
+
+    return sock.getsockopt(SOL_SOCKET, option)
+
+
+def get_packet_statistics(sock):
+    """
+    Get the kernel receive counters of an AF_PACKET socket
+
+    The kernel resets the counters each time they are read.
+
+    :param sock: (socket) AF_PACKET socket
+
+    :return: (tuple) frames received and frames dropped since the last call
+    """
+    return unpack("II", sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, 8))
+
+
+def get_socket_meminfo(sock):
+    """
+    Get the SO_MEMINFO memory counters of a socket
+
+    :param sock: (socket) socket handle to use
+
+    :return: (tuple) rmem_alloc, rcvbuf, wmem_alloc, sndbuf, fwd_alloc, wmem_queued,
+                     optmem, backlog and drops, or None if not supported (Linux < 4.6)
+    """
+    try:
+        return unpack("9I", sock.getsockopt(SOL_SOCKET, SO_MEMINFO, 36))
+
+    except OSError as _e:
+        return None
+
+
+def attach_filter(sock, program):
+    """
+    Attach a classic BPF program to a socket, replacing any attached program
+
+    :param sock:    (socket) socket handle to use
+    :param program: (list) BPF instructions as (code, jt, jf, k) tuples
+    """
+    filters = b''.join(pack('HBBI', code, jt, jf, k) for (code, jt, jf, k) in program)
+    b = create_string_buffer(filters)
+    fprog = pack('HL', len(program), addressof(b))
+    sock.setsockopt(SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+
+def detach_filter(sock):
+    """
+    Detach any BPF program from a socket
+
+    :param sock: (socket) socket handle to use
+    """
+    try:
+        sock.setsockopt(SOL_SOCKET, SO_DETACH_FILTER, 0)
+
+    except OSError as _e:
+        pass    # No filter attached
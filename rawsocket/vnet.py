@@ -0,0 +1,268 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+virtio_net_hdr support for PACKET_VNET_HDR sockets
+
+With PACKET_VNET_HDR enabled, received frames may be GRO coalesced
+super-frames described by a virtio_net_hdr, and transmitted frames may be
+TCP/UDP super-frames of up to 64 KB that the kernel or NIC segments (GSO).
+This module builds and parses the header, prepares super-frames for GSO and
+lazily splits received super-frames into individual segments.
+"""
+import struct
+from array import array
+from collections import namedtuple
+
+# From linux/virtio_net.h
+VIRTIO_NET_HDR_F_NEEDS_CSUM = 1
+VIRTIO_NET_HDR_F_DATA_VALID = 2
+
+VIRTIO_NET_HDR_GSO_NONE = 0
+VIRTIO_NET_HDR_GSO_TCPV4 = 1
+VIRTIO_NET_HDR_GSO_UDP = 3
+VIRTIO_NET_HDR_GSO_TCPV6 = 4
+VIRTIO_NET_HDR_GSO_UDP_L4 = 5
+VIRTIO_NET_HDR_GSO_ECN = 0x80
+
+VNET_HDR_SIZE = 10
+GSO_MAX_SIZE = 65535
+
+_ETH_P_IP = 0x0800
+_ETH_P_IPV6 = 0x86dd
+_VLAN_TPIDS = (0x8100, 0x88a8)
+_IPPROTO_TCP = 6
+_IPPROTO_UDP = 17
+
+_TCP_FIN = 0x01
+_TCP_PSH = 0x08
+_TCP_CWR = 0x80
+
+_hdr = struct.Struct('=BBHHHH')
+_u16 = struct.Struct('!H')
+_u32 = struct.Struct('!I')
+_native_u16 = struct.Struct('=H')
+
+
+class VirtioNetHdr(namedtuple('VirtioNetHdr', 'flags gso_type hdr_len gso_size csum_start csum_offset')):
+    """
+    struct virtio_net_hdr, in host byte order as used by packet sockets
+    """
+    __slots__ = ()
+
+    @staticmethod
+    def unpack(data):
+        """
+        Decode a virtio_net_hdr
+
+        :param data: (bytes) VNET_HDR_SIZE octets
+
+        :return: (VirtioNetHdr) header
+        """
+        return VirtioNetHdr(*_hdr.unpack_from(data))
+
+    def pack(self):
+        """
+        Encode the header
+
+        :return: (bytes) VNET_HDR_SIZE octets
+        """
+        return _hdr.pack(*self)
+
+    @property
+    def is_gso(self):
+        """True if the frame is a super-frame to be segmented"""
+        return self.gso_type & ~VIRTIO_NET_HDR_GSO_ECN != VIRTIO_NET_HDR_GSO_NONE
+
+    @property
+    def needs_csum(self):
+        """True if the L4 checksum holds only the pseudo-header sum"""
+        return bool(self.flags & VIRTIO_NET_HDR_F_NEEDS_CSUM)
+
+    def shifted(self, octets):
+        """
+        Get the header for the frame after octets were inserted before the L3 header
+
+        :param octets: (int) Number of octets inserted, such as a 4 octet VLAN tag
+
+        :return: (VirtioNetHdr) adjusted header
+        """
+        return self._replace(hdr_len=self.hdr_len + octets if self.hdr_len else 0,
+                             csum_start=self.csum_start + octets if self.needs_csum else self.csum_start)
+
+
+NO_VNET_HDR = VirtioNetHdr(0, VIRTIO_NET_HDR_GSO_NONE, 0, 0, 0, 0)
+
+
+def _parse(frame):
+    """
+    Locate the L3 and L4 headers of an IPv4/IPv6 frame
+
+    :return: (tuple) L3 offset, ethertype, L4 offset, IP protocol
+    """
+    offset = 12
+    etype = _u16.unpack_from(frame, offset)[0]
+    while etype in _VLAN_TPIDS:
+        offset += 4
+        etype = _u16.unpack_from(frame, offset)[0]
+
+    l3 = offset + 2
+    if etype == _ETH_P_IP:
+        return l3, etype, l3 + (frame[l3] & 0x0f) * 4, frame[l3 + 9]
+
+    if etype == _ETH_P_IPV6:
+        return l3, etype, l3 + 40, frame[l3 + 6]    # Extension headers not supported
+
+    raise ValueError('Not an IPv4/IPv6 frame: ethertype 0x{:04x}'.format(etype))
+
+
+def _csum_add(total, data):
+    """One's complement sum of native order 16-bit words"""
+    if len(data) & 1:
+        data = bytes(data) + b'\x00'
+    total += sum(array('H', bytes(data)))
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return total
+
+
+def _pseudo_header_sum(frame, l3, etype, proto, l4_len):
+    if etype == _ETH_P_IP:
+        pseudo = frame[l3 + 12:l3 + 20] + struct.pack('!BBH', 0, proto, l4_len)
+    else:
+        pseudo = frame[l3 + 8:l3 + 40] + struct.pack('!IxxxB', l4_len, proto)
+    return _csum_add(0, pseudo)
+
+
+def _set_l3_length(seg, l3, etype, index=0):
+    if etype == _ETH_P_IP:
+        ihl = (seg[l3] & 0x0f) * 4
+        _u16.pack_into(seg, l3 + 2, len(seg) - l3)
+        if index:
+            _u16.pack_into(seg, l3 + 4, (_u16.unpack_from(seg, l3 + 4)[0] + index) & 0xffff)
+        _u16.pack_into(seg, l3 + 10, 0)
+        _native_u16.pack_into(seg, l3 + 10, ~_csum_add(0, seg[l3:l3 + ihl]) & 0xffff)
+    else:
+        _u16.pack_into(seg, l3 + 4, len(seg) - l3 - 40)
+
+
+def _set_l4_csum(seg, l3, etype, l4, proto):
+    offset = l4 + (16 if proto == _IPPROTO_TCP else 6)
+    _u16.pack_into(seg, offset, 0)
+    total = _csum_add(_pseudo_header_sum(seg, l3, etype, proto, len(seg) - l4), seg[l4:])
+    csum = ~total & 0xffff
+    if csum == 0 and proto == _IPPROTO_UDP:
+        csum = 0xffff
+    _native_u16.pack_into(seg, offset, csum)
+
+
+def prepare_gso(frame, mss):
+    """
+    Prepare a TCP or UDP super-frame for transmission with GSO
+
+    The IP length fields are set for the whole super-frame and the L4 checksum
+    is replaced with the pseudo-header sum, as required for checksum offload.
+
+    :param frame: (bytes) Ethernet frame with an IPv4/IPv6 TCP or UDP payload of any size
+    :param mss:   (int) Payload octets per transmitted segment
+
+    :return: (tuple) prepared frame (bytes) and its VirtioNetHdr
+    """
+    if len(frame) > GSO_MAX_SIZE:
+        raise ValueError('Frame exceeds {} octets'.format(GSO_MAX_SIZE))
+
+    l3, etype, l4, proto = _parse(frame)
+    seg = bytearray(frame)
+    _set_l3_length(seg, l3, etype)
+
+    if proto == _IPPROTO_TCP:
+        hdr_len = l4 + (seg[l4 + 12] >> 4) * 4
+        csum_offset = 16
+        gso_type = VIRTIO_NET_HDR_GSO_TCPV4 if etype == _ETH_P_IP else VIRTIO_NET_HDR_GSO_TCPV6
+
+    elif proto == _IPPROTO_UDP:
+        hdr_len = l4 + 8
+        csum_offset = 6
+        gso_type = VIRTIO_NET_HDR_GSO_UDP_L4
+        _u16.pack_into(seg, l4 + 4, len(seg) - l4)
+
+    else:
+        raise ValueError('GSO requires TCP or UDP, IP protocol is {}'.format(proto))
+
+    if len(seg) - hdr_len <= mss:
+        gso_type, mss = VIRTIO_NET_HDR_GSO_NONE, 0
+
+    _native_u16.pack_into(seg, l4 + csum_offset,
+                          _pseudo_header_sum(seg, l3, etype, proto, len(seg) - l4))
+
+    return bytes(seg), VirtioNetHdr(VIRTIO_NET_HDR_F_NEEDS_CSUM, gso_type, hdr_len,
+                                    mss, l4, csum_offset)
+
+
+def segments(frame, vnet_hdr):
+    """
+    Lazily split a received super-frame into individual frames
+
+    Frames that are not super-frames are returned as is, with their checksum
+    completed if the kernel left it partial.
+
+    :param frame:    (bytes) Received frame
+    :param vnet_hdr: (VirtioNetHdr) Header received with the frame
+
+    :return: (generator) of frames (bytes)
+    """
+    if vnet_hdr is None or (not vnet_hdr.is_gso and not vnet_hdr.needs_csum):
+        yield frame
+        return
+
+    l3, etype, l4, proto = _parse(frame)
+
+    if not vnet_hdr.is_gso:
+        seg = bytearray(frame)
+        _set_l4_csum(seg, l3, etype, l4, proto)
+        yield bytes(seg)
+        return
+
+    gso_type = vnet_hdr.gso_type & ~VIRTIO_NET_HDR_GSO_ECN
+    if gso_type in (VIRTIO_NET_HDR_GSO_TCPV4, VIRTIO_NET_HDR_GSO_TCPV6):
+        hdr_len = l4 + (frame[l4 + 12] >> 4) * 4
+    elif gso_type == VIRTIO_NET_HDR_GSO_UDP_L4:
+        hdr_len = l4 + 8
+    else:
+        raise ValueError('Unsupported GSO type {}'.format(vnet_hdr.gso_type))
+
+    headers = bytes(frame[:hdr_len])
+    payload = memoryview(frame)[hdr_len:]
+    mss = vnet_hdr.gso_size
+    seq = _u32.unpack_from(headers, l4 + 4)[0] if proto == _IPPROTO_TCP else 0
+
+    for index, offset in enumerate(range(0, len(payload), mss)):
+        seg = bytearray(headers)
+        seg += payload[offset:offset + mss]
+        last = offset + mss >= len(payload)
+
+        _set_l3_length(seg, l3, etype, index)
+
+        if proto == _IPPROTO_TCP:
+            _u32.pack_into(seg, l4 + 4, (seq + offset) & 0xffffffff)
+            flags = seg[l4 + 13]
+            if not last:
+                flags &= ~(_TCP_FIN | _TCP_PSH)
+            if index:
+                flags &= ~_TCP_CWR
+            seg[l4 + 13] = flags
+        else:
+            _u16.pack_into(seg, l4 + 4, len(seg) - l4)
+
+        _set_l4_csum(seg, l3, etype, l4, proto)
+        yield bytes(seg)
@@ -0,0 +1,557 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+AF_XDP receive and transmit
+
+An XdpIOPort receives through an AF_XDP socket instead of an AF_PACKET
+socket. A minimal XDP program, loaded with the bpf() syscall, redirects
+frames arriving on one receive queue of the interface into the socket
+through an XSKMAP; frames on other queues, or while the socket is not
+ready, continue to the kernel stack. Frames are exchanged through a UMEM
+area shared with the kernel and four rings: fill and rx for receive,
+tx and completion for transmit.
+
+The port binds in copy mode, which works with the generic (SKB) XDP hook
+on any interface including veth. Native mode (xdp_mode='drv') needs driver
+support. Requires Linux 5.9 or later (BPF_LINK_CREATE for XDP) and
+CAP_NET_ADMIN/CAP_BPF. IOPort.create(..., backend='xdp') falls back to the
+AF_PACKET port when any of this is unavailable.
+
+Only frames received on the interface are seen, as with DIRECTION_IN. The
+bpf_filter is evaluated in user space.
+"""
+import os
+import mmap
+import errno
+import select
+import socket
+import platform
+from struct import pack, pack_into, unpack, unpack_from
+from ctypes import CDLL, c_int, c_long, c_void_p, c_uint32, c_char, c_size_t, c_ssize_t, \
+    create_string_buffer, addressof, get_errno, sizeof, Structure, c_ushort, byref
+
+from .ioport import IOPort, frame_segments, ZERO_PAD
+from .bpf import BpfProgram
+from .util import get_if_index
+
+AF_XDP = 44
+SOL_XDP = 283
+
+# From linux/if_xdp.h
+XDP_MMAP_OFFSETS = 1
+XDP_RX_RING = 2
+XDP_TX_RING = 3
+XDP_UMEM_REG = 4
+XDP_UMEM_FILL_RING = 5
+XDP_UMEM_COMPLETION_RING = 6
+XDP_STATISTICS = 7
+
+XDP_COPY = 1 << 1
+
+XDP_PGOFF_RX_RING = 0
+XDP_PGOFF_TX_RING = 0x80000000
+XDP_UMEM_PGOFF_FILL_RING = 0x100000000
+XDP_UMEM_PGOFF_COMPLETION_RING = 0x180000000
+
+XDP_PACKET_HEADROOM = 256
+
+# From linux/bpf.h
+BPF_MAP_CREATE = 0
+BPF_MAP_UPDATE_ELEM = 2
+BPF_PROG_LOAD = 5
+BPF_LINK_CREATE = 28
+
+BPF_MAP_TYPE_XSKMAP = 17
+BPF_PROG_TYPE_XDP = 6
+BPF_XDP = 37
+BPF_PSEUDO_MAP_FD = 1
+BPF_FUNC_redirect_map = 51
+
+XDP_PASS = 2
+XDP_FLAGS_SKB_MODE = 1 << 1
+XDP_FLAGS_DRV_MODE = 1 << 2
+
+# mmap.MAP_POPULATE is only defined from Python 3.10, pre-faulting the rings is an optimization
+_MAP_POPULATE = getattr(mmap, 'MAP_POPULATE', 0)
+
+_SYS_BPF = {'x86_64': 321, 'aarch64': 280, 'armv7l': 386, 'ppc64le': 361, 's390x': 351}
+
+libc = CDLL("libc.so.6", use_errno=True)
+_syscall = libc.syscall
+_syscall.restype = c_long
+
+_bind = libc.bind
+_bind.argtypes = [c_int, c_void_p, c_uint32]
+_bind.restype = c_int
+
+_sendto = libc.sendto
+_sendto.argtypes = [c_int, c_void_p, c_size_t, c_int, c_void_p, c_uint32]
+_sendto.restype = c_ssize_t
+
+
+class struct_sockaddr_xdp(Structure):
+    _fields_ = [
+        ("sxdp_family", c_ushort),
+        ("sxdp_flags", c_ushort),
+        ("sxdp_ifindex", c_uint32),
+        ("sxdp_queue_id", c_uint32),
+        ("sxdp_shared_umem_fd", c_uint32),
+    ]
+
+
+def _raise_errno():
+    err = get_errno()
+    raise OSError(err, os.strerror(err))
+
+
+def bpf(cmd, attr):
+    """
+    Invoke the bpf() system call
+
+    :param cmd:  (int) BPF command
+    :param attr: (bytes) union bpf_attr contents for the command
+
+    :return: (int) result, a file descriptor for commands creating an object
+    """
+    nr = _SYS_BPF.get(platform.machine())
+    if nr is None:
+        raise OSError(errno.ENOSYS, 'bpf() syscall number unknown on {}'.format(platform.machine()))
+
+    buf = create_string_buffer(attr, 128)
+    rv = _syscall(c_long(nr), c_int(cmd), buf, c_uint32(128))
+    if rv < 0:
+        _raise_errno()
+    return rv
+
+
+def _insn(code, dst=0, src=0, off=0, imm=0):
+    return pack('<BBhi', code, (src << 4) | dst, off, imm)
+
+
+def redirect_program(map_fd):
+    """
+    Build the XDP program redirecting each frame to the XSKMAP entry of its receive queue
+
+    Frames of queues without a socket in the map are passed to the kernel stack.
+
+    :param map_fd: (int) XSKMAP file descriptor
+
+    :return: (bytes) eBPF instructions
+    """
+    return b''.join((
+        _insn(0x61, dst=2, src=1, off=16),                  # r2 = ctx->rx_queue_index
+        _insn(0x18, dst=1, src=BPF_PSEUDO_MAP_FD, imm=map_fd),  # r1 = map (ld_imm64)
+        _insn(0x00),
+        _insn(0xb7, dst=3, imm=XDP_PASS),                   # r3 = XDP_PASS if no entry
+        _insn(0x85, imm=BPF_FUNC_redirect_map),             # call bpf_redirect_map
+        _insn(0x95),                                        # exit
+    ))
+
+
+class XdpProgram(object):
+    """
+    XSKMAP and redirect program attached to an interface
+
+    The program is detached when its link is closed.
+    """
+    def __init__(self, ifindex, max_queues=64, mode=XDP_FLAGS_SKB_MODE):
+        """
+        Class initializer
+
+        :param ifindex:    (int) Interface index to attach to
+        :param max_queues: (int) Entries in the XSKMAP
+        :param mode:       (int) XDP_FLAGS_SKB_MODE for generic or XDP_FLAGS_DRV_MODE for native
+        """
+        self._map_fd = self._prog_fd = self._link_fd = None
+        try:
+            self._map_fd = bpf(BPF_MAP_CREATE, pack('<IIIII', BPF_MAP_TYPE_XSKMAP, 4, 4,
+                                                    max_queues, 0))
+            insns = create_string_buffer(redirect_program(self._map_fd))
+            license = create_string_buffer(b'GPL')
+            attr = pack('<IIQQIIQII16sII', BPF_PROG_TYPE_XDP, len(insns.raw) // 8,
+                        addressof(insns), addressof(license), 0, 0, 0, 0, 0,
+                        b'rawsocket_xsk', 0, 0)
+            self._prog_fd = bpf(BPF_PROG_LOAD, attr)
+            self._link_fd = bpf(BPF_LINK_CREATE, pack('<IIII', self._prog_fd, ifindex,
+                                                      BPF_XDP, mode))
+        except Exception as _e:
+            self.close()
+            raise
+
+    def register(self, queue_id, xsk_fd):
+        """
+        Redirect a receive queue to an AF_XDP socket
+
+        :param queue_id: (int) Receive queue
+        :param xsk_fd:   (int) AF_XDP socket file descriptor
+        """
+        key = create_string_buffer(pack('<I', queue_id))
+        value = create_string_buffer(pack('<I', xsk_fd))
+        bpf(BPF_MAP_UPDATE_ELEM, pack('<IIQQQ', self._map_fd, 0, addressof(key),
+                                      addressof(value), 0))
+
+    def close(self):
+        for name in ('_link_fd', '_prog_fd', '_map_fd'):
+            fd = getattr(self, name)
+            setattr(self, name, None)
+            if fd is not None:
+                os.close(fd)
+
+
+class _Ring(object):
+    """ One of the four rings shared with the kernel """
+    def __init__(self, sock, offsets, entries, desc_size, pgoff):
+        producer, consumer, desc, _flags = offsets
+        self.mm = mmap.mmap(sock.fileno(), desc + entries * desc_size,
+                            mmap.MAP_SHARED | _MAP_POPULATE,
+                            mmap.PROT_READ | mmap.PROT_WRITE, offset=pgoff)
+        self.producer = c_uint32.from_buffer(self.mm, producer)
+        self.consumer = c_uint32.from_buffer(self.mm, consumer)
+        self.desc = desc
+        self.mask = entries - 1
+
+    def close(self):
+        self.producer = self.consumer = None
+        mm, self.mm = self.mm, None
+        if mm is not None:
+            mm.close()
+
+
+class XdpSocket(object):
+    """
+    AF_XDP socket with its UMEM and rings
+
+    Half of the UMEM frames are kept in the fill ring for receive, the others
+    are used for transmit.
+    """
+    FRAME_SIZE = 2048
+    NUM_FRAMES = 4096
+
+    def __init__(self, ifindex, queue_id=0, num_frames=NUM_FRAMES, frame_size=FRAME_SIZE,
+                 copy=True):
+        """
+        Class initializer
+
+        :param ifindex:    (int) Interface index
+        :param queue_id:   (int) Receive queue to bind to
+        :param num_frames: (int) UMEM frames, a power of two
+        :param frame_size: (int) UMEM frame size, a power of two from 2048 to the page size
+        :param copy:       (bool) Bind in copy mode, required for generic XDP
+        """
+        assert num_frames & (num_frames - 1) == 0, 'num_frames must be a power of two'
+
+        self._frame_size = frame_size
+        self._rx = self._tx = self._fill = self._completion = None
+        self._umem_ref = None
+        half = num_frames // 2
+
+        self._socket = socket.socket(AF_XDP, socket.SOCK_RAW, 0)
+        try:
+            self._umem = mmap.mmap(-1, num_frames * frame_size,
+                                   mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS | _MAP_POPULATE)
+            self._umem_ref = c_char.from_buffer(self._umem)
+
+            s = self._socket
+            s.setsockopt(SOL_XDP, XDP_UMEM_REG, pack('<QQII', addressof(self._umem_ref),
+                                                     len(self._umem), frame_size, 0))
+            for option in (XDP_UMEM_FILL_RING, XDP_UMEM_COMPLETION_RING, XDP_RX_RING, XDP_TX_RING):
+                s.setsockopt(SOL_XDP, option, half)
+
+            offsets = unpack('<16Q', s.getsockopt(SOL_XDP, XDP_MMAP_OFFSETS, 128))
+            self._rx = _Ring(s, offsets[0:4], half, 16, XDP_PGOFF_RX_RING)
+            self._tx = _Ring(s, offsets[4:8], half, 16, XDP_PGOFF_TX_RING)
+            self._fill = _Ring(s, offsets[8:12], half, 8, XDP_UMEM_PGOFF_FILL_RING)
+            self._completion = _Ring(s, offsets[12:16], half, 8, XDP_UMEM_PGOFF_COMPLETION_RING)
+
+            # First half of the UMEM for receive, second half for transmit
+            fill = self._fill
+            for i in range(half):
+                pack_into('<Q', fill.mm, fill.desc + i * 8, i * frame_size)
+            fill.producer.value = half
+            self._fill_prod = half
+
+            self._tx_free = [(half + i) * frame_size for i in range(half)]
+            self._tx_prod = 0
+            self._completion_cons = 0
+            self._rx_cons = 0
+            self._rx_prod = 0
+
+            addr = struct_sockaddr_xdp(AF_XDP, XDP_COPY if copy else 0, ifindex, queue_id, 0)
+            if _bind(s.fileno(), byref(addr), sizeof(addr)) < 0:
+                _raise_errno()
+
+        except Exception as _e:
+            self.close()
+            raise
+
+    @property
+    def socket(self):
+        return self._socket
+
+    def fileno(self):
+        sock = self._socket
+        return sock.fileno() if sock is not None else None
+
+    def recv(self, nonblocking=False, timeout=None):
+        """
+        Receive one frame
+
+        :param nonblocking: (bool) If True, raise BlockingIOError if no frame is waiting
+        :param timeout:     (float) Seconds to wait for a blocking receive
+
+        :return: (bytes) frame
+        """
+        rx = self._rx
+        cons = self._rx_cons
+        if cons == self._rx_prod:
+            self._rx_prod = rx.producer.value
+            if cons == self._rx_prod:
+                if nonblocking:
+                    raise BlockingIOError(errno.EAGAIN, 'No frame waiting')
+
+                select.select([self._socket], [], [], timeout)
+                self._rx_prod = rx.producer.value
+                if cons == self._rx_prod:
+                    raise BlockingIOError(errno.EAGAIN, 'No frame waiting')
+
+        addr, length = unpack_from('<QI', rx.mm, rx.desc + (cons & rx.mask) * 16)
+        frame = self._umem[addr:addr + length]
+        self._rx_cons = cons = (cons + 1) & 0xffffffff
+        rx.consumer.value = cons
+
+        # Give the frame back to the kernel
+        fill = self._fill
+        prod = self._fill_prod
+        pack_into('<Q', fill.mm, fill.desc + (prod & fill.mask) * 8, addr & ~(self._frame_size - 1))
+        self._fill_prod = prod = (prod + 1) & 0xffffffff
+        fill.producer.value = prod
+        return frame
+
+    def _reclaim(self):
+        completion = self._completion
+        cons = self._completion_cons
+        prod = completion.producer.value
+        while cons != prod:
+            self._tx_free.append(unpack_from('<Q', completion.mm,
+                                             completion.desc + (cons & completion.mask) * 8)[0])
+            cons = (cons + 1) & 0xffffffff
+
+        if cons != self._completion_cons:
+            self._completion_cons = cons
+            completion.consumer.value = cons
+
+    def _kick(self):
+        if _sendto(self._socket.fileno(), None, 0, socket.MSG_DONTWAIT, None, 0) < 0:
+            err = get_errno()
+            if err not in (errno.EAGAIN, errno.EBUSY, errno.ENOBUFS, errno.ENETDOWN):
+                raise OSError(err, os.strerror(err))
+
+    def send(self, segments, length, pad=0):
+        """
+        Queue a frame on the tx ring and ask the kernel to send it
+
+        The segments are copied one after the other into a UMEM frame.
+
+        :param segments: (sequence) Buffer protocol objects making up the frame
+        :param length:   (int) Frame length, at most the UMEM frame size
+        :param pad:      (int) Zero octets to append
+
+        :return: (int) number of bytes queued, not counting padding, -1 if no UMEM frame is free
+        """
+        if length + pad > self._frame_size:
+            raise OSError(errno.EMSGSIZE, os.strerror(errno.EMSGSIZE))
+
+        self._reclaim()
+        if not self._tx_free:
+            self._kick()
+            self._reclaim()
+            if not self._tx_free:
+                return -1
+
+        addr = self._tx_free.pop()
+        umem = self._umem
+        offset = addr
+        for segment in segments:
+            size = len(segment) if isinstance(segment, bytes) else memoryview(segment).nbytes
+            umem[offset:offset + size] = segment
+            offset += size
+        if pad:
+            umem[offset:offset + pad] = ZERO_PAD[:pad]
+
+        tx = self._tx
+        prod = self._tx_prod
+        pack_into('<QII', tx.mm, tx.desc + (prod & tx.mask) * 16, addr, length + pad, 0)
+        self._tx_prod = prod = (prod + 1) & 0xffffffff
+        tx.producer.value = prod
+
+        self._kick()
+        return length
+
+    def statistics(self):
+        """
+        Get the kernel's XDP_STATISTICS counters
+
+        :return: (dict) statistics
+        """
+        values = unpack('<6Q', self._socket.getsockopt(SOL_XDP, XDP_STATISTICS, 48).ljust(48, b'\0'))
+        return {
+            'xdp_rx_dropped': values[0],
+            'xdp_rx_invalid_descs': values[1],
+            'xdp_tx_invalid_descs': values[2],
+            'xdp_rx_ring_full': values[3],
+            'xdp_rx_fill_ring_empty': values[4],
+            'xdp_tx_ring_empty': values[5],
+        }
+
+    def close(self):
+        for name in ('_rx', '_tx', '_fill', '_completion'):
+            ring = getattr(self, name)
+            setattr(self, name, None)
+            if ring is not None:
+                ring.close()
+
+        sock, self._socket = self._socket, None
+        if sock is not None:
+            sock.close()
+
+        self._umem_ref = None
+        umem, self._umem = getattr(self, '_umem', None), None
+        if umem is not None:
+            umem.close()
+
+
+class XdpIOPort(IOPort):
+    """
+    IOPort receiving and sending through AF_XDP
+
+    Supports the IOPort rx_callback/send/statistics contract. vnet_hdr, snaplen,
+    tx_pool, socket buffer options and DIRECTION_OUT do not apply to AF_XDP.
+    """
+    def __init__(self, iface_name, rx_callback, bpf_filter=None, verbose=False, queue_id=0,
+                 xdp_mode='skb', num_frames=XdpSocket.NUM_FRAMES, **kwargs):
+        """
+        Class initializer
+
+        :param iface_name:  (str) Interface Name to open
+        :param rx_callback: (func) Function to process received frames (bytes)
+        :param bpf_filter:  (BpfProgramFilter) Filter evaluated in user space
+        :param verbose:     (bool) True if verbose, debug output, should be shown
+        :param queue_id:    (int) Receive queue to bind to
+        :param xdp_mode:    (str) 'skb' for generic XDP, 'drv' for native driver XDP
+        :param num_frames:  (int) UMEM frames, half for receive and half for transmit
+        :param kwargs:      Additional IOPort options
+        """
+        self._xdp = self._xsk = None
+        assert not kwargs.get('vnet_hdr'), 'vnet_hdr is not supported by AF_XDP'
+        assert kwargs.get('direction', self.DIRECTION_INOUT) != self.DIRECTION_OUT, \
+            'AF_XDP only receives frames arriving on the interface'
+        assert xdp_mode in ('skb', 'drv'), 'Invalid xdp_mode {}'.format(xdp_mode)
+
+        self._queue_id = queue_id
+        self._xdp_mode = xdp_mode
+        self._num_frames = num_frames
+        self._rx_filtered = 0
+        if kwargs.get('snaplen') is not None:
+            raise ValueError('snaplen is not supported by AF_XDP')
+        if kwargs.get('tx_pool'):
+            raise ValueError('tx_pool is not supported by AF_XDP, frames are sent through the UMEM')
+        if kwargs.get('txtime') is not None:
+            raise ValueError('txtime is not supported by AF_XDP')
+        super(XdpIOPort, self).__init__(iface_name, rx_callback, bpf_filter=bpf_filter,
+                                        verbose=verbose, **kwargs)
+
+    def _open_socket(self):
+        self._user_filter = BpfProgram(self._filter.get_bpf()) if self._filter is not None else None
+
+        ifindex = get_if_index(self._iface_name)
+        mode = XDP_FLAGS_SKB_MODE if self._xdp_mode == 'skb' else XDP_FLAGS_DRV_MODE
+        try:
+            self._xdp = XdpProgram(ifindex, max_queues=self._queue_id + 1, mode=mode)
+            self._xsk = XdpSocket(ifindex, self._queue_id, num_frames=self._num_frames,
+                                  copy=self._xdp_mode == 'skb')
+            self._xdp.register(self._queue_id, self._xsk.fileno())
+
+        except Exception as _e:
+            self._close_xdp()
+            raise
+
+        return self._xsk.socket
+
+    def _close_xdp(self):
+        xdp, self._xdp = self._xdp, None
+        xsk, self._xsk = self._xsk, None
+        if xdp is not None:
+            xdp.close()
+        if xsk is not None:
+            xsk.close()
+
+    def close(self):
+        self._rx_callback = None
+        self._socket = None
+        pool = getattr(self, '_tx_pool', None)
+        if pool is not None:
+            pool.close()
+        self._close_xdp()
+
+    def _rcv_frame(self, nonblocking=False):
+        xsk = self._xsk
+        user_filter = self._user_filter
+        frame = xsk.recv(nonblocking, self.RCV_TIMEOUT)
+
+        if user_filter is not None:
+            while not user_filter(frame):
+                self._rx_filtered += 1
+                # Raises BlockingIOError if only filtered frames were waiting
+                frame = xsk.recv(True)
+        return frame
+
+    def _send_frame(self, frame, vnet_hdr=None, sock=None):
+        if vnet_hdr is not None:
+            raise ValueError('Port {} not opened with vnet_hdr'.format(self._iface_name))
+
+        xsk = self._xsk
+        if xsk is None:
+            return -1
+
+        segments, length = frame_segments(frame)
+        return xsk.send(segments, length, max(0, self.MIN_PKT_SIZE - length))
+
+    def statistics(self, top_n=None):
+        stats = super(XdpIOPort, self).statistics(top_n=top_n)
+        stats['backend'] = 'xdp'
+        stats['xdp_mode'] = self._xdp_mode
+        stats['xdp_queue_id'] = self._queue_id
+        stats['rx_filtered'] = self._rx_filtered
+
+        xsk = self._xsk
+        if xsk is not None:
+            stats.update(xsk.statistics())
+            stats['rx_kernel_drops'] = stats['xdp_rx_dropped'] + stats['xdp_rx_ring_full']
+        return stats
+
+    def up(self):
+        os.system('ip link set {} up'.format(self._iface_name))
+        return self
+
+    def down(self):
+        os.system('ip link set {} down'.format(self._iface_name))
+        return self
+
+    def _get_mac_address(self):
+        try:
+            with open('/sys/class/net/{}/address'.format(self._iface_name)) as f:
+                return f.read().strip().replace(':', '').encode()
+
+        except OSError as _e:
+            return None
@@ -0,0 +1,101 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Fixtures shared by the unprivileged tests
+"""
+import os
+import time
+
+import pytest
+
+from rawsocket import bpfcache
+from rawsocket.bpf import BPF_LD, BPF_H, BPF_ABS, BPF_JMP, BPF_JEQ, BPF_K, BPF_RET
+from rawsocket.iothread import IOThread, BpfProgramFilter
+from rawsocket.pcapfile import LINKTYPE_ETHERNET
+from rawsocket.simnet import SimNetwork
+
+HEADER = b'\xff' * 6 + b'\x02\x00\x00\x00\x00\x01'
+FILTER = 'ether proto 0x88b5'
+VETH = ('vt0', 'vt1')
+FILTER_PROGRAM = [(BPF_LD | BPF_H | BPF_ABS, 0, 0, 12),
+                  (BPF_JMP | BPF_JEQ | BPF_K, 0, 1, 0x88b5),
+                  (BPF_RET | BPF_K, 0, 0, 262144),
+                  (BPF_RET | BPF_K, 0, 0, 0)]
+
+
+def _frame(ethertype=0x88b5, payload=b'', size=60):
+    data = HEADER + ethertype.to_bytes(2, 'big') + payload
+    return data + bytes(max(0, size - len(data)))
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def make_frame():
+    """ Build an Ethernet frame: make_frame(ethertype=0x88b5, payload=b'', size=60) """
+    return _frame
+
+
+@pytest.fixture
+def wait_for():
+    """ Poll a condition until it is true or a timeout passes: wait_for(condition, timeout=5) """
+    return _wait_for
+
+
+@pytest.fixture
+def bpf_cache(tmp_path, monkeypatch):
+    """ An empty compiled program cache for the test """
+    directory = tmp_path / 'bpf'
+    monkeypatch.setenv('RAWSOCKET_BPF_CACHE', str(directory))
+    return directory
+
+
+@pytest.fixture
+def bpf_filter(bpf_cache):
+    """ FILTER, compiled by hand into the program cache so libpcap is not needed """
+    bpfcache.store(FILTER, LINKTYPE_ETHERNET, FILTER_PROGRAM)
+    return BpfProgramFilter(FILTER)
+
+
+@pytest.fixture
+def veth():
+    """ Names of a veth pair for the tests that need root: ip link add vt0 type veth peer name vt1 """
+    if os.geteuid() != 0:
+        pytest.skip('Needs root')
+    if not all(os.path.exists('/sys/class/net/' + name) for name in VETH):
+        pytest.skip('Needs the veth pair {} and {}'.format(*VETH))
+    return VETH
+
+
+@pytest.fixture
+def network():
+    """ A private SimNetwork with sim0 linked to sim1 """
+    network = SimNetwork()
+    network.link('sim0', 'sim1')
+    return network
+
+
+@pytest.fixture
+def io_thread():
+    thread = IOThread()
+    thread.start()
+    yield thread
+    thread.stop()
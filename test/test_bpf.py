@@ -0,0 +1,170 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+User space BPF evaluation
+"""
+import struct
+
+import pytest
+
+from rawsocket.bpf import BpfProgram, ACCEPT, ACCEPT_ALL, BPF_MAXINSNS, ancillary, \
+    BPF_LD, BPF_LDX, BPF_ST, BPF_ALU, BPF_JMP, BPF_RET, BPF_MISC, BPF_W, BPF_H, BPF_B, \
+    BPF_IMM, BPF_ABS, BPF_IND, BPF_MEM, BPF_LEN, BPF_MSH, BPF_DIV, BPF_JA, BPF_JEQ, \
+    BPF_K, BPF_X, BPF_A, BPF_TAX, SKF_AD_PROTOCOL
+
+from conftest import FILTER, FILTER_PROGRAM
+
+EXPRESSIONS = [
+    FILTER,
+    'arp',
+    'ip',
+    'ip6',
+    'vlan',
+    'tcp port 80',
+    'udp and port 53',
+    'icmp or icmp6',
+    'host 10.0.0.1',
+    'net 192.168.0.0/16 and not port 22',
+    'ip[8] < 64',
+    'tcp[tcpflags] & tcp-syn != 0',
+    'greater 100',
+    'less 64',
+    'ether broadcast',
+    'ether[0] & 1 = 1',
+    'vlan 100 and ip',
+]
+
+
+def _ipv4(protocol, source, destination, l4, options=b''):
+    header = struct.pack('!BBHHHBBH4s4s', 0x45 + len(options) // 4, 0, 20 + len(options) + len(l4),
+                         1, 0, 32, protocol, 0, bytes(source), bytes(destination))
+    return header + options + l4
+
+
+def _frames():
+    mac = b'\x02\x00\x00\x00\x00\x02\x02\x00\x00\x00\x00\x01'
+    tcp = struct.pack('!HHIIBBHHH', 1024, 80, 1, 0, 0x50, 0x02, 8192, 0, 0)
+    udp = struct.pack('!HHHH', 5353, 53, 8, 0)
+    frames = [
+        mac + b'\x08\x00' + _ipv4(6, (10, 0, 0, 1), (10, 0, 0, 2), tcp),
+        mac + b'\x08\x00' + _ipv4(6, (192, 168, 1, 1), (10, 0, 0, 2), tcp, options=bytes(8)),
+        mac + b'\x08\x00' + _ipv4(17, (192, 168, 1, 1), (192, 168, 1, 2), udp) + bytes(100),
+        mac + b'\x08\x00' + _ipv4(1, (172, 16, 0, 1), (10, 0, 0, 1), bytes(8)),
+        mac + b'\x86\xdd' + struct.pack('!IHBB', 0x60000000, 8, 58, 64) + bytes(32) + bytes(8),
+        b'\xff' * 6 + mac[6:] + b'\x08\x06' + bytes(28),
+        mac + b'\x81\x00\x00\x64\x08\x00' + _ipv4(17, (10, 0, 0, 1), (10, 0, 0, 2), udp),
+        mac + b'\x81\x00\x00\x65\x86\xdd' + bytes(40),
+        b'\x01\x00\x5e\x00\x00\x01' + mac[6:] + b'\x88\xb5' + bytes(46),
+        mac + b'\x08\x00' + bytes(4),          # Truncated IPv4 header
+        mac[:10],                               # Shorter than an Ethernet header
+    ]
+    return frames
+
+
+@pytest.mark.parametrize('expression', EXPRESSIONS)
+def test_matches_libpcap(expression):
+    pcapy = pytest.importorskip('pcapy')
+    reference = pcapy.BPFProgram(expression, 1)
+    program = BpfProgram(reference.get_bpf())
+
+    for frame in _frames():
+        assert program(frame) == reference.filter(frame), (expression, frame.hex())
+
+
+def test_long_program(make_frame):
+    # ldh [12]; then for each n: jeq #n, accept or try the next; ret #0
+    count = (BPF_MAXINSNS - 3) // 2
+    program = [(BPF_LD | BPF_H | BPF_ABS, 0, 0, 12)]
+    for n in range(count):
+        program.append((BPF_JMP | BPF_JEQ | BPF_K, 0, 1, 0x1000 + n))
+        program.append((BPF_JMP | BPF_JA, 0, 0, 2 * (count - n) - 1))
+    program += [(BPF_RET | BPF_K, 0, 0, 0), (BPF_RET | BPF_K, 0, 0, ACCEPT)]
+
+    bpf = BpfProgram(program)
+    assert bpf(make_frame(0x1000)) == ACCEPT
+    assert bpf(make_frame(0x1000 + count - 1)) == ACCEPT
+    assert bpf(make_frame(0x0800)) == 0
+
+
+def test_long_libpcap_program():
+    pcapy = pytest.importorskip('pcapy')
+    expression = ' or '.join('host 10.0.{}.{}'.format(n // 250, n % 250 + 1) for n in range(130))
+    reference = pcapy.BPFProgram(expression, 1)
+    program = BpfProgram(reference.get_bpf())
+    assert len(program.program) > 1000
+
+    mac = bytes(12) + b'\x08\x00'
+    for frame in (mac + _ipv4(17, (10, 0, 0, 130), (10, 0, 9, 9), bytes(8)),
+                  mac + _ipv4(17, (10, 0, 9, 9), (10, 0, 9, 8), bytes(8))):
+        assert program(frame) == reference.filter(frame)
+    assert program(mac + _ipv4(17, (10, 0, 0, 130), (10, 0, 9, 9), bytes(8))) != 0
+
+
+def test_registers_and_memory(make_frame):
+    program = BpfProgram([
+        (BPF_LDX | BPF_B | BPF_MSH, 0, 0, 14),          # X = IPv4 header length
+        (BPF_LD | BPF_H | BPF_IND, 0, 0, 14),           # A = first half word after it
+        (BPF_ST, 0, 0, 3),
+        (BPF_LD | BPF_IMM, 0, 0, 7),
+        (BPF_LDX | BPF_MEM, 0, 0, 3),
+        (BPF_ALU | BPF_DIV | BPF_X, 0, 0, 0),           # 7 // X
+        (BPF_MISC | BPF_TAX, 0, 0, 0),
+        (BPF_LD | BPF_LEN, 0, 0, 0),
+        (BPF_ALU | 0x00 | BPF_X, 0, 0, 0),              # len + X
+        (BPF_RET | BPF_A, 0, 0, 0),
+    ])
+    frame = make_frame(0x0800, payload=b'\x45' + bytes(19) + b'\x00\x02', size=64)
+    assert program(frame) == 64 + 7 // 2
+    assert program(frame, wire_len=1500) == 1500 + 3
+
+    # Division by zero in X rejects the frame, as in the kernel
+    assert program(make_frame(0x0800, payload=b'\x45', size=64)) == 0
+
+
+def test_out_of_bounds_rejects(make_frame):
+    program = BpfProgram([(BPF_LD | BPF_W | BPF_ABS, 0, 0, 58),
+                          (BPF_RET | BPF_K, 0, 0, ACCEPT)])
+    assert program(make_frame(size=62)) == ACCEPT
+    assert program(make_frame(size=61)) == 0
+
+
+@pytest.mark.parametrize('program', [
+    [],
+    [(BPF_RET | BPF_K, 0, 0, 0)] * (BPF_MAXINSNS + 1),
+    [(BPF_LD | BPF_W | BPF_ABS, 0, 0, ancillary(SKF_AD_PROTOCOL)), (BPF_RET | BPF_A, 0, 0, 0)],
+    [(BPF_ST, 0, 0, 16), (BPF_RET | BPF_K, 0, 0, 0)],
+    [(BPF_ALU | BPF_DIV | BPF_K, 0, 0, 0), (BPF_RET | BPF_K, 0, 0, 0)],
+    [(BPF_JMP | BPF_JEQ | BPF_K, 0, 1, 0), (BPF_RET | BPF_K, 0, 0, 0)],
+    [(BPF_LD | BPF_IMM, 0, 0, 0)],
+])
+def test_invalid_programs(program):
+    with pytest.raises(ValueError):
+        BpfProgram(program)
+
+
+def test_filter_many(make_frame):
+    program = BpfProgram(FILTER_PROGRAM)
+    frames = [make_frame(), make_frame(0x0800), make_frame(size=1500)]
+    assert program.filter_many(frames, use_numpy=False) == [True, False, True]
+    assert BpfProgram(ACCEPT_ALL).filter_many([], use_numpy=False) == []
+
+
+def test_filter_many_numpy(make_frame):
+    pytest.importorskip('numpy')
+    frames = [frame for frame in _frames() for _ in range(3)]
+    for program in (FILTER_PROGRAM,
+                    [(BPF_LD | BPF_B | BPF_ABS, 0, 0, 70), (BPF_RET | BPF_A, 0, 0, 0)]):
+        bpf = BpfProgram(program)
+        expected = bpf.filter_many(frames, use_numpy=False)
+        assert list(bpf.filter_many(frames, use_numpy=True)) == expected
@@ -0,0 +1,93 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compiled BPF program cache and BpfProgramFilter
+"""
+import pytest
+
+from rawsocket import bpfcache
+from rawsocket.bpf import BPF_LD, BPF_W, BPF_ABS, BPF_JMP, BPF_JEQ, BPF_K, BPF_RET, \
+    ancillary, SKF_AD_PKTTYPE, PACKET_OUTGOING
+from rawsocket.iothread import BpfProgramFilter
+from rawsocket.pcapfile import LINKTYPE_ETHERNET, write_pcap
+
+from conftest import FILTER, FILTER_PROGRAM
+
+# What libpcap compiles 'inbound' to, the kernel ancillary load cannot run in user space
+INBOUND_PROGRAM = [(BPF_LD | BPF_W | BPF_ABS, 0, 0, ancillary(SKF_AD_PKTTYPE)),
+                   (BPF_JMP | BPF_JEQ | BPF_K, 0, 1, PACKET_OUTGOING),
+                   (BPF_RET | BPF_K, 0, 0, 0),
+                   (BPF_RET | BPF_K, 0, 0, 65536)]
+
+
+def test_store_and_load(bpf_cache):
+    assert bpfcache.load(FILTER, LINKTYPE_ETHERNET) is None
+    bpfcache.store(FILTER, LINKTYPE_ETHERNET, FILTER_PROGRAM)
+
+    assert bpfcache.cache_dir() == str(bpf_cache)
+    assert bpfcache.load(FILTER, LINKTYPE_ETHERNET) == FILTER_PROGRAM
+    assert bpfcache.load(FILTER, 113) is None
+    assert bpfcache.load('ip', LINKTYPE_ETHERNET) is None
+
+
+def test_damaged_entry_is_a_miss(bpf_cache):
+    bpfcache.store(FILTER, LINKTYPE_ETHERNET, FILTER_PROGRAM)
+    entry, = bpf_cache.iterdir()
+    entry.write_bytes(entry.read_bytes()[:-3])
+    assert bpfcache.load(FILTER, LINKTYPE_ETHERNET) is None
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.setenv('RAWSOCKET_BPF_CACHE', '')
+    assert bpfcache.cache_dir() is None
+    bpfcache.store(FILTER, LINKTYPE_ETHERNET, FILTER_PROGRAM)
+    assert bpfcache.load(FILTER, LINKTYPE_ETHERNET) is None
+
+
+def test_cached_filter_runs_in_user_space(bpf_filter, make_frame, tmp_path):
+    assert bpf_filter.get_bpf() == FILTER_PROGRAM
+    assert bpf_filter(make_frame()) != 0
+    assert bpf_filter(make_frame(0x0800)) == 0
+    assert bpf_filter._bpf is None              # libpcap was not loaded
+
+    frames = [make_frame(), make_frame(0x0800)]
+    assert list(bpf_filter.filter_many(frames, use_numpy=False)) == [True, False]
+
+    path = str(tmp_path / 'frames.pcap')
+    write_pcap(path, [(0.0, len(frame), frame) for frame in frames])
+    assert list(bpf_filter.filter_pcap(path, use_numpy=False)) == [True, False]
+
+
+def test_compiled_filter_is_cached(bpf_cache):
+    pytest.importorskip('pcapy')
+    program = BpfProgramFilter(FILTER).get_bpf()
+    assert bpfcache.load(FILTER, LINKTYPE_ETHERNET) == program
+    assert BpfProgramFilter(FILTER)._bpf is None
+
+
+def test_falls_back_to_libpcap(bpf_cache, make_frame, tmp_path):
+    pcapy = pytest.importorskip('pcapy')
+    bpfcache.store('inbound', LINKTYPE_ETHERNET, INBOUND_PROGRAM)
+    program = BpfProgramFilter('inbound')
+    reference = pcapy.BPFProgram('inbound', LINKTYPE_ETHERNET)
+
+    frame = make_frame()
+    assert program(frame) == reference.filter(frame)
+    assert program._bpf is not None
+
+    assert BpfProgramFilter('inbound').filter_many([frame]) == [reference.filter(frame) != 0]
+
+    path = str(tmp_path / 'frames.pcap')
+    write_pcap(path, [(0.0, len(frame), frame)])
+    assert BpfProgramFilter('inbound').filter_pcap(path) == [reference.filter(frame) != 0]
@@ -0,0 +1,70 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Adaptive receive buffer sizing
+"""
+import pytest
+
+from rawsocket.buftune import BufferTuner
+
+KB = 1024
+
+
+def test_grows_on_drops():
+    tuner = BufferTuner(min_size=256 * KB, max_size=1024 * KB, interval=1.0)
+    assert tuner.update(0.0, 0, 0, 256 * KB) is None                # First sample
+    assert tuner.update(0.5, 10, 0, 256 * KB) is None               # Before the interval
+    assert tuner.update(1.0, 10, 0, 256 * KB) == 512 * KB
+    assert tuner.update(2.0, 20, 0, 512 * KB) == 1024 * KB
+    assert tuner.update(3.0, 30, 0, 1024 * KB) is None              # At max_size
+
+    stats = tuner.statistics()
+    assert stats['rcvbuf_grows'] == 2
+    assert [entry[1:3] for entry in stats['rcvbuf_adjustments']] == \
+        [(256 * KB, 512 * KB), (512 * KB, 1024 * KB)]
+
+
+def test_shrinks_when_quiet():
+    tuner = BufferTuner(min_size=256 * KB, max_size=1024 * KB, interval=1.0, quiet_intervals=3)
+    tuner.update(0.0, 5, 0, 1024 * KB)
+    assert tuner.update(1.0, 5, 100 * KB, 1024 * KB) is None
+    assert tuner.update(2.0, 5, 100 * KB, 1024 * KB) is None
+    assert tuner.update(3.0, 5, 100 * KB, 1024 * KB) == 512 * KB
+    assert tuner.statistics()['rcvbuf_shrinks'] == 1
+
+
+def test_busy_queue_does_not_shrink():
+    tuner = BufferTuner(min_size=256 * KB, max_size=1024 * KB, interval=1.0, quiet_intervals=2)
+    tuner.update(0.0, 0, 0, 512 * KB)
+    tuner.update(1.0, 0, 600 * KB, 512 * KB)                       # Over a quarter of 2 * size
+    assert tuner.update(2.0, 0, 0, 512 * KB) is None
+
+    # A drop restarts the quiet period
+    tuner = BufferTuner(min_size=256 * KB, max_size=1024 * KB, interval=1.0, quiet_intervals=2)
+    tuner.update(0.0, 0, 0, 512 * KB)
+    tuner.update(1.0, 0, 0, 512 * KB)
+    assert tuner.update(2.0, 1, 0, 512 * KB) == 1024 * KB
+    assert tuner.update(3.0, 1, 0, 1024 * KB) is None
+
+
+def test_invalid_limits():
+    with pytest.raises(AssertionError):
+        BufferTuner(min_size=2048, max_size=1024)
+
+
+def test_port_starts_at_min_size(veth, io_thread):
+    io_thread.open(veth[1], lambda frame: None, rcvbuf_tuner=BufferTuner(min_size=256 * KB))
+    stats = io_thread.statistics(veth[1])
+    assert stats['rcvbuf'] == 2 * 256 * KB          # The kernel doubles the requested size
+    assert stats['rcvbuf_grows'] == 0
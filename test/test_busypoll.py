@@ -0,0 +1,52 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Busy poll mode of IOThread
+"""
+from rawsocket.ioport import IOPort
+from rawsocket.iothread import IOThread
+
+SIM = IOPort.BACKEND_SIM
+
+
+def test_busy_poll(network, make_frame, wait_for):
+    received = []
+    io_thread = IOThread(busy_poll=5000).start()
+    try:
+        io_thread.open('sim0', received.append, backend=SIM, network=network)
+        io_thread.open('sim1', None, backend=SIM, network=network)
+
+        for n in range(100):
+            io_thread.send('sim1', make_frame(payload=bytes([n])))
+        assert wait_for(lambda: len(received) == 100)
+        assert [bytes(f)[14] for f in received] == list(range(100))
+
+        # The thread spins out its budget once the frames stop
+        stats = io_thread.thread_statistics()
+        assert wait_for(lambda: io_thread.thread_statistics()['spin_polls'] > 0)
+        assert stats['busy_poll'] == 5000
+
+    finally:
+        io_thread.stop()
+
+
+def test_busy_poll_disabled(io_thread, network, make_frame, wait_for):
+    received = []
+    io_thread.open('sim0', received.append, backend=SIM, network=network)
+    io_thread.open('sim1', None, backend=SIM, network=network)
+    io_thread.send('sim1', make_frame())
+
+    assert wait_for(lambda: received)
+    stats = io_thread.thread_statistics()
+    assert stats['spin_polls'] == stats['busy_rx_polls'] == 0
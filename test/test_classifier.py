@@ -0,0 +1,84 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Bounded traffic classification counters
+"""
+from rawsocket.classifier import SpaceSaving, TrafficClassifier
+from rawsocket.ioport import IOPort
+
+SIM = IOPort.BACKEND_SIM
+
+
+def test_space_saving_exact_below_capacity():
+    table = SpaceSaving(4)
+    for key, count in (('a', 5), ('b', 3), ('c', 1)):
+        for _ in range(count):
+            table.update(key, 10)
+
+    assert table.top(2) == [('a', 5, 50, 0), ('b', 3, 30, 0)]
+    assert len(table) == 3 and table.evictions == 0
+
+
+def test_space_saving_bounded():
+    table = SpaceSaving(8)
+    for n in range(10000):
+        table.update('heavy')
+        table.update(n)                 # A new key every time
+
+    assert len(table) == 8
+    assert table.evictions > 0
+    key, count, _octets, error = table.top(1)[0]
+    assert key == 'heavy' and count - error <= 10000 <= count
+
+    # Every count over-estimates by at most its error
+    assert all(count - error <= 1 for key, count, _, error in table.top(8) if key != 'heavy')
+
+    table.clear()
+    assert len(table) == 0 and table.top() == []
+
+
+def test_vlan_ethertype_and_mac(make_frame):
+    classifier = TrafficClassifier(capacity=16)
+    single = make_frame(0x8100, payload=b'\x00\x64\x08\x00')
+    double = make_frame(0x88a8, payload=b'\x00\x0a\x81\x00\x00\x14\x86\xdd')
+    for frame in (single, single, double, make_frame(0x0806), make_frame()[:13]):
+        classifier.update(frame)
+
+    top = classifier.top(10)
+    assert [(entry['key'], entry['frames']) for entry in top['vlan']] == \
+        [((100, None), 2), ((10, 20), 1), ((None, None), 1)]
+    assert [entry['key'] for entry in top['ethertype']] == ['0x0800', '0x86dd', '0x0806']
+    assert top['src_mac'] == [{'key': '02:00:00:00:00:01', 'frames': 4, 'octets': 240, 'error': 0}]
+    assert classifier.statistics()['classified_frames'] == 4        # Runt not classified
+
+
+def test_disabled_tables(make_frame):
+    classifier = TrafficClassifier(vlan=False, src_mac=False)
+    classifier.update(make_frame())
+    assert list(classifier.top()) == ['ethertype']
+    assert 'classifier_vlan_keys' not in classifier.statistics()
+
+
+def test_port_statistics(io_thread, network, make_frame, wait_for):
+    io_thread.open('sim0', lambda frame: None, backend=SIM, network=network,
+                   classifier=TrafficClassifier())
+    io_thread.open('sim1', None, backend=SIM, network=network)
+    for ethertype in (0x88b5, 0x88b5, 0x0800):
+        io_thread.send('sim1', make_frame(ethertype))
+
+    assert wait_for(lambda: io_thread.statistics('sim0')['classified_frames'] == 3)
+    stats = io_thread.statistics('sim0', top_n=1)
+    assert stats['classifier_ethertype_keys'] == 2
+    assert stats['top_talkers']['ethertype'] == [{'key': '0x88b5', 'frames': 2, 'octets': 120,
+                                                  'error': 0}]
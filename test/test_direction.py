@@ -0,0 +1,98 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Per-port receive direction control and PACKET_QDISC_BYPASS
+"""
+import socket
+import time
+
+import pytest
+
+from rawsocket import ioport
+from rawsocket.ioport import IOPort
+
+
+def _no_ignore_outgoing(sock):
+    return False
+
+
+def _no_filter(sock, program):
+    raise OSError('attach_filter not permitted')
+
+
+@pytest.fixture
+def transmit(veth):
+    """ Send on veth[0] from another socket, the kernel never loops a frame back to its sender """
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+    sock.bind((veth[0], 0))
+    yield sock.send
+    sock.close()
+
+
+@pytest.mark.parametrize('direction, mode', [(IOPort.DIRECTION_IN, 'ignore_outgoing'),
+                                             (IOPort.DIRECTION_IN, 'bpf'),
+                                             (IOPort.DIRECTION_OUT, 'bpf'),
+                                             (IOPort.DIRECTION_IN, 'user'),
+                                             (IOPort.DIRECTION_OUT, 'user')])
+def test_direction(veth, io_thread, transmit, make_frame, wait_for, monkeypatch, direction, mode):
+    if mode != 'ignore_outgoing':
+        monkeypatch.setattr(ioport, 'set_ignore_outgoing', _no_ignore_outgoing)
+    if mode == 'user':
+        monkeypatch.setattr(ioport, 'attach_filter', _no_filter)
+
+    received = []
+    io_thread.open(veth[0], lambda frame: received.append(bytes(frame[:20])), direction=direction)
+    io_thread.open(veth[1], None)
+    stats = io_thread.statistics(veth[0])
+    if mode == 'ignore_outgoing' and stats['rx_direction_mode'] != mode:
+        pytest.skip('PACKET_IGNORE_OUTGOING not supported by this kernel')
+    assert stats['rx_direction_mode'] == mode
+
+    outgoing, incoming = make_frame(payload=b'outgo'), make_frame(payload=b'incom')
+    transmit(outgoing)
+    io_thread.send(veth[1], incoming)
+
+    wanted, unwanted = (outgoing, incoming) if direction == IOPort.DIRECTION_OUT else (incoming, outgoing)
+    assert wait_for(lambda: wanted[:20] in received)
+    time.sleep(0.1)
+    assert unwanted[:20] not in received
+
+    stats = io_thread.statistics(veth[0])
+    assert stats['rx_direction'] == direction
+    if mode == 'user':
+        assert stats['rx_direction_suppressed'] >= 1
+
+
+def test_inout(veth, io_thread, transmit, make_frame, wait_for):
+    received = []
+    io_thread.open(veth[0], lambda frame: received.append(bytes(frame[:20])))
+    io_thread.open(veth[1], None)
+
+    outgoing, incoming = make_frame(payload=b'outgo'), make_frame(payload=b'incom')
+    transmit(outgoing)
+    io_thread.send(veth[1], incoming)
+    assert wait_for(lambda: outgoing[:20] in received and incoming[:20] in received)
+    assert 'rx_direction_mode' not in io_thread.statistics(veth[0])
+
+
+def test_qdisc_bypass(veth, io_thread, make_frame, wait_for):
+    received = []
+    io_thread.open(veth[0], None, qdisc_bypass=True)
+    io_thread.open(veth[1], lambda frame: received.append(bytes(frame[:20])),
+                   direction=IOPort.DIRECTION_IN)
+
+    frame = make_frame(payload=b'bypass')
+    assert io_thread.send(veth[0], frame) == len(frame)
+    assert wait_for(lambda: frame[:20] in received)
+    assert io_thread.statistics(veth[0])['tx_qdisc_bypass'] is True
@@ -0,0 +1,85 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+PACKET_FANOUT receive groups
+"""
+import pytest
+
+from rawsocket.buftune import BufferTuner
+from rawsocket.classifier import TrafficClassifier
+from rawsocket.iothread import IOThread
+from rawsocket.overload import OverloadGuard
+from rawsocket.recorder import FlightRecorder
+from rawsocket.util import PACKET_FANOUT_LB
+
+
+class _Member(object):
+    def __init__(self, stats):
+        self._stats = stats
+
+    def statistics(self, interface, top_n=None):
+        return self._stats
+
+
+def test_merged_statistics():
+    members = [_Member({'rx_frames': 3, 'tx_octets': 120, 'rcvbuf': 1024, 'tx_qdisc_bypass': True,
+                        'rx_queue_high_water': 4, 'backend': 'packet'}),
+               _Member({'rx_frames': 5, 'tx_octets': 60, 'rcvbuf': 2048, 'tx_qdisc_bypass': False,
+                        'rx_queue_high_water': 9, 'backend': 'packet'}),
+               _Member(None)]
+
+    assert IOThread._fanout_statistics('eth0', members, None) == {
+        'rx_frames': 8,
+        'tx_octets': 180,
+        'rcvbuf': 1024,                 # Not a counter, the first member's
+        'tx_qdisc_bypass': True,
+        'rx_queue_high_water': 9,       # The largest, not the sum
+        'backend': 'packet',
+        'fanout_members': 3,
+    }
+
+
+@pytest.mark.parametrize('option, value', [('classifier', TrafficClassifier()),
+                                           ('overload', OverloadGuard()),
+                                           ('rcvbuf_tuner', BufferTuner()),
+                                           ('recorder', FlightRecorder())])
+def test_unshared_options_rejected(option, value):
+    io_thread = IOThread()
+    try:
+        with pytest.raises(ValueError):
+            io_thread.open('eth0', lambda frame: None, fanout=2, **{option: value})
+        assert io_thread.port('eth0') is None
+
+    finally:
+        io_thread.stop()
+
+
+def test_veth(veth, io_thread, make_frame, wait_for):
+    received = []
+    io_thread.open(veth[0], None)
+    io_thread.open(veth[1], lambda frame: received.append(bytes(frame[:15])), fanout=2,
+                   fanout_mode=PACKET_FANOUT_LB)
+
+    frames = [make_frame(payload=bytes([n])) for n in range(20)]
+    for frame in frames:
+        io_thread.send(veth[0], frame)
+
+    assert wait_for(lambda: sorted(f for f in received if f[12:14] == b'\x88\xb5') ==
+                    sorted(f[:15] for f in frames))
+    stats = io_thread.statistics(veth[1])
+    assert stats['fanout_members'] == 2
+    assert stats['rx_frames'] >= 20
+
+    io_thread.close(veth[1])
+    assert io_thread.statistics(veth[1]) is None
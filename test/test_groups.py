@@ -0,0 +1,78 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Ports serviced by group and receive threads
+"""
+import threading
+
+from rawsocket.ioport import IOPort
+from rawsocket.iothread import IOThread
+
+SIM = IOPort.BACKEND_SIM
+
+
+def _receiving(received):
+    def rx_callback(frame):
+        received.append((threading.current_thread().name, bytes(frame)))
+    return rx_callback
+
+
+def test_group_thread(io_thread, network, make_frame, wait_for):
+    received = []
+    io_thread.open('sim0', _receiving(received), backend=SIM, network=network, group='rx')
+    io_thread.open('sim1', None, backend=SIM, network=network)
+
+    assert io_thread.port('sim0') is not None
+    assert io_thread.send('sim1', make_frame()) == 60
+    assert wait_for(lambda: received)
+    assert received[0][0] == 'IOThread-rx'
+    assert list(io_thread.thread_statistics()['groups']) == ['rx']
+
+
+def test_keep_closed_group_started(network, make_frame, wait_for):
+    received = []
+    io_thread = IOThread()
+    try:
+        io_thread.open('sim0', _receiving(received), backend=SIM, network=network, group=True,
+                       keep_closed=True)
+        io_thread.open('sim1', None, backend=SIM, network=network, keep_closed=True)
+        io_thread.send('sim1', make_frame())
+        assert not wait_for(lambda: received, timeout=0.2)          # Nothing running yet
+
+        io_thread.start()
+        assert wait_for(lambda: received)
+        assert received[0][0] == 'IOThread-sim0'
+
+    finally:
+        io_thread.stop()
+
+
+def test_receive_threads(network, make_frame, wait_for):
+    received = []
+    io_thread = IOThread(receive_threads=2)
+    try:
+        for n in range(4):
+            network.link('in{}'.format(n), 'out{}'.format(n))
+            io_thread.open('in{}'.format(n), _receiving(received), backend=SIM, network=network)
+            io_thread.open('out{}'.format(n), None, backend=SIM, network=network, group='tx')
+
+        for n in range(4):
+            io_thread.send('out{}'.format(n), make_frame(payload=bytes([n])))
+
+        assert wait_for(lambda: len(received) == 4)
+        threads = {name for name, _ in received}
+        assert threads == {'IOThread-rx0', 'IOThread-rx1'}
+
+    finally:
+        io_thread.stop()
@@ -0,0 +1,56 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Frames sent as buffers or sequences of segments
+"""
+from array import array
+
+from rawsocket.ioport import IOPort, frame_segments, frame_bytes
+
+SIM = IOPort.BACKEND_SIM
+
+
+def test_frame_segments(make_frame):
+    frame = make_frame()
+    assert frame_segments(frame) == ((frame,), 60)
+
+    header, payload = bytearray(frame[:14]), memoryview(frame[14:])
+    segments, length = frame_segments([header, payload])
+    assert list(segments) == [header, payload] and length == 60
+
+    words = array('H', frame)                           # Length counted in octets
+    assert frame_segments(words)[1] == 2 * len(words) == 60
+
+
+def test_frame_bytes(make_frame):
+    frame = make_frame()
+    assert frame_bytes(frame) is frame
+    assert frame_bytes((frame[:14], bytearray(frame[14:]))) == frame
+    assert frame_bytes(memoryview(frame)) == frame
+
+
+def test_send_segmented(io_thread, network, make_frame, wait_for):
+    received = []
+    io_thread.open('sim0', received.append, backend=SIM, network=network)
+    io_thread.open('sim1', None, backend=SIM, network=network)
+
+    frame = make_frame(payload=b'segments')
+    assert io_thread.send('sim1', (frame[:14], memoryview(frame)[14:])) == 60
+
+    frames = [frame, [frame[:14], frame[14:]], bytearray(frame)]
+    assert io_thread.send_many('sim1', frames) == 3
+
+    assert wait_for(lambda: len(received) == 4)
+    assert all(bytes(f) == frame for f in received)
+    assert io_thread.statistics('sim1')['tx_octets'] == 4 * 60
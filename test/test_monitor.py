@@ -0,0 +1,78 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Live receive rate monitor, rawsocket.monitor
+"""
+import json
+
+from rawsocket import monitor
+from rawsocket.classifier import TrafficClassifier
+from rawsocket.ioport import IOPort
+from rawsocket.monitor import Monitor, render
+from rawsocket.trace import Tracer
+
+SIM = IOPort.BACKEND_SIM
+
+
+def test_sample(io_thread, network, make_frame, wait_for):
+    tracer = Tracer()
+    io_thread.set_tracer(tracer)
+    io_thread.open('sim0', lambda frame: None, backend=SIM, network=network,
+                   classifier=TrafficClassifier(vlan=False, ethertype=False))
+    io_thread.open('sim1', None, backend=SIM, network=network)
+    io_thread.send('sim1', make_frame())
+    assert wait_for(lambda: io_thread.statistics('sim0')['rx_frames'] == 1)
+
+    # Counted from the first sample on
+    rates = Monitor(io_thread, ['sim0'], tracer=tracer, top_n=3)
+    for _ in range(4):
+        io_thread.send('sim1', make_frame(size=100))
+    assert wait_for(lambda: io_thread.statistics('sim0')['rx_frames'] == 5)
+
+    sample, = rates.sample()
+    assert sample['interface'] == 'sim0'
+    assert sample['rx_frames'] == 5
+    assert sample['pps'] > 0 and sample['mbps'] > 0
+    assert (sample['kernel_drops'], sample['user_drops']) == (0, 0)
+    assert set(sample['callback_latency_us']) == {'p50', 'p99', 'p99.9', 'max'}
+    assert sample['top_talkers'][0][1] == 5
+
+    sample, = rates.sample()
+    assert sample['pps'] == 0
+    assert sample['callback_latency_us'] is None       # The tracer is cleared every sample
+
+
+def test_render():
+    samples = [{'interface': 'eth0', 'pps': 1500.4, 'mbps': 12.0, 'kernel_drops': 2, 'user_drops': 3,
+                'callback_latency_us': {'p50': 1.25, 'p99': 8.0, 'p99.9': 20.0, 'max': 31.0},
+                'top_talkers': [('02:00:00:00:00:01', 42)]},
+               {'interface': 'eth1', 'pps': 0.0, 'mbps': 0.0, 'kernel_drops': 0, 'user_drops': 0,
+                'callback_latency_us': None, 'top_talkers': []}]
+
+    lines = render(samples, 2).splitlines()
+    assert lines[0].startswith('rawsocket monitor') and lines[0].endswith('every 2s')
+    assert lines[3].split() == ['eth0', '1500', '12.00', '2', '3', '1.2', '8.0', '20.0']
+    assert lines[4].split() == ['eth1', '0', '0.00', '0', '0', '-', '-', '-']
+    assert lines[6] == 'eth0 top talkers (frames since start)'
+    assert lines[7].split() == ['02:00:00:00:00:01', '42']
+    assert len(lines) == 8
+
+
+def test_main_json(capsys):
+    assert monitor.main(['monitor-sim0', '--backend', 'sim', '--json', '--duration', '0.2',
+                         '--interval', '0.1']) == 0
+
+    samples = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert len(samples) >= 2
+    assert all(sample['interface'] == 'monitor-sim0' and sample['pps'] == 0 for sample in samples)
@@ -0,0 +1,91 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Receive path overload protection, rawsocket.overload
+"""
+from rawsocket.ioport import IOPort
+from rawsocket.overload import OverloadGuard, STATE_NORMAL, STATE_SAMPLING, STATE_DROPPING
+
+SIM = IOPort.BACKEND_SIM
+
+
+def test_rate_limit_burst():
+    guard = OverloadGuard(rate_limit=0.001, burst=3)
+    assert [guard.admit() for _ in range(5)] == [True] * 3 + [False] * 2
+    assert guard.state == STATE_NORMAL
+    assert not guard.timed
+
+
+def test_watchdog_escalates_and_recovers():
+    guard = OverloadGuard(sample_rate=4, callback_budget=0.001, recover_intervals=2, interval=1.0)
+    assert guard.timed
+
+    guard.record(0.01)
+    assert guard.evaluate(10.0) == STATE_SAMPLING
+    assert [guard.admit() for _ in range(8)] == ([False] * 3 + [True]) * 2
+
+    guard.record(0.01)
+    assert guard.evaluate(10.5) is None                 # Not yet the next interval
+    assert guard.evaluate(11.0) == STATE_DROPPING
+    assert not any(guard.admit() for _ in range(10))
+
+    guard.record(0.0001)
+    assert guard.evaluate(12.0) is None                 # One healthy interval
+    guard.record(0.0008)
+    assert guard.evaluate(13.0) is None                 # Above recover_ratio resets the count
+    for now in (14.0, 15.0):
+        guard.record(0.0001)
+        state = guard.evaluate(now)
+    assert state == STATE_SAMPLING
+
+    assert guard.evaluate(16.0) is None                 # No frames counts as healthy
+    assert guard.evaluate(17.0) == STATE_NORMAL
+    assert guard.statistics()['overload_transitions'] == 4
+
+
+def test_kernel_sampling_estimate():
+    guard = OverloadGuard(sample_rate=10, callback_budget=0.001)
+    guard.record(1.0)
+    guard.evaluate(0.0)
+    guard.set_in_kernel(True)
+    assert all(guard.admit() for _ in range(3))         # The kernel already sampled
+
+    stats = guard.statistics()
+    assert stats['overload_kernel_sampling']
+    assert stats['rx_shed_kernel_estimate'] == 27
+
+
+def test_sim_sheds(io_thread, network, make_frame, wait_for):
+    received = []
+    io_thread.open('sim0', received.append, backend=SIM, network=network,
+                   overload=OverloadGuard(rate_limit=0.001, burst=2))
+    io_thread.open('sim1', None, backend=SIM, network=network)
+
+    for _ in range(5):
+        io_thread.send('sim1', make_frame())
+
+    assert wait_for(lambda: io_thread.statistics('sim0')['rx_shed'] == 3)
+    stats = io_thread.statistics('sim0')
+    assert stats['rx_frames'] == 2
+    assert stats['overload_state'] == STATE_NORMAL
+    assert len(received) == 2
+
+
+def test_packet_kernel_sampling(veth, io_thread, wait_for):
+    guard = OverloadGuard(sample_rate=4, callback_budget=0.001, recover_intervals=100, interval=0.0)
+    io_thread.open(veth[1], lambda frame: None, overload=guard)
+
+    guard.record(1.0)                                   # Degrades on the next I/O thread tick
+    assert wait_for(lambda: guard.state == STATE_SAMPLING)
+    assert io_thread.statistics(veth[1])['overload_kernel_sampling']
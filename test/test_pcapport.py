@@ -0,0 +1,155 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Capture files and their replay, rawsocket.pcapfile and rawsocket.pcapport
+"""
+import struct
+import time
+
+import pytest
+
+from rawsocket.ioport import IOPort
+from rawsocket.iothread import IOThread
+from rawsocket.pcapfile import open_capture, write_pcap, PcapngReader
+from rawsocket.pcapport import PcapIOPort
+
+PCAP = IOPort.BACKEND_PCAP
+
+
+@pytest.fixture
+def capture(tmp_path, make_frame):
+    """ Ten frames 10 ms apart with a wire length of 100, every third one IPv4 """
+    path = str(tmp_path / 'capture.pcap')
+    write_pcap(path, [(1000.0 + n * 0.01, 100,
+                       make_frame(0x0800 if n % 3 == 0 else 0x88b5, bytes([n])))
+                      for n in range(10)])
+    return path
+
+
+def _block(block_type, body):
+    body += bytes(-len(body) % 4)
+    length = len(body) + 12
+    return struct.pack('<II', block_type, length) + body + struct.pack('<I', length)
+
+
+def test_pcap_round_trip(capture):
+    with open_capture(capture) as reader:
+        records = [(timestamp, wire_len, bytes(frame)) for timestamp, wire_len, frame in reader]
+
+    assert len(records) == 10
+    assert records[3][0] == pytest.approx(1000.03)
+    assert all(wire_len == 100 and len(frame) == 60 for _, wire_len, frame in records)
+    assert [frame[14] for _, _, frame in records] == list(range(10))
+
+
+def test_pcapng(tmp_path, make_frame):
+    path = str(tmp_path / 'capture.pcapng')
+    shb = _block(0x0A0D0D0A, struct.pack('<IHHq', 0x1A2B3C4D, 1, 0, -1))
+    idb = _block(1, struct.pack('<HHI', 1, 0, 128) +
+                 struct.pack('<HHB', 9, 1, 9) + bytes(3) + struct.pack('<HH', 0, 0))   # ns
+    frames = [make_frame(payload=bytes([n])) for n in range(3)]
+    epbs = [_block(6, struct.pack('<IIIII', 0, 0, 1500000000 + n, 60, 64) + frame)
+            for n, frame in enumerate(frames)]
+    with open(path, 'wb') as f:
+        f.write(shb + idb + b''.join(epbs) + epbs[0][:20])        # Truncated final block
+
+    reader = open_capture(path)
+    try:
+        assert isinstance(reader, PcapngReader)
+        assert reader.snaplen == 128
+        records = [(timestamp, wire_len, bytes(frame)) for timestamp, wire_len, frame in reader]
+
+    finally:
+        reader.close()
+
+    assert [frame for _, _, frame in records] == frames
+    assert [wire_len for _, wire_len, _ in records] == [64] * 3
+    assert records[1][0] == pytest.approx(1.500000001)
+
+
+def test_replay(capture):
+    received = []
+    port = PcapIOPort('replay', lambda f: received.append(bytes(f)), capture=capture)
+    try:
+        assert port.replay(count=4) == 4
+        assert not port.finished
+        assert port.replay() == 6
+        assert port.finished
+
+    finally:
+        port.close()
+
+    assert [f[14] for f in received] == list(range(10))
+    stats = port.statistics()
+    assert stats['rx_frames'] == 10
+    assert stats['rx_octets'] == 600
+
+
+def test_replay_filter(capture, bpf_filter):
+    received = []
+    port = PcapIOPort(capture, lambda f: received.append(bytes(f)), bpf_filter=bpf_filter)
+    try:
+        assert port.replay() == 10
+        assert port.statistics()['rx_filtered'] == 4
+
+    finally:
+        port.close()
+
+    assert [f[14] for f in received] == [1, 2, 4, 5, 7, 8]
+
+
+@pytest.mark.parametrize('timing', [False, True])
+def test_io_thread(capture, timing):
+    received = []
+
+    def rx_callback(f):
+        time.sleep(0.001)
+        received.append(bytes(f))
+
+    io_thread = IOThread()
+    io_thread.start()
+    try:
+        start = time.monotonic()
+        io_thread.open(capture, rx_callback, backend=PCAP, timing=timing)
+        port = io_thread.port(capture)
+
+        assert port.wait(5)
+        assert len(received) == 10           # Finished only once the last frame is delivered
+        if timing:
+            assert time.monotonic() - start >= 0.09
+
+    finally:
+        io_thread.stop()
+
+    assert [f[14] for f in received] == list(range(10))
+
+
+def test_pull_mode(capture):
+    io_thread = IOThread()
+    io_thread.start()
+    try:
+        io_thread.open(capture, None, backend=PCAP)
+        frames = []
+        while len(frames) < 10:
+            batch = io_thread.receive_many(capture, timeout=5)
+            assert batch
+            frames.extend(batch)
+
+        assert io_thread.port(capture).wait(5)
+        assert io_thread.receive(capture, timeout=0.05) is None
+
+    finally:
+        io_thread.stop()
+
+    assert [bytes(f)[14] for f in frames] == list(range(10))
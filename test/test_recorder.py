@@ -0,0 +1,95 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Flight recorder, rawsocket.recorder
+"""
+from array import array
+
+import pytest
+
+from rawsocket.ioport import IOPort
+from rawsocket.pcapfile import open_capture
+from rawsocket.recorder import FlightRecorder, DIRECTION_RX, DIRECTION_TX
+
+SIM = IOPort.BACKEND_SIM
+
+
+def read(path):
+    with open_capture(path) as reader:
+        return [(wire_len, bytes(frame)) for _timestamp, wire_len, frame in reader]
+
+
+def test_keeps_most_recent():
+    recorder = FlightRecorder(frames=3, snaplen=4)
+    for n in range(5):
+        recorder.rx(bytes([n]) * 10)
+
+    assert [(wire_len, frame) for _, wire_len, frame in recorder.records(DIRECTION_RX)] == \
+        [(10, bytes([n]) * 4) for n in (2, 3, 4)]
+    assert recorder.records(DIRECTION_TX) == []
+
+    stats = recorder.statistics()
+    assert stats['recorder_rx_frames'] == 5
+    assert stats['recorder_octets'] == 2 * 3 * 4
+
+
+def test_octets_sizes_the_rings():
+    recorder = FlightRecorder(octets=1000, snaplen=100)
+    assert recorder.frames == 10
+
+
+def test_segmented_and_buffer_frames():
+    recorder = FlightRecorder(frames=8, snaplen=6)
+    recorder.tx((b'ab', bytearray(b'cd'), memoryview(b'efgh')))
+    recorder.tx(array('H', [0x0101, 0x0202, 0x0303, 0x0404]))
+    recorder.tx(b'xyz')
+
+    assert [(wire_len, frame) for _, wire_len, frame in recorder.records(DIRECTION_TX)] == \
+        [(8, b'abcdef'), (8, b'\x01\x01\x02\x02\x03\x03'), (3, b'xyz')]
+
+
+def test_trigger_dumps_on_tick(tmp_path):
+    recorder = FlightRecorder(frames=4, snaplen=16, dump_dir=str(tmp_path),
+                              trigger=lambda frame: frame[0] == 0xee)
+    recorder.rx(bytes(10))
+    assert recorder.tick('eth0') is None
+
+    recorder.rx(b'\xee' * 10)
+    recorder.tx(b'\x01' * 10)
+    path = recorder.tick('eth0')
+    assert path.startswith(str(tmp_path))
+    assert read(path) == [(10, bytes(10)), (10, b'\xee' * 10), (10, b'\x01' * 10)]
+    assert recorder.tick('eth0') is None
+    assert recorder.statistics()['recorder_dumps'] == 1
+
+
+def test_port_recorder_dump(io_thread, network, make_frame, wait_for, tmp_path):
+    received = []
+    recorder = FlightRecorder(frames=4, snaplen=32)
+    io_thread.open('sim0', received.append, backend=SIM, network=network, recorder=recorder)
+    io_thread.open('sim1', None, backend=SIM, network=network)
+
+    for n in range(6):
+        io_thread.send('sim1', make_frame(payload=bytes([n]), size=100))
+        io_thread.send('sim0', make_frame(payload=bytes([n])))
+    assert wait_for(lambda: len(received) == 6)
+
+    path = str(tmp_path / 'sim0.pcap')
+    assert io_thread.dump_recorder('sim0', path, DIRECTION_RX) == 4
+    assert read(path) == [(100, make_frame(payload=bytes([n]), size=100)[:32])
+                          for n in range(2, 6)]
+    assert io_thread.statistics('sim0')['recorder_tx_frames'] == 6
+
+    with pytest.raises(ValueError):
+        io_thread.dump_recorder('sim1', path)               # No recorder
@@ -0,0 +1,126 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Pull-mode receive, rawsocket.rxqueue and IOThread.receive
+"""
+import threading
+
+import pytest
+
+from rawsocket.ioport import IOPort
+from rawsocket.rxqueue import ReceiveQueue, OVERFLOW_DROP_NEWEST, OVERFLOW_DROP_OLDEST
+
+SIM = IOPort.BACKEND_SIM
+
+
+def test_queue_order_and_capacity():
+    queue = ReceiveQueue(5)
+    assert queue.capacity == 8                  # Rounded up to a power of two
+
+    for n in range(3):
+        assert queue.put(bytes([n]))
+    assert len(queue) == 3
+    assert queue.get(0) == b'\x00'
+    assert queue.get_many(10, 0) == [b'\x01', b'\x02']
+    assert queue.get(0) is None
+    assert queue.get_many(10, 0) == []
+
+
+@pytest.mark.parametrize('overflow, expected', [(OVERFLOW_DROP_NEWEST, list(range(4))),
+                                                (OVERFLOW_DROP_OLDEST, list(range(2, 6)))])
+def test_queue_overflow(overflow, expected):
+    queue = ReceiveQueue(4, overflow=overflow)
+    results = [queue.put(bytes([n])) for n in range(6)]
+
+    assert results == [True] * 4 + [overflow == OVERFLOW_DROP_OLDEST] * 2
+    assert [f[0] for f in queue.get_many(10, 0)] == expected
+
+    stats = queue.statistics()
+    assert stats['rx_queue_drops'] == 2
+    assert stats['rx_queue_enqueued'] == 6 if overflow == OVERFLOW_DROP_OLDEST else 4
+    assert stats['rx_queue_high_water'] == 4
+
+
+def test_queue_vnet_hdr():
+    queue = ReceiveQueue(4)
+    queue.put(b'frame', vnet_hdr='hdr')
+    assert queue.get(0) == (b'frame', 'hdr')
+
+
+def test_queue_wakes_waiter():
+    queue = ReceiveQueue(4)
+    threading.Timer(0.05, queue.put, (b'x',)).start()
+    assert queue.get(5) == b'x'
+
+    threading.Timer(0.05, queue.close).start()
+    assert queue.get(5) is None
+    assert queue.closed
+
+
+def test_queue_close_keeps_frames():
+    queue = ReceiveQueue(4)
+    queue.put(b'x')
+    queue.close()
+    assert queue.get(None) == b'x'              # Queued before the close
+    assert queue.get(None) is None              # Closed, does not block
+
+
+def test_pull_mode(io_thread, network, make_frame, wait_for):
+    io_thread.open('sim0', None, backend=SIM, network=network)
+    io_thread.open('sim1', None, backend=SIM, network=network)
+
+    assert io_thread.receive('sim0', timeout=0) is None
+    for n in range(5):
+        io_thread.send('sim1', make_frame(payload=bytes([n])))
+
+    assert bytes(io_thread.receive('sim0', timeout=5))[14] == 0
+    assert wait_for(lambda: io_thread.statistics('sim0')['rx_frames'] == 5)
+    assert [bytes(f)[14] for f in io_thread.receive_many('sim0', timeout=5)] == [1, 2, 3, 4]
+    assert io_thread.receive_many('sim0', timeout=0.05) == []
+    assert io_thread.statistics('sim0')['rx_queue_enqueued'] == 5
+
+
+def test_pull_mode_closed(io_thread, network):
+    io_thread.open('sim0', None, backend=SIM, network=network)
+    io_thread.open('sim1', lambda f: None, backend=SIM, network=network)
+
+    with pytest.raises(ValueError):
+        io_thread.receive('sim1', timeout=0)    # Opened with an rx_callback
+
+    closer = threading.Timer(0.1, io_thread.close, ('sim0',))
+    closer.start()
+    assert io_thread.receive('sim0', timeout=5) is None       # Woken by the close
+    closer.join()
+
+    assert io_thread.receive('sim0', timeout=0) is None
+    assert io_thread.receive_many('sim0', timeout=0) == []
+
+
+def test_pull_mode_unknown_interface(io_thread, network, make_frame, wait_for):
+    with pytest.raises(ValueError):
+        io_thread.receive('sim0', timeout=0)        # Never opened
+
+    # Frames queued before a group port closes are still read afterwards
+    io_thread.open('sim0', None, backend=SIM, network=network, group='pull')
+    io_thread.open('sim1', None, backend=SIM, network=network)
+    io_thread.send('sim1', make_frame())
+    assert wait_for(lambda: io_thread.statistics('sim0')['rx_queue_depth'] == 1)
+
+    io_thread.close('sim0')
+    assert io_thread.receive('sim0', timeout=0) is not None
+    assert io_thread.receive('sim0', timeout=1) is None
+
+    io_thread.open('sim0', lambda f: None, backend=SIM, network=network)
+    with pytest.raises(ValueError):
+        io_thread.receive('sim0', timeout=0)        # Reopened with an rx_callback
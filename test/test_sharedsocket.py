@@ -0,0 +1,46 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Ports sharing one AF_PACKET socket
+"""
+import pytest
+
+from rawsocket.sharedsocket import SharedIOPort
+
+
+def test_tx_pool_rejected():
+    with pytest.raises(ValueError):
+        SharedIOPort('eth0', None, None, tx_pool=True)
+
+
+def test_shared_ports(veth, io_thread, bpf_filter, make_frame, wait_for):
+    received = {name: [] for name in veth}
+    for name in veth:
+        io_thread.open(name, received[name].append, bpf_filter=bpf_filter, shared=True)
+
+    # The kernel filter passes a new member's frames once the I/O thread syncs it
+    frame = make_frame(payload=b'shared')
+
+    def delivered():
+        assert io_thread.send(veth[0], frame) == len(frame)
+        return received[veth[1]]
+
+    assert wait_for(delivered)
+    assert io_thread.send(veth[1], make_frame(0x0800)) > 0         # Filtered out
+    assert wait_for(lambda: io_thread.statistics(veth[0])['rx_filtered'] >= 1)
+    assert all(bytes(f[:len(frame)]) == frame for f in received[veth[1]])
+
+    stats = io_thread.statistics(veth[0])
+    assert stats['ifindex'] is not None
+    assert not received[veth[0]]
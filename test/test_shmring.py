@@ -0,0 +1,118 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Shared memory frame ring and the process based receive engine
+"""
+import pytest
+
+from rawsocket.ioport import IOPort
+from rawsocket.pcapfile import write_pcap
+from rawsocket.rxworker import ReceiveWorker
+from rawsocket.shmring import SharedFrameRing, RECORD_HEADER_SIZE
+
+
+@pytest.fixture
+def ring():
+    consumer = SharedFrameRing.create(1024)
+    producer = SharedFrameRing.attach(consumer.name)
+    yield consumer, producer
+    producer.close()
+    consumer.close()
+
+
+def test_write_and_consume(ring, make_frame):
+    consumer, producer = ring
+    assert producer.write(make_frame(), timestamp=1)
+    assert producer.write(make_frame(0x8100, size=64)[:32], vlan=100, wire_len=64, timestamp=2)
+
+    frames = consumer.read_batch()
+    assert frames == [(make_frame(), 60, None, 1), (make_frame(0x8100, size=64)[:32], 64, 100, 2)]
+    assert consumer.read_batch() == []
+
+    stats = consumer.statistics()
+    assert stats['ring_frames'] == stats['ring_consumed'] == 2
+    assert stats['ring_queued_octets'] == 0
+
+
+def test_wrap_and_drop(ring, make_frame):
+    consumer, producer = ring
+    size = (RECORD_HEADER_SIZE + 100 + 7) & ~7
+    fits = consumer.capacity // size
+
+    for n in range(3):
+        for i in range(fits):
+            assert producer.write(make_frame(payload=bytes([n, i]), size=100))
+        assert not producer.write(make_frame(size=100))         # Full, dropped
+        frames = consumer.read_batch(max_frames=fits + 1)
+        assert [f[0][14:16] for f in frames] == [bytes([n, i]) for i in range(fits)]
+
+    assert consumer.statistics()['ring_dropped'] == 3
+
+
+def test_consume_after_close(ring, make_frame):
+    consumer, producer = ring
+    producer.write(make_frame())
+    producer.close()
+    assert consumer.closed
+    assert len(consumer.read_batch()) == 1          # Frames written before closing are kept
+    assert not consumer.wait(0.1)
+
+    consumer.close()
+    assert consumer.closed
+    assert consumer.read_batch(timeout=0.1) == []
+    assert len(consumer) == 0
+
+
+@pytest.fixture
+def capture(tmp_path, make_frame):
+    tagged = make_frame(0x8100, payload=b'\x00\x64\x88\xb5', size=200)
+    frames = [make_frame(), tagged, make_frame()[:10], make_frame(size=300)]
+    path = str(tmp_path / 'frames.pcap')
+    write_pcap(path, [(0.0, len(frame), frame) for frame in frames])
+    return path, frames
+
+
+def _worker_frames(worker, count, wait_for):
+    frames = []
+    assert wait_for(lambda: frames.extend(worker.ring.read_batch(timeout=0.1)) or
+                    len(frames) >= count, timeout=60.0)
+    return frames
+
+
+def test_worker(capture, wait_for):
+    path, frames = capture
+    worker = ReceiveWorker('replay', backend=IOPort.BACKEND_PCAP, capture=path).start()
+    ring = worker.ring
+    try:
+        received = _worker_frames(worker, len(frames), wait_for)
+        assert [f[0] for f in received] == frames
+        assert [f[2] for f in received] == [None, 100, None, None]
+
+    finally:
+        worker.stop()
+
+    assert ring.read_batch() == []                 # Closed by stop(), nothing to read
+
+
+def test_worker_snaplen(capture, wait_for):
+    path, frames = capture
+    worker = ReceiveWorker('replay', backend=IOPort.BACKEND_PCAP, capture=path,
+                           snaplen=64).start()
+    try:
+        received = _worker_frames(worker, len(frames), wait_for)
+        assert [f[0] for f in received] == [frame[:64] for frame in frames]
+        assert [f[1] for f in received] == [len(frame) for frame in frames]
+
+    finally:
+        worker.stop()
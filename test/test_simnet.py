@@ -0,0 +1,104 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Simulated interface backend, rawsocket.simnet
+"""
+import time
+
+import pytest
+
+from rawsocket.ioport import IOPort
+from rawsocket.iothread import IOThread
+from rawsocket.simnet import SimNetwork, SimIOPort
+
+SIM = IOPort.BACKEND_SIM
+
+
+def test_dispatch(io_thread, network, make_frame, wait_for):
+    received = []
+    io_thread.open('sim0', received.append, backend=SIM, network=network)
+    io_thread.open('sim1', None, backend=SIM, network=network)
+
+    for n in range(10):
+        assert io_thread.send('sim1', make_frame(payload=bytes([n]))) == 60
+
+    assert wait_for(lambda: len(received) == 10)
+    assert [bytes(f)[14] for f in received] == list(range(10))
+
+    stats = io_thread.statistics('sim0')
+    assert stats['backend'] == 'sim'
+    assert stats['rx_frames'] == 10
+    assert stats['rx_octets'] == 600
+    assert io_thread.statistics('sim1')['tx_frames'] == 10
+
+
+def test_bpf_filter(io_thread, network, bpf_filter, make_frame, wait_for):
+    received = []
+    io_thread.open('sim0', received.append, bpf_filter=bpf_filter, backend=SIM, network=network)
+    io_thread.open('sim1', None, backend=SIM, network=network)
+
+    for ethertype in (0x88b5, 0x0800, 0x88b5, 0x86dd):
+        io_thread.send('sim1', make_frame(ethertype))
+
+    assert wait_for(lambda: len(received) == 2)
+    time.sleep(0.1)
+    assert len(received) == 2
+    assert all(bytes(f[12:14]) == b'\x88\xb5' for f in received)
+    assert io_thread.statistics('sim0')['rx_filtered'] == 2
+
+
+def test_link_loss_and_down(make_frame):
+    network = SimNetwork()
+    network.link('a', 'b', bidirectional=False)
+    network.link('c', 'b', loss=1.0)
+
+    assert network.transmit('a', make_frame()) == 1
+    assert network.transmit('b', make_frame()) == 0         # a to b only
+    assert network.transmit('c', make_frame()) == 0         # Always lost
+
+    network.interface('b').up = False
+    assert network.transmit('a', make_frame()) == 0
+    assert network.interface('b').rx_down == 1
+
+
+def test_send_on_down_interface(io_thread, network, make_frame):
+    io_thread.open('sim1', None, backend=SIM, network=network)
+    port = io_thread.port('sim1')
+    port.down()
+    with pytest.raises(OSError):
+        port.send(make_frame())
+    port.up()
+    assert port.send(make_frame()) == 60
+
+
+def test_sim_queue_size(network, make_frame):
+    io_thread = IOThread()              # Not started, so nothing drains the interface
+    io_thread.open('sim0', lambda f: None, backend=SIM, network=network, sim_queue_size=4)
+    io_thread.open('sim1', None, backend=SIM, network=network)
+    try:
+        for _ in range(10):
+            io_thread.send('sim1', make_frame())
+
+        stats = io_thread.statistics('sim0')
+        assert stats['rx_kernel_packets'] == 4
+        assert stats['rx_kernel_drops'] == 6
+
+    finally:
+        io_thread.stop()
+
+
+def test_tx_pool_rejected(network):
+    with pytest.raises(ValueError):
+        SimIOPort('sim0', None, network=network, tx_pool=True)
+    assert network.interface('sim0').filter is None
@@ -0,0 +1,92 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Snaplen-limited receive
+"""
+import pytest
+
+from rawsocket import monitor
+from rawsocket.bpf import BpfProgram, snapped, ACCEPT_ALL
+from rawsocket.classifier import TrafficClassifier
+from rawsocket.ioport import IOPort
+from rawsocket.pcapfile import write_pcap
+from rawsocket.pcapport import PcapIOPort
+from rawsocket.recorder import FlightRecorder
+from rawsocket.sharedsocket import SharedIOPort
+from rawsocket.xdp import XdpIOPort
+
+SIM = IOPort.BACKEND_SIM
+
+
+def test_snapped_program(bpf_filter, make_frame):
+    assert BpfProgram(snapped(None, 64))(make_frame(size=1500)) == 64
+    assert snapped(ACCEPT_ALL, 64) == snapped(None, 64)
+
+    program = BpfProgram(snapped(bpf_filter.get_bpf(), 64))
+    assert program(make_frame(size=1500)) == 64
+    assert program(make_frame(0x0800, size=1500)) == 0
+
+
+def test_classifier_and_recorder_wire_length(make_frame):
+    classifier = TrafficClassifier()
+    classifier.update(make_frame(size=64), 1500)
+    assert classifier.top(1)['ethertype'][0]['octets'] == 1500
+
+    recorder = FlightRecorder(frames=2, snaplen=32)
+    recorder.rx(make_frame(size=64), 1500)
+    recorder.rx(make_frame(size=64))
+    assert [wire_len for _, wire_len, _ in recorder.records()] == [1500, 64]
+
+
+def test_sim(io_thread, network, make_frame, wait_for):
+    received = []
+    classifier = TrafficClassifier()
+    io_thread.open('sim0', received.append, backend=SIM, network=network, snaplen=20,
+                   classifier=classifier)
+    io_thread.open('sim1', None, backend=SIM, network=network)
+
+    io_thread.send('sim1', make_frame(size=200))
+    io_thread.send('sim1', make_frame(size=10))
+    assert wait_for(lambda: len(received) == 2)
+    assert [len(f) for f in received] == [20, 14]
+    assert io_thread.statistics('sim0')['rx_octets'] == 214
+    assert classifier.top(1)['ethertype'][0]['octets'] == 214
+
+
+def test_pcap(tmp_path, make_frame, bpf_filter):
+    path = str(tmp_path / 'capture.pcap')
+    write_pcap(path, [(0.0, 1000, make_frame(size=100)), (0.0, 1000, make_frame(0x0800, size=100))])
+
+    received = []
+    port = PcapIOPort(path, lambda f: received.append(bytes(f)), bpf_filter=bpf_filter, snaplen=16)
+    try:
+        port.replay()
+        assert port.statistics()['rx_octets'] == 1000       # Wire length of the capture
+
+    finally:
+        port.close()
+
+    assert [len(f) for f in received] == [16]
+
+
+@pytest.mark.parametrize('port_class, args', [(XdpIOPort, ()), (SharedIOPort, (None,))])
+def test_unsupported(port_class, args):
+    with pytest.raises(ValueError):
+        port_class('eth0', None, *args, snaplen=64)
+
+
+def test_monitor_rejects_xdp(capsys):
+    with pytest.raises(SystemExit):
+        monitor.main(['eth0', '--backend', 'xdp', '--snaplen', '64'])
+    assert '--snaplen' in capsys.readouterr().err
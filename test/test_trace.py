@@ -0,0 +1,112 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Profiling and tracing hooks, rawsocket.trace
+"""
+from rawsocket.ioport import IOPort
+from rawsocket.trace import Histogram, Tracer
+
+SIM = IOPort.BACKEND_SIM
+
+
+def test_histogram_percentiles():
+    histogram = Histogram()
+    assert histogram.snapshot()['p50'] is None
+
+    for value in range(1, 10001):
+        histogram.record(value)
+    histogram.record(-5)                        # Counted as 0
+
+    snapshot = histogram.snapshot()
+    assert snapshot['count'] == len(histogram) == 10001
+    assert snapshot['min'] == 0
+    assert snapshot['max'] == 10000
+    for percent in (50, 90, 99):
+        assert abs(histogram.percentile(percent) - percent * 100) <= percent * 100 * 0.07
+    assert histogram.percentile(100) == 10000
+
+    histogram.record(1 << 60)                   # Beyond MAX_BITS, in the last bucket
+    assert histogram.percentile(100) == 1 << 60
+
+
+def test_histogram_merge():
+    first, second = Histogram(), Histogram()
+    first.record(10)
+    second.record(3)
+    second.record(1000)
+
+    first.merge(second)
+    assert (len(first), first.snapshot()['min'], first.snapshot()['max']) == (3, 3, 1000)
+    first.clear()
+    assert first.snapshot() == Histogram().snapshot()
+
+
+def test_tracer_stages_and_sampling():
+    exported = []
+    tracer = Tracer(sample_rate=2, exporter=exported.append)
+    for _ in range(4):
+        tracer.record('rx', 'eth0', 100, [('recv', 150), ('callback', 400)], {'rawsocket.octets': 60})
+
+    stages = tracer.statistics()['stages']['rx']['eth0']
+    assert stages['recv']['max'] == 50
+    assert stages['callback']['max'] == 250
+    assert list(tracer.histograms('rx', 'eth0')) == [('rx', 'eth0')]
+    assert tracer.histograms('tx') == {}
+
+    assert len(exported) == 2
+    root, recv, callback = exported[0]
+    assert root.name == 'rawsocket.rx' and root.parent_id is None
+    assert root.attributes == {'rawsocket.name': 'eth0', 'rawsocket.octets': 60}
+    assert [recv.name, callback.name] == ['rawsocket.rx.recv', 'rawsocket.rx.callback']
+    assert recv.parent_id == callback.parent_id == root.span_id
+    assert recv.trace_id == root.trace_id
+    assert callback.end_ns - recv.start_ns == 300
+
+    stats = tracer.statistics()
+    assert (stats['traced_operations'], stats['sampled_operations']) == (4, 2)
+    tracer.clear()
+    assert tracer.statistics()['stages'] == {}
+
+
+def test_export_errors():
+    def exporter(spans):
+        raise RuntimeError('exporter failed')
+
+    tracer = Tracer(histograms=False, sample_rate=1, exporter=exporter)
+    tracer.record('tx', 'eth0', 0, [('send', 10)])
+    stats = tracer.statistics()
+    assert stats['export_errors'] == 1
+    assert stats['stages'] == {}
+
+
+def test_sim(io_thread, network, make_frame, wait_for):
+    tracer = Tracer()
+    io_thread.set_tracer(tracer)
+    received = []
+    io_thread.open('sim0', received.append, backend=SIM, network=network)
+    io_thread.open('sim1', None, backend=SIM, network=network)
+
+    for _ in range(3):
+        io_thread.send('sim1', make_frame())
+    assert wait_for(lambda: len(received) == 3)
+
+    stages = tracer.statistics()['stages']
+    assert stages['tx']['sim1']['send']['count'] == 3
+    assert set(stages['rx']['sim0']) >= {'classify', 'callback'}
+    assert 'loop' in stages
+
+    io_thread.set_tracer(None)
+    io_thread.send('sim1', make_frame())
+    assert wait_for(lambda: len(received) == 4)
+    assert tracer.statistics()['stages']['tx']['sim1']['send']['count'] == 3
@@ -0,0 +1,143 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Request/response transactions, rawsocket.transaction
+"""
+from concurrent.futures import TimeoutError, CancelledError
+
+import pytest
+
+from rawsocket.ioport import IOPort
+from rawsocket.transaction import TimerWheel
+
+SIM = IOPort.BACKEND_SIM
+
+
+def test_wheel_expires_in_order():
+    wheel = TimerWheel(resolution=0.01, slot_bits=2, levels=3, now=0.0)
+    for deadline in (0.5, 0.03, 2.0, 0.031, 0.2):
+        wheel.schedule(deadline, deadline)
+    assert len(wheel) == 5
+
+    assert wheel.advance(0.02) == []
+    assert wheel.advance(0.1) == [0.03, 0.031]
+    assert wheel.advance(1.0) == [0.2, 0.5]         # Cascaded down from higher levels
+    assert wheel.advance(10.0) == [2.0]
+    assert len(wheel) == 0
+
+
+def test_wheel_never_expires_early():
+    wheel = TimerWheel(resolution=0.01, now=0.0)
+    wheel.schedule(0.015, 'x')
+    assert wheel.advance(0.019) == []
+    assert wheel.advance(0.02) == ['x']
+
+
+def test_wheel_cancel():
+    wheel = TimerWheel(resolution=0.01, now=0.0)
+    timer = wheel.schedule(0.05, 'x')
+    wheel.schedule(0.05, 'y')
+
+    assert wheel.cancel(timer)
+    assert not wheel.cancel(timer)
+    assert wheel.advance(1.0) == ['y']
+
+
+def test_wheel_beyond_range():
+    wheel = TimerWheel(resolution=0.01, slot_bits=2, levels=2, now=0.0)     # 0.16 s range
+    wheel.schedule(1.0, 'far')
+    assert wheel.advance(0.9) == []
+    assert wheel.advance(1.0) == ['far']
+
+
+@pytest.fixture
+def responder(io_thread, network):
+    """ sim1 answers each 0x88b5 request with a 0x88b6 frame echoing its two key octets """
+    def respond(request):
+        if bytes(request[12:14]) == b'\x88\xb5':
+            io_thread.send('sim1', bytes(request[:12]) + b'\x88\xb6' + bytes(request[14:]))
+
+    def response_key(response):
+        return bytes(response[14:16]) if bytes(response[12:14]) == b'\x88\xb6' else None
+
+    io_thread.open('sim0', None, backend=SIM, network=network, response_key=response_key)
+    io_thread.open('sim1', respond, backend=SIM, network=network)
+    return io_thread
+
+
+def test_request_response(responder, make_frame):
+    futures = [responder.request('sim0', make_frame(payload=bytes([n, 1])), key=bytes([n, 1]))
+               for n in range(8)]
+    responses = [future.result(timeout=5) for future in futures]
+
+    assert [bytes(r)[14] for r in responses] == list(range(8))
+    assert responder.receive('sim0', timeout=0) is None         # Responses are not queued
+
+    stats = responder.transactions.statistics()
+    assert stats['transactions_pending'] == 0
+    assert stats['kinds']['default']['requests'] == 8
+    assert stats['kinds']['default']['responses'] == 8
+
+
+def test_key_function_and_unmatched(responder, make_frame):
+    key = lambda frame: bytes(frame[14:16])
+    future = responder.request('sim0', make_frame(payload=b'\x05\x05'), key=key, kind='probe')
+    assert bytes(future.result(timeout=5))[14:16] == b'\x05\x05'
+
+    responder.transactions.match('sim0', b'\x09\x09', None)         # Nothing pending
+    assert responder.transactions.statistics()['transactions_unmatched'] == 1
+
+
+def test_duplicate_pending_key(io_thread, network, make_frame):
+    io_thread.open('sim0', None, backend=SIM, network=network, response_key=lambda f: None)
+    io_thread.request('sim0', make_frame(), key=1, timeout=5)
+    with pytest.raises(ValueError):
+        io_thread.request('sim0', make_frame(), key=1, timeout=5)
+
+
+def test_request_timeout(io_thread, network, make_frame):
+    io_thread.open('sim0', None, backend=SIM, network=network,
+                   response_key=lambda response: bytes(response[14:16]))
+    io_thread.open('sim1', None, backend=SIM, network=network)
+
+    future = io_thread.request('sim0', make_frame(payload=b'\x07\x07'), key=b'\x07\x07',
+                               timeout=0.1)
+    with pytest.raises(TimeoutError):
+        future.result(timeout=5)
+    assert io_thread.transactions.statistics()['kinds']['default']['timeouts'] == 1
+
+
+def test_close_cancels(io_thread, network, make_frame):
+    io_thread.open('sim0', None, backend=SIM, network=network, response_key=lambda f: None)
+    future = io_thread.request('sim0', make_frame(), key=1, timeout=5)
+
+    io_thread.close('sim0')
+    with pytest.raises(CancelledError):
+        future.result(timeout=5)
+
+
+def test_send_failure(io_thread, network, make_frame):
+    io_thread.open('sim0', None, backend=SIM, network=network, response_key=lambda f: None)
+    io_thread.port('sim0').down()
+
+    future = io_thread.request('sim0', make_frame(), key=1, timeout=5)
+    with pytest.raises(OSError):
+        future.result(timeout=5)
+
+    stats = io_thread.transactions.statistics()
+    assert stats['transactions_pending'] == 0
+    assert stats['kinds']['default']['errors'] == 1
+
+    io_thread.port('sim0').up()
+    assert not io_thread.request('sim0', make_frame(), key=1, timeout=5).done()     # Key released
@@ -0,0 +1,106 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Per-thread transmit sockets, rawsocket.txpool
+"""
+import threading
+
+from rawsocket.txpool import TxSocketPool
+
+
+class _Socket(object):
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def _in_thread(func):
+    thread = threading.Thread(target=func)
+    thread.start()
+    thread.join()
+
+
+def test_sender_per_thread():
+    sockets = []
+
+    def factory():
+        sockets.append(_Socket())
+        return sockets[-1]
+
+    pool = TxSocketPool(factory)
+    sender = pool.sender()
+    assert pool.sender() is sender and sender.socket is sockets[0]
+    sender.frames, sender.octets = 2, 120
+
+    def send():
+        other = pool.sender()
+        other.frames, other.octets, other.errors = 1, 60, 1
+
+    _in_thread(send)
+    assert len(sockets) == 2
+
+    # The exited thread's socket is closed and its counters kept
+    assert pool.statistics() == (3, 180, 1, 1)
+    assert sockets[1].closed and not sockets[0].closed
+
+    seen = []
+    pool.for_each_socket(seen.append)
+    assert seen == [sockets[0]]
+
+    pool.close()
+    assert sockets[0].closed
+    assert pool.statistics() == (3, 180, 1, 0)
+
+    # A closed pool creates no more sockets
+    errors = []
+
+    def send_closed():
+        try:
+            pool.sender()
+        except OSError as _e:
+            errors.append(_e)
+
+    _in_thread(send_closed)
+    assert len(errors) == 1 and len(sockets) == 2
+
+
+def test_counters_only():
+    pool = TxSocketPool(None)
+    sender = pool.sender()
+    assert sender.socket is None
+    sender.frames = 1
+    assert pool.statistics() == (1, 0, 0, 0)
+
+
+def test_veth(veth, io_thread, make_frame, wait_for):
+    received = []
+    io_thread.open(veth[0], None, tx_pool=True)
+    io_thread.open(veth[1], lambda frame: received.append(bytes(frame[:15])))
+
+    def send(n):
+        for _ in range(25):
+            assert io_thread.send(veth[0], make_frame(payload=bytes([n]))) == 60
+
+    threads = [threading.Thread(target=send, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert wait_for(lambda: len([f for f in received if f[12:14] == b'\x88\xb5']) == 100)
+    stats = io_thread.statistics(veth[0])
+    assert (stats['tx_frames'], stats['tx_octets'], stats['tx_errors']) == (100, 6000, 0)
+    assert stats['tx_sockets'] == 0             # The sending threads have exited
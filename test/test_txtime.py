@@ -0,0 +1,96 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Time-based transmit with SO_TXTIME
+"""
+import subprocess
+import time
+
+import pytest
+
+from rawsocket.ioport import IOPort
+from rawsocket.pcapport import PcapIOPort
+from rawsocket.sharedsocket import SharedIOPort
+from rawsocket.simnet import SimIOPort
+from rawsocket.xdp import XdpIOPort
+
+SIM = IOPort.BACKEND_SIM
+
+
+@pytest.mark.parametrize('port_class, args', [(SimIOPort, ()), (XdpIOPort, ()),
+                                              (SharedIOPort, (None,)), (PcapIOPort, ())])
+def test_unsupported(port_class, args):
+    with pytest.raises(ValueError):
+        port_class('eth0', None, *args, txtime=time.CLOCK_MONOTONIC)
+
+
+def test_not_opened_with_txtime(io_thread, network, make_frame):
+    io_thread.open('sim1', None, backend=SIM, network=network)
+    port = io_thread.port('sim1')
+    with pytest.raises(ValueError):
+        port.send_at(make_frame(), 0)
+    with pytest.raises(ValueError):
+        port.txtime_now()
+    assert io_thread.send_at('sim2', make_frame(), 0) == -1        # Not open
+
+
+@pytest.mark.parametrize('tx_pool', [False, True])
+def test_send_at(veth, io_thread, make_frame, wait_for, tx_pool):
+    # Without an ETF or fq qdisc the launch time is ignored and the frame sent at once
+    received = []
+    io_thread.open(veth[0], None, txtime=time.CLOCK_MONOTONIC, tx_pool=tx_pool)
+    io_thread.open(veth[1], lambda frame: received.append(bytes(frame[:15])),
+                   direction=IOPort.DIRECTION_IN)
+    port = io_thread.port(veth[0])
+
+    frame = make_frame(payload=b'\x07')
+    assert io_thread.send_at(veth[0], frame, port.txtime_now()) == 60
+    assert wait_for(lambda: frame[:15] in received)
+    assert io_thread.statistics(veth[0])['tx_frames'] == 1
+
+
+@pytest.fixture
+def fq_qdisc(veth):
+    """ The fq qdisc on veth[0], it releases frames at their CLOCK_MONOTONIC launch time """
+    if subprocess.call(['tc', 'qdisc', 'replace', 'dev', veth[0], 'root', 'fq'],
+                       stderr=subprocess.DEVNULL) != 0:
+        pytest.skip('Needs the fq qdisc')
+    yield veth
+    subprocess.call(['tc', 'qdisc', 'del', 'dev', veth[0], 'root'], stderr=subprocess.DEVNULL)
+
+
+def test_launch_time(fq_qdisc, io_thread, make_frame, wait_for):
+    veth = fq_qdisc
+    arrivals = []
+
+    def received(frame):
+        if bytes(frame[12:15]) in (b'\x88\xb5\x01', b'\x88\xb5\x02', b'\x88\xb5\x03'):
+            arrivals.append((frame[14], time.monotonic()))
+
+    io_thread.open(veth[0], None, txtime=time.CLOCK_MONOTONIC)
+    io_thread.open(veth[1], received, direction=IOPort.DIRECTION_IN)
+    port = io_thread.port(veth[0])
+
+    start = time.monotonic()
+    launch = port.txtime_now() + 300 * 1000000
+    assert io_thread.send_at(veth[0], make_frame(payload=b'\x01'), launch) == 60
+    assert port.send_many_at([make_frame(payload=b'\x02'), make_frame(payload=b'\x03')],
+                             launch + 100 * 1000000, interval=100 * 1000000) == 2
+
+    assert wait_for(lambda: len(arrivals) == 3)
+    assert [n for n, _ in arrivals] == [1, 2, 3]
+    assert all(at - start >= 0.25 + 0.1 * index for index, (_, at) in enumerate(arrivals))
+
+    stats = io_thread.statistics(veth[0])
+    assert (stats['tx_frames'], stats['tx_txtime_missed'], stats['tx_txtime_invalid']) == (3, 0, 0)
@@ -0,0 +1,69 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+io_uring engine of IOThread
+"""
+from threading import Thread
+
+import pytest
+
+from rawsocket.iothread import IOThread
+
+
+@pytest.fixture
+def uring_thread(wait_for):
+    thread = IOThread(engine=IOThread.ENGINE_URING)
+    thread.start()
+    try:
+        if not wait_for(lambda: thread.thread_statistics()['engine'] is not None, timeout=2.0) or \
+                thread.thread_statistics()['engine'] != IOThread.ENGINE_URING:
+            pytest.skip('io_uring not available')
+        yield thread
+
+    finally:
+        thread.stop()
+
+
+def test_receive(veth, uring_thread, bpf_filter, make_frame, wait_for):
+    received = []
+    uring_thread.open(veth[1], received.append, bpf_filter=bpf_filter)
+    uring_thread.open(veth[0], None)
+
+    for n in range(20):
+        assert uring_thread.send(veth[0], make_frame(payload=bytes([n]))) == 60
+
+    assert wait_for(lambda: len(received) == 20)
+    assert [bytes(f)[14] for f in received] == list(range(20))
+    assert uring_thread.thread_statistics()['uring_completions'] > 0
+
+
+def test_send_many_from_threads(veth, uring_thread, bpf_filter, make_frame, wait_for):
+    received = []
+    uring_thread.open(veth[1], received.append, bpf_filter=bpf_filter)
+    uring_thread.open(veth[0], None)
+
+    def sender(n):
+        frames = [make_frame(payload=bytes([n, i])) for i in range(100)]
+        assert uring_thread.send_many(veth[0], frames) == 100
+
+    senders = [Thread(target=sender, args=(n,)) for n in range(4)]
+    for thread in senders:
+        thread.start()
+    for thread in senders:
+        thread.join()
+
+    assert wait_for(lambda: len(received) == 400)
+    assert sorted(bytes(f)[14:16] for f in received) == \
+        sorted(bytes([n, i]) for n in range(4) for i in range(100))
+    assert wait_for(lambda: uring_thread.statistics(veth[0])['tx_frames'] == 400)
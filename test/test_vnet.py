@@ -0,0 +1,135 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+virtio_net_hdr building, GSO preparation and segmentation of super-frames
+"""
+import struct
+from array import array
+
+import pytest
+
+from rawsocket import vnet
+from rawsocket.vnet import VirtioNetHdr, prepare_gso, segments, NO_VNET_HDR, \
+    VIRTIO_NET_HDR_GSO_TCPV4, VIRTIO_NET_HDR_GSO_UDP_L4, VIRTIO_NET_HDR_GSO_NONE
+
+MAC = b'\x02\x00\x00\x00\x00\x02\x02\x00\x00\x00\x00\x01'
+
+
+def _tcp_frame(payload, flags=0x18, vlan=None):
+    tcp = struct.pack('!HHIIBBHHH', 1024, 80, 1000, 0, 0x50, flags, 8192, 0, 0)
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 0, 7, 0, 64, 6, 0,
+                     bytes((10, 0, 0, 1)), bytes((10, 0, 0, 2)))
+    tag = b'' if vlan is None else b'\x81\x00' + struct.pack('!H', vlan)
+    return MAC + tag + b'\x08\x00' + ip + tcp + payload
+
+
+def _udp_frame(payload):
+    udp = struct.pack('!HHHH', 5353, 53, 0, 0)
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 0, 7, 0, 64, 17, 0,
+                     bytes((10, 0, 0, 1)), bytes((10, 0, 0, 2)))
+    return MAC + b'\x08\x00' + ip + udp + payload
+
+
+def _sum(data):
+    if len(data) & 1:
+        data += b'\x00'
+    total = sum(array('H', data))
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return total
+
+
+def _checksums_valid(frame, l3=14):
+    ihl = (frame[l3] & 0x0f) * 4
+    l4 = l3 + ihl
+    pseudo = frame[l3 + 12:l3 + 20] + struct.pack('!BBH', 0, frame[l3 + 9], len(frame) - l4)
+    return _sum(frame[l3:l4]) == 0xffff and _sum(pseudo + frame[l4:]) == 0xffff
+
+
+def test_header():
+    hdr = VirtioNetHdr(1, VIRTIO_NET_HDR_GSO_TCPV4, 54, 1448, 34, 16)
+    assert len(hdr.pack()) == vnet.VNET_HDR_SIZE
+    assert VirtioNetHdr.unpack(hdr.pack()) == hdr
+    assert hdr.is_gso and hdr.needs_csum
+    assert not NO_VNET_HDR.is_gso and not NO_VNET_HDR.needs_csum
+
+    shifted = hdr.shifted(4)
+    assert (shifted.hdr_len, shifted.csum_start) == (58, 38)
+
+
+def test_tcp_gso_round_trip():
+    payload = bytes(range(256)) * 12
+    frame, hdr = prepare_gso(_tcp_frame(payload, flags=0x19), 1000)     # FIN, PSH and ACK
+    assert hdr.gso_type == VIRTIO_NET_HDR_GSO_TCPV4
+    assert (hdr.hdr_len, hdr.gso_size, hdr.csum_start, hdr.csum_offset) == (54, 1000, 34, 16)
+
+    segs = list(segments(frame, hdr))
+    assert [len(seg) - 54 for seg in segs] == [1000, 1000, 1000, 72]
+    assert b''.join(seg[54:] for seg in segs) == payload
+    assert [struct.unpack_from('!I', seg, 38)[0] for seg in segs] == [1000, 2000, 3000, 4000]
+    assert [seg[47] & 0x09 for seg in segs] == [0, 0, 0, 0x09]        # FIN and PSH on the last
+    assert all(_checksums_valid(seg) for seg in segs)
+
+
+def test_udp_checksum_only():
+    frame, hdr = prepare_gso(_udp_frame(b'query'), 1400)
+    assert hdr.gso_type == VIRTIO_NET_HDR_GSO_NONE and hdr.needs_csum
+
+    seg, = segments(frame, hdr)
+    assert seg[42:] == b'query'
+    assert _checksums_valid(seg)
+
+
+def test_udp_gso():
+    frame, hdr = prepare_gso(_udp_frame(bytes(3000)), 1400)
+    assert hdr.gso_type == VIRTIO_NET_HDR_GSO_UDP_L4
+    segs = list(segments(frame, hdr))
+    assert [len(seg) - 42 for seg in segs] == [1400, 1400, 200]
+    assert all(_checksums_valid(seg) for seg in segs)
+
+
+def test_vlan_tagged():
+    frame, hdr = prepare_gso(_tcp_frame(bytes(2000), vlan=10), 1000)
+    assert hdr.csum_start == 38
+    segs = list(segments(frame, hdr))
+    assert len(segs) == 2 and all(_checksums_valid(seg, l3=18) for seg in segs)
+
+
+def test_plain_frames_untouched(make_frame):
+    frame = make_frame()
+    assert list(segments(frame, None)) == [frame]
+    assert list(segments(frame, NO_VNET_HDR)) == [frame]
+
+
+def test_invalid(make_frame):
+    with pytest.raises(ValueError):
+        prepare_gso(make_frame(), 1000)                  # Not IP
+    with pytest.raises(ValueError):
+        prepare_gso(_tcp_frame(bytes(vnet.GSO_MAX_SIZE)), 1000)
+
+
+def test_vnet_hdr_port(veth, io_thread, bpf_filter, make_frame, wait_for):
+    received = []
+    io_thread.open(veth[1], lambda frame, hdr: received.append((bytes(frame), hdr)),
+                   bpf_filter=bpf_filter, vnet_hdr=True)
+    io_thread.open(veth[0], None)
+
+    frame = make_frame()
+    assert io_thread.send(veth[0], frame) == len(frame)
+    with pytest.raises(ValueError):
+        io_thread.send(veth[0], frame, vnet_hdr=NO_VNET_HDR)       # Not opened with vnet_hdr
+
+    assert wait_for(lambda: received)
+    assert received[0][0][:60] == frame
+    assert isinstance(received[0][1], VirtioNetHdr)
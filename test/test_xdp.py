@@ -0,0 +1,39 @@
+# Copyright 2020, Boling Consulting Solutions
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+AF_XDP port options, checked before any socket is opened
+"""
+import mmap
+
+import pytest
+
+from rawsocket import xdp
+from rawsocket.xdp import XdpIOPort
+
+
+@pytest.mark.parametrize('option', [{'tx_pool': True}, {'snaplen': 64}])
+def test_unsupported_options(option):
+    with pytest.raises(ValueError):
+        XdpIOPort('eth0', None, **option)
+
+
+@pytest.mark.parametrize('option', [{'vnet_hdr': True}, {'direction': XdpIOPort.DIRECTION_OUT},
+                                    {'xdp_mode': 'hw'}])
+def test_invalid_options(option):
+    with pytest.raises(AssertionError):
+        XdpIOPort('eth0', None, **option)
+
+
+def test_map_populate():
+    assert xdp._MAP_POPULATE == getattr(mmap, 'MAP_POPULATE', 0)